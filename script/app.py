@@ -4,39 +4,91 @@ import tensorflow as tf
 import numpy as np
 import os
 import cv2
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import io
-import base64
-from tensorflow.keras.preprocessing import image
-from pydicom import dcmread
 from waitress import serve
-from inference_sdk import InferenceHTTPClient
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from batching import MicroBatcher
+from gradcam import GradCamEngine
+from render import render_options, render_comparison, render_overlay, grid_fields, mime_type
+from payloads import payload_response, compress
+from memory_debug import track_memory
+from validators import create_validator, INVALID_MESSAGE
+from result_cache import ResultCache
+from registry import registry
+from metrics import instrument, stage, timed, count_fallback, count_error, count_cache, CollectedMetric
+from volume import (iter_slices, batched, TopK, VolumeTooLarge,
+                    ARCHIVE_EXTENSIONS, VOLUME_BATCH_SIZE, VOLUME_TOP_K)
+from uploads import (configure_app, read_upload, decode_image, file_extension, upload_limit,
+                     UploadTooLarge, IMAGE_EXTENSIONS, DICOM_EXTENSIONS, MAX_BATCH_UPLOAD_BYTES)
+from batch_uploads import batch_files, stream_batch, result_record
+from jobs import JobQueue, JobQueueFull, job_response, job_events
+from brain_mask import brain_mask as compute_brain_mask, brain_masks, gray_uint8
+from buffers import scratch, scaled_uint8
+from preprocessing import (BINARY_IMG_SIZE, DEMENTED_LABEL, interpret_score,
+                           binary_preprocess_image as preprocess_image,
+                           binary_preprocess_dicom as preprocess_dicom,
+                           binary_preprocess_dicom_pixels as preprocess_dicom_pixels)
 
 # Initialize Flask App
 app = Flask(__name__)
 CORS(app)
+configure_app(app)
+# Request/stage latency histograms and GET /metrics
+instrument(app)
+# gzip/br for large responses (COMPRESS_RESPONSES=0 to disable)
+compress(app)
+# MEMORY_DEBUG=1: GET /debug/memory and per-request allocation tracing
+track_memory(app)
 
 # Constants
-IMG_SIZE = 256
+IMG_SIZE = BINARY_IMG_SIZE
 BINARY_MODEL_PATH = os.path.join(os.getcwd(), "binary_epoch50.h5")
 
-# Initialize Roboflow Client for MRI validation
-ROBOFLOW_CLIENT = InferenceHTTPClient(
-    api_url="https://detect.roboflow.com",
-    api_key="Uv31TiRmfGZBE4y9mLLE"
-)
+# Micro-batching knobs: a larger window/batch trades latency for throughput
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 5))
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", 8))
+# "async" serves the same routes behind a bounded admission queue (async_server.py)
+SERVER_MODE = os.environ.get("SERVER_MODE", "waitress").lower()
+GRADCAM_CACHE_SIZE = int(os.environ.get("GRADCAM_CACHE_SIZE", 4))
+# Run dummy predict/Grad-CAM passes before serving so the first request is not slow
+WARMUP = os.environ.get("WARMUP", "1") == "1"
+
+# Result cache for repeat uploads; set RESULT_CACHE_DIR to keep results across restarts
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 64))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR") or None
+
+# Deferred Grad-CAM (defer_gradcam=true on /predict): the prediction is returned
+# straight away with a job ID and the explanation is made by background workers
+GRADCAM_JOB_WORKERS = int(os.environ.get("GRADCAM_JOB_WORKERS", 1))
+GRADCAM_JOB_QUEUE = int(os.environ.get("GRADCAM_JOB_QUEUE", 32))
+GRADCAM_JOB_TTL_SECONDS = float(os.environ.get("GRADCAM_JOB_TTL_SECONDS", 300))
+# Longest long-poll (?wait=) and server-sent-events stream per request. Both hold
+# a server thread, so at most GRADCAM_JOB_MAX_WAITERS run at once (others get 503)
+# and the rest of SERVER_THREADS stay free for predictions.
+GRADCAM_JOB_MAX_WAIT = float(os.environ.get("GRADCAM_JOB_MAX_WAIT", 10))
+GRADCAM_JOB_STREAM_SECONDS = float(os.environ.get("GRADCAM_JOB_STREAM_SECONDS", 30))
+GRADCAM_JOB_MAX_WAITERS = int(os.environ.get("GRADCAM_JOB_MAX_WAITERS", 2))
+
+# MRI validator (MRI_VALIDATOR=remote|heuristic|keras), cached by upload hash.
+# Validation runs alongside preprocessing and inference.
+mri_validator = create_validator()
+VALIDATION_WORKERS = int(os.environ.get("VALIDATION_WORKERS", 4))
+validation_executor = ThreadPoolExecutor(max_workers=VALIDATION_WORKERS, thread_name_prefix="validate")
+CollectedMetric("neurofind_validation_cache_total", "MRI validation cache lookups", "counter", ("service", "outcome"),
+                lambda: [(("binary", outcome), mri_validator.stats()[field])
+                         for outcome, field in (("hit", "hits"), ("miss", "misses"))])
 
 # Load
-def load_model():
+def load_model(path=BINARY_MODEL_PATH):
     try:
-        return tf.keras.models.load_model(BINARY_MODEL_PATH, compile=False)
+        return tf.keras.models.load_model(path, compile=False)
     except Exception as e:
         print(f"Error loading model: {e}")
-        return create_custom_model()
+        return create_custom_model(path)
 
-def create_custom_model():
+def create_custom_model(path=BINARY_MODEL_PATH):
     """Fallback model creation if loading fails"""
     print("Creating a custom model as fallback...")
     inputs = tf.keras.layers.Input(shape=(IMG_SIZE, IMG_SIZE, 3))
@@ -56,7 +108,7 @@ def create_custom_model():
     model = tf.keras.Model(inputs=inputs, outputs=outputs)
     
     try:
-        model.load_weights(BINARY_MODEL_PATH)
+        model.load_weights(path)
         print("Successfully loaded weights into the custom model.")
     except Exception as weight_error:
         print(f"Error loading weights: {weight_error}")
@@ -64,350 +116,682 @@ def create_custom_model():
     
     return model
 
-# Load the model
-binary_model = load_model()
+# Load the model (once per process, shared with server.py)
+binary_served = registry.load("binary", BINARY_MODEL_PATH, load_model, input_size=IMG_SIZE)
+binary_model = binary_served.model
+# Cached results are only reused for the same model file and backend
+BINARY_MODEL_VERSION = f"{binary_served.version}:{binary_served.backend}"
 
-# Image processing functions
-def preprocess_image(img_path):
-    """Process JPEG/PNG images"""
-    try:
-        img = image.load_img(img_path, target_size=(IMG_SIZE, IMG_SIZE))
-        img_array = image.img_to_array(img) / 255.0
-        original_img = np.array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        return img_array, original_img
-    except Exception as e:
-        print(f"Error preprocessing image: {e}")
-        return None, None
-
-def preprocess_dicom(dicom_path):
-    """Process DICOM images"""
-    try:
-        dicom_data = dcmread(dicom_path)
-        pixel_array = dicom_data.pixel_array
-        
-        img_resized = cv2.resize(pixel_array, (IMG_SIZE, IMG_SIZE))
-        img_normalized = img_resized / 255.0 if img_resized.max() > 1.0 else img_resized
-        original_img = img_normalized.copy()
-        
-        # Convert grayscale to RGB if needed
-        if len(img_normalized.shape) == 2:
-            img_normalized = np.stack([img_normalized] * 3, axis=-1)
-            
-        img_reshaped = np.expand_dims(img_normalized, axis=0)
-        return img_reshaped, original_img
-    except Exception as e:
-        print(f"Error processing DICOM file: {e}")
-        return None, None
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_SIZE,
+    disk_dir=os.path.join(RESULT_CACHE_DIR, "binary") if RESULT_CACHE_DIR else None,
+)
 
-def validate_mri(file_path):
-    """Validate if the uploaded file is an MRI image"""
+@timed("binary", "validate")
+def validate_mri(image_bgr, content_key=None):
+    """Validate if the uploaded image is an MRI image"""
     try:
-        result = ROBOFLOW_CLIENT.infer(file_path, model_id="noisy-data/2")
-        if "predictions" in result and len(result["predictions"]) > 0:
-            return True, "Valid MRI image"
-        else:
-            return False, "The uploaded image does not appear to be an MRI scan"
+        return mri_validator.validate(image_bgr, content_key)
     except Exception as e:
         print(f"Error during MRI validation: {e}")
+        count_error("binary", "validate")
         return False, f"Error validating image: {str(e)}"
 
 # Grad-CAM visualization
-def create_visualization(heatmap, original_img):
-    """Create visualization with original image and heatmap overlay"""
+@timed("binary", "visualization")
+def create_visualization(heatmap, original_img, options=None, brain_mask=None):
+    """Create visualization with original image and heatmap overlay
+
+    brain_mask: the image's opened brain mask when already computed (batch paths)
+    
+    Intermediates are 8-bit and live in this thread's scratch buffers.
+    """
     try:
-        # Format original image
-        if len(original_img.shape) == 2:
-            original_img = cv2.cvtColor(np.float32(original_img), cv2.COLOR_GRAY2RGB)
-        elif len(original_img.shape) == 3 and original_img.shape[2] == 1:
-            original_img = cv2.cvtColor(np.float32(original_img.squeeze()), cv2.COLOR_GRAY2RGB)
-        
-        if original_img.max() <= 1.0:
-            original_img = (original_img * 255).astype(np.uint8)
-        else:
-            original_img = original_img.astype(np.uint8)
+        if options is None:
+            options = render_options()
         
-        original_img = cv2.resize(original_img, (IMG_SIZE, IMG_SIZE))
-        heatmap = cv2.resize(heatmap, (original_img.shape[1], original_img.shape[0]))
+        # 8-bit RGB original: [0, 1] floats are scaled, grayscale is converted last
+        if len(original_img.shape) == 3 and original_img.shape[2] == 1:
+            original_img = original_img[:, :, 0]
+        if original_img.dtype != np.uint8:
+            if original_img.max() <= 1.0:
+                original_img = scaled_uint8(original_img, "visualization.original")
+            else:
+                original_img = original_img.astype(np.uint8)
+        if len(original_img.shape) == 2:
+            original_img = cv2.cvtColor(original_img, cv2.COLOR_GRAY2RGB,
+                                        dst=scratch("visualization.rgb", original_img.shape + (3,), np.uint8))
         
-        # Create brain mask
-        original_gray = cv2.cvtColor(original_img, cv2.COLOR_BGR2GRAY)
-        _, brain_mask = cv2.threshold(original_gray, 15, 255, cv2.THRESH_BINARY)
+        if original_img.shape[:2] != (IMG_SIZE, IMG_SIZE):
+            original_img = cv2.resize(original_img, (IMG_SIZE, IMG_SIZE))
+        if heatmap.shape[:2] != original_img.shape[:2]:
+            heatmap = cv2.resize(heatmap, (original_img.shape[1], original_img.shape[0]))
         
-        # Clean up mask
-        kernel = np.ones((5, 5), np.uint8)
-        brain_mask = cv2.morphologyEx(brain_mask, cv2.MORPH_CLOSE, kernel)
-        brain_mask = cv2.morphologyEx(brain_mask, cv2.MORPH_OPEN, kernel)
-        brain_mask_3ch = cv2.cvtColor(brain_mask, cv2.COLOR_GRAY2BGR)
+        # Brain mask, unless the caller computed it with the rest of its batch
+        if brain_mask is None or brain_mask.shape != original_img.shape[:2]:
+            brain_mask = compute_brain_mask(original_img, opened=True)
         
         # Apply mask to heatmap
-        masked_heatmap = cv2.bitwise_and(heatmap, brain_mask_3ch)
+        masked_heatmap = scratch("visualization.masked", heatmap.shape, np.uint8)
+        masked_heatmap.fill(0)
+        cv2.bitwise_and(heatmap, heatmap, dst=masked_heatmap, mask=brain_mask)
         
         # Convert to RGB
-        original_rgb = cv2.cvtColor(original_img, cv2.COLOR_BGR2RGB)
-        masked_heatmap_rgb = cv2.cvtColor(masked_heatmap, cv2.COLOR_BGR2RGB)
+        original_rgb = cv2.cvtColor(original_img, cv2.COLOR_BGR2RGB,
+                                    dst=scratch("visualization.original_rgb", original_img.shape, np.uint8))
+        cv2.cvtColor(masked_heatmap, cv2.COLOR_BGR2RGB, dst=masked_heatmap)
         
         # Create blended image
-        superimposed_img = cv2.addWeighted(original_rgb, 0.7, masked_heatmap_rgb, 0.5, 0)
-        
-        # Create figure with subplots
-        plt.figure(figsize=(10, 5), dpi=100)
-        plt.subplot(1, 2, 1)
-        plt.imshow(original_rgb)
-        plt.axis('off')
-        plt.subplot(1, 2, 2)
-        plt.imshow(superimposed_img)
-        plt.axis('off')
-        plt.subplots_adjust(wspace=0.01, hspace=0)
-        
-        # Convert to base64
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0)
-        plt.close('all')  # Close figures to prevent memory
-        buf.seek(0)
-        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-        
-        return img_str
+        superimposed_img = cv2.addWeighted(original_rgb, 0.7, masked_heatmap, 0.5, 0,
+                                           dst=scratch("visualization.overlay", original_rgb.shape, np.uint8))
+        
+        # Overlay alone (also for grid requests that fell back to an image)
+        if options.get("heatmap", "panel") != "panel":
+            return render_overlay(superimposed_img, options)
+        # Side-by-side composite, encoded without a plotting backend
+        return render_comparison(original_rgb, superimposed_img, options)
     except Exception as e:
         print(f"Error creating visualization: {e}")
+        count_error("binary", "visualization")
         return None
 
-def generate_gradcam(model, preprocessed_img, original_img, layer_name=None):
-    """Generate Grad-CAM visualization for the input image"""
+def find_gradcam_layer(model):
+    """Pick the last convolutional layer of the model for Grad-CAM"""
+    layer_name = None
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.Conv2D) or 'conv' in layer.name.lower():
+            layer_name = layer.name
+
+    if layer_name is None:
+        # Fallback if no conv layer found
+        for i in range(len(model.layers) - 2, 0, -1):
+            output_shape = getattr(model.layers[i], 'output_shape', None)
+            if output_shape and len(output_shape) == 4:
+                layer_name = model.layers[i].name
+                break
+    return layer_name
+
+def random_heatmap(height=16, width=16):
+    """Colored random heatmap used when no gradients are available"""
+    heatmap = np.random.rand(height, width)
+    heatmap = np.uint8(255 * heatmap)
+    heatmap = cv2.resize(heatmap, (IMG_SIZE, IMG_SIZE))
+    return cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
+
+def heatmap_from_cam(cam):
+    """Turn a raw Grad-CAM map into a blurred, thresholded color heatmap.
+
+    The result is a scratch buffer of this thread, valid until its next call.
+    """
+    heatmap = np.maximum(cam, 0, dtype=np.float32)
+    heatmap -= heatmap.min()
+    heatmap /= heatmap.max() + 1e-10
+    resized = cv2.resize(heatmap, (IMG_SIZE, IMG_SIZE),
+                         dst=scratch("heatmap.resized", (IMG_SIZE, IMG_SIZE), np.float32))
+    cv2.GaussianBlur(resized, (9, 9), 0, dst=resized)
+    resized -= resized.min()
+    resized /= resized.max() + 1e-10
+    resized[resized < 0.3] = 0
+    return cv2.applyColorMap(scaled_uint8(resized, "heatmap.8bit"), cv2.COLORMAP_JET,
+                             dst=scratch("heatmap.colored", (IMG_SIZE, IMG_SIZE, 3), np.uint8))
+
+@timed("binary", "gradcam")
+def render_gradcam(engine, preprocessed_img, original_img, layer_name=None, options=None, brain_mask=None):
+    """Grad-CAM visualization for the input image and the fallback used instead
+    of Grad-CAM, if any (None when the visualization is a real Grad-CAM map)"""
     try:
-        # Find appropriate layer if not specified
+        # Use the layer resolved at model load if not specified
         if layer_name is None:
-            for i, layer in enumerate(model.layers):
-                if isinstance(layer, tf.keras.layers.Conv2D) or 'conv' in layer.name.lower():
-                    layer_name = layer.name
-                    
-            if layer_name is None:
-                # Fallback if no conv layer found
-                for i in range(len(model.layers) - 2, 0, -1):
-                    output_shape = getattr(model.layers[i], 'output_shape', None)
-                    if output_shape and len(output_shape) == 4:
-                        layer_name = model.layers[i].name
-                        break
+            layer_name = engine.default_layer
         
         # create fallback visualization
         if layer_name is None:
             print("Creating a fallback heatmap")
-            heatmap = np.random.rand(16, 16)
-            heatmap = np.uint8(255 * heatmap)
-            heatmap = cv2.resize(heatmap, (IMG_SIZE, IMG_SIZE))
-            heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-            return create_visualization(heatmap, original_img)
+            count_fallback("binary", "random_no_layer")
+            return create_visualization(random_heatmap(), original_img, options, brain_mask), "random_no_layer"
         
-        # Create Grad-CAM model
+        # Create (or reuse the cached) Grad-CAM model
         try:
-            grad_layer = model.get_layer(layer_name)
-            grad_model = tf.keras.models.Model(
-                inputs=[model.inputs],
-                outputs=[grad_layer.output, model.output]
-            )
+            output_height, output_width = engine.layer_output_shape(layer_name)
         except Exception as layer_error:
             print(f"Error creating Grad-CAM model: {layer_error}")
+            count_fallback("binary", "sobel_saliency")
             # Fallback to saliency map
-            if len(original_img.shape) == 3 and original_img.shape[2] == 3:
-                gray_img = cv2.cvtColor(original_img.astype(np.float32), cv2.COLOR_RGB2GRAY)
-            else:
-                gray_img = original_img.squeeze()
-                
-            sobelx = cv2.Sobel(gray_img, cv2.CV_64F, 1, 0, ksize=3)
-            sobely = cv2.Sobel(gray_img, cv2.CV_64F, 0, 1, ksize=3)
-            magnitude = np.sqrt(sobelx**2 + sobely**2)
-            magnitude = 255 * magnitude / np.max(magnitude)
+            gray_img = gray_uint8(original_img)
+            sobelx = cv2.Sobel(gray_img, cv2.CV_32F, 1, 0, ksize=3)
+            sobely = cv2.Sobel(gray_img, cv2.CV_32F, 0, 1, ksize=3)
+            magnitude = cv2.magnitude(sobelx, sobely)
+            magnitude *= 255 / max(float(magnitude.max()), 1e-10)
             heatmap = magnitude.astype(np.uint8)
             heatmap = cv2.resize(heatmap, (IMG_SIZE, IMG_SIZE))
             heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-            return create_visualization(heatmap, original_img)
-        
-        with tf.GradientTape() as tape:
-            preprocessed_tensor = tf.convert_to_tensor(preprocessed_img, dtype=tf.float32)
-            conv_outputs, predictions = grad_model(preprocessed_tensor)
-            loss = predictions[0]  # Binary classification
+            return create_visualization(heatmap, original_img, options, brain_mask), "sobel_saliency"
         
         # Get gradients
         try:
-            grads = tape.gradient(loss, conv_outputs)
-            if grads is None:
+            _, cams = engine.explain(preprocessed_img, class_indices=[0], layer_name=layer_name)
+            if cams is None:
                 # Fallback for gradient issues
                 print("Gradients are None, using random heatmap")
-                output_shape = conv_outputs.shape.as_list()
-                heatmap = np.random.rand(output_shape[1], output_shape[2])
-                heatmap = np.uint8(255 * heatmap)
-                heatmap = cv2.resize(heatmap, (IMG_SIZE, IMG_SIZE))
-                heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-                return create_visualization(heatmap, original_img)
+                count_fallback("binary", "random_no_gradients")
+                return create_visualization(random_heatmap(output_height, output_width), original_img, options, brain_mask), "random_no_gradients"
         except Exception as grad_error:
             print(f"Error computing gradients: {grad_error}")
+            count_fallback("binary", "random_gradient_error")
             # Random heatmap fallback
-            heatmap = np.random.rand(16, 16)
-            heatmap = np.uint8(255 * heatmap)
-            heatmap = cv2.resize(heatmap, (IMG_SIZE, IMG_SIZE))
-            heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-            return create_visualization(heatmap, original_img)
-        
-        # Process gradients
-        grads = grads.numpy()
-        conv_outputs = conv_outputs.numpy()
-        pooled_grads = np.mean(grads, axis=(0, 1, 2))
-        
-        # Generate heatmap
-        heatmap = np.zeros(conv_outputs.shape[1:3], dtype=np.float32)
-        for i, w in enumerate(pooled_grads):
-            heatmap += w * conv_outputs[0, :, :, i]
-        
-        # Process heatmap
-        heatmap = np.maximum(heatmap, 0)
-        heatmap = (heatmap - heatmap.min()) / (heatmap.max() - heatmap.min() + 1e-10)
-        heatmap = cv2.resize(heatmap, (IMG_SIZE, IMG_SIZE))
-        heatmap = cv2.GaussianBlur(heatmap, (9, 9), 0)
-        heatmap = (heatmap - heatmap.min()) / (heatmap.max() - heatmap.min() + 1e-10)
-        heatmap[heatmap < 0.3] = 0
-        heatmap = np.uint8(255 * heatmap)
-        heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-        
-        return create_visualization(heatmap, original_img)
+            return create_visualization(random_heatmap(), original_img, options, brain_mask), "random_gradient_error"
+        
+        return create_visualization(heatmap_from_cam(cams[0]), original_img, options, brain_mask), None
     except Exception as e:
-        print(f"Error in generate_gradcam: {e}")
+        print(f"Error in render_gradcam: {e}")
         
         # Final fallback
+        count_fallback("binary", "canny_edges")
         try:
-            if len(original_img.shape) == 3 and original_img.shape[2] == 3:
-                gray = cv2.cvtColor((original_img * 255).astype(np.uint8), cv2.COLOR_RGB2GRAY)
-            else:
-                gray = (original_img * 255).astype(np.uint8)
-                
-            edges = cv2.Canny(gray, 100, 200)
+            edges = cv2.Canny(gray_uint8(original_img), 100, 200)
             edges_colored = cv2.applyColorMap(edges, cv2.COLORMAP_JET)
-            return create_visualization(edges_colored, original_img)
+            return create_visualization(edges_colored, original_img, options, brain_mask), "canny_edges"
         except:
-            return None
+            return None, "canny_edges"
+
+def generate_gradcam(engine, preprocessed_img, original_img, layer_name=None, options=None, brain_mask=None):
+    """Generate Grad-CAM visualization for the input image"""
+    return render_gradcam(engine, preprocessed_img, original_img, layer_name, options, brain_mask)[0]
+
+# Grad-CAM engine: target layer resolved once, compiled steps cached per layer
+binary_gradcam = GradCamEngine(
+    binary_model,
+    default_layer=find_gradcam_layer(binary_model),
+    max_cached_layers=GRADCAM_CACHE_SIZE,
+)
+
+def run_binary_batch(batch):
+    """Scores and Grad-CAM maps for a batch from a single Keras forward pass.
+
+    The Grad-CAM pass already produces the scores, so the TFLite backend is
+    only used on prediction-only paths (binary_served.predict).
+    """
+    class_indices = np.zeros(len(batch), dtype=np.int32)
+    try:
+        return binary_gradcam.explain(batch, class_indices=class_indices)
+    except Exception as e:
+        print(f"Error in fused Grad-CAM step, predicting without it: {e}")
+        count_error("binary", "gradcam")
+        return binary_served.predict(batch), None
+
+def gradcam_fields(cam, preprocessed_img, original_img, options, layer_name=None, brain_mask=None):
+    """Explanation fields of a response in the requested heatmap format.
+
+    cam: the image's Grad-CAM map if the forward pass already produced one.
+    Grid requests fall back to an overlay image when no map can be computed.
+    """
+    if options["heatmap"] == "grid":
+        if cam is None:
+            try:
+                _, cams = binary_gradcam.explain(preprocessed_img, class_indices=[0], layer_name=layer_name)
+                cam = cams[0] if cams is not None else None
+            except Exception as e:
+                print(f"Error computing Grad-CAM grid: {e}")
+                count_error("binary", "gradcam")
+        if cam is not None:
+            return grid_fields(cam, options)
+    
+    if cam is not None:
+        visualization, fallback = create_visualization(heatmap_from_cam(cam), original_img, options, brain_mask), None
+    else:
+        visualization, fallback = render_gradcam(binary_gradcam, preprocessed_img, original_img, layer_name, options, brain_mask)
+    if fallback is None and options["heatmap"] == "grid":
+        fallback = "grid_unavailable"
+    fields = {"gradcam_visualization": visualization or None, "gradcam_mime_type": mime_type(options)}
+    if fallback is not None:
+        # The heatmap is a stand-in, not Grad-CAM: clients can tell, and it is never cached
+        fields["gradcam_fallback"] = fallback
+    return fields
+
+def has_explanation(fields):
+    return bool(fields.get("gradcam_visualization") or fields.get("gradcam_grid"))
+
+def cacheable_explanation(fields):
+    """Only real Grad-CAM results go to the result cache, not fallback heatmaps"""
+    return has_explanation(fields) and "gradcam_fallback" not in fields
+
+# Concurrent /predict requests share one model call per batch
+binary_scheduler = MicroBatcher(
+    run_binary_batch,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    name="binary",
+)
+binary_served.gradcam = binary_gradcam
+binary_served.scheduler = binary_scheduler
+
+# Prediction without Grad-CAM for deferred requests
+binary_predict_scheduler = MicroBatcher(
+    binary_served.predict,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    name="binary-predict",
+)
+
+# Deferred Grad-CAM jobs start only once no classification batch is running or waiting
+gradcam_jobs = JobQueue(
+    workers=GRADCAM_JOB_WORKERS,
+    max_queue=GRADCAM_JOB_QUEUE,
+    ttl_seconds=GRADCAM_JOB_TTL_SECONDS,
+    max_waiters=GRADCAM_JOB_MAX_WAITERS,
+    busy=lambda: binary_scheduler.busy() or binary_predict_scheduler.busy(),
+    name="gradcam",
+)
+CollectedMetric("neurofind_gradcam_jobs", "Deferred Grad-CAM jobs by status", "gauge", ("status",),
+                lambda: [((status,), gradcam_jobs.stats()[status]) for status in ("queued", "running", "finished")])
+
+def run_gradcam_job(key, response, preprocessed_img, original_img, options):
+    """Explanation fields for a deferred /predict; real Grad-CAM results are cached"""
+    explanation = gradcam_fields(None, preprocessed_img, original_img, options)
+    if not has_explanation(explanation):
+        raise RuntimeError("Could not generate visualization")
+    if cacheable_explanation(explanation):
+        result_cache.put(key, dict(response, **explanation))
+    return explanation
+
+warmup_state = {"done": False, "seconds": None}
+
+def is_ready():
+    return warmup_state["done"] or not WARMUP
+
+def warmup():
+    """Exercise predict, Grad-CAM and rendering once with a blank image"""
+    started = time.perf_counter()
+    try:
+        dummy = np.zeros((1, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+        original = np.zeros((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8)
+        
+        # Fused predict + Grad-CAM step used by /predict, then the /gradcam path
+        _, cam = binary_scheduler(dummy)
+        binary_predict_scheduler(dummy)
+        if cam is not None:
+            create_visualization(heatmap_from_cam(cam[0]), original)
+        generate_gradcam(binary_gradcam, dummy, original)
+        
+        # Every padded batch shape (volume, batch and prediction-only requests)
+        binary_served.warmup_predict(VOLUME_BATCH_SIZE)
+    except Exception as e:
+        print(f"Error during warm-up: {e}")
+    warmup_state["done"] = True
+    warmup_state["seconds"] = round(time.perf_counter() - started, 3)
+    print(f"Binary model warm-up took {warmup_state['seconds']} s")
 
-# Helper function to handle file processing
-def process_upload_file():
-    """Process uploaded file and return preprocessed data"""
+# Helper functions to handle file processing
+def read_upload_file():
+    """Read the uploaded file into memory"""
     if "file" not in request.files:
-        return None, None, None, "No file uploaded", 400
+        return None, None, "No file uploaded", 400
     
     file = request.files["file"]
     if file.filename == "":
-        return None, None, None, "No selected file", 400
+        return None, None, "No selected file", 400
 
-    # Save uploaded file 
-    file_ext = os.path.splitext(file.filename)[-1].lower()
-    file_path = os.path.join(os.getcwd(), "temp_" + file.filename)
-    file.save(file_path)
-    
-    if file_ext not in [".jpg", ".jpeg", ".png", ".dcm"]:
-        os.remove(file_path)
-        return None, None, None, "Unsupported file format. Please upload a JPG, PNG, or DICOM file.", 400
+    file_ext = file_extension(file.filename)
+    if file_ext not in IMAGE_EXTENSIONS + DICOM_EXTENSIONS:
+        return None, None, "Unsupported file format. Please upload a JPG, PNG, or DICOM file.", 400
     
-    # Validate MRI for image files
-    if file_ext in [".jpg", ".jpeg", ".png"]:
-        is_mri, message = validate_mri(file_path)
-        if not is_mri:
-            os.remove(file_path)
-            return None, None, None, message, 400
-    
-    # Process file based on type
-    if file_ext in [".jpg", ".jpeg", ".png"]:
-        preprocessed_img, original_img = preprocess_image(file_path)
+    try:
+        with stage("binary", "read_upload"):
+            return read_upload(file), file_ext, None, 200
+    except UploadTooLarge as e:
+        return None, None, str(e), 413
+
+def process_upload(data, file_ext):
+    """Preprocess uploaded bytes, starting MRI validation in the background.
+
+    Returns the preprocessed arrays and a future for the validation result
+    (None for DICOM); callers check it with validation_error() before
+    responding.
+    """
+    validation = None
+    if file_ext in IMAGE_EXTENSIONS:
+        with stage("binary", "decode"):
+            image_bgr = decode_image(data)
+        if image_bgr is None:
+            # Not a decodable JPEG/PNG despite the extension: a bad upload, not a server error
+            return None, None, None, INVALID_MESSAGE, 400
+        
+        # Validate MRI for image files while preprocessing and inference run
+        content_key = hashlib.sha256(data).hexdigest()
+        validation = validation_executor.submit(validate_mri, image_bgr, content_key)
+        
+        with stage("binary", "preprocess"):
+            preprocessed_img, original_img = preprocess_image(image_bgr)
     else:  # DICOM file
-        preprocessed_img, original_img = preprocess_dicom(file_path)
+        with stage("binary", "preprocess"):
+            preprocessed_img, original_img = preprocess_dicom(data)
     
     if preprocessed_img is None or original_img is None:
-        os.remove(file_path)
         return None, None, None, "Error processing image", 500
     
-    return file_path, preprocessed_img, original_img, None, 200
+    return preprocessed_img, original_img, validation, None, 200
+
+def validation_error(validation):
+    """Error message if background MRI validation rejected the image"""
+    if validation is None:
+        return None
+    with stage("binary", "validate_wait"):
+        is_mri, message = validation.result()
+    return None if is_mri else message
+
+def cache_key(data, endpoint, options):
+    """Key for an upload's result under the current model and request options"""
+    return ResultCache.make_key(data, BINARY_MODEL_VERSION, dict(options, endpoint=endpoint))
 
 # API Endpoints
 @app.route("/predict", methods=["POST"])
 def predict():
     """Main prediction endpoint"""
-    file_path = None
     try:
-        file_path, preprocessed_img, original_img, error, status_code = process_upload_file()
+        data, file_ext, error, status_code = read_upload_file()
         if error:
             return jsonify({"error": error}), status_code
         
-        # Make prediction
-        prediction = binary_model.predict(preprocessed_img)
-        pred_value = float(prediction[0][0] if len(prediction.shape) > 1 and prediction.shape[1] > 0 else prediction[0])
-        predicted_label = "VAD-Demented" if pred_value > 0.5 else "Non-Demented"
-        confidence = pred_value * 100 if pred_value > 0.5 else (1 - pred_value) * 100
+        options = render_options(request.form)
+        defer = request.form.get("defer_gradcam", "false").lower() in ("1", "true", "yes")
+        key = cache_key(data, "predict", options)
+        cached = result_cache.get(key)
+        count_cache("binary", "result", cached is not None)
+        if cached is not None:
+            return payload_response(cached, 200, {"X-Cache": "hit"})
+        
+        preprocessed_img, original_img, validation, error, status_code = process_upload(data, file_ext)
+        if error:
+            return jsonify({"error": error}), status_code
+        
+        # Make prediction and Grad-CAM from the same forward pass (prediction only if deferred)
+        with stage("binary", "inference"):
+            if defer:
+                prediction, cam = binary_predict_scheduler(preprocessed_img), None
+            else:
+                prediction, cam = binary_scheduler(preprocessed_img)
         
-        # Generate Grad-CAM
-        gradcam_base64 = generate_gradcam(binary_model, preprocessed_img, original_img)
+        # Discard the result if the image is not an MRI scan
+        error = validation_error(validation)
+        if error:
+            return jsonify({"error": error}), 400
+        pred_value = float(prediction[0][0] if len(prediction.shape) > 1 and prediction.shape[1] > 0 else prediction[0])
+        predicted_label, confidence = interpret_score(pred_value)
         
         # Prepare response
         response = {
             "prediction": predicted_label, 
             "confidence": round(float(confidence), 2),
             "raw_score": pred_value,
-            "is_valid_mri": True,
-            "gradcam_visualization": gradcam_base64 or None
+            "is_valid_mri": True
         }
         
-        if not gradcam_base64:
+        if defer:
+            try:
+                job_id = gradcam_jobs.submit(run_gradcam_job, key, dict(response), preprocessed_img, original_img, options)
+                response["gradcam_job"] = job_id
+                response["gradcam_job_url"] = f"/gradcam_jobs/{job_id}"
+                return payload_response(response, 200, {"X-Cache": "miss"})
+            except JobQueueFull:
+                # Explain inline rather than drop the explanation
+                count_fallback("binary", "gradcam_job_queue_full")
+        
+        # Grad-CAM in the requested heatmap format
+        explanation = gradcam_fields(cam[0] if cam is not None else None, preprocessed_img, original_img, options)
+        response.update(explanation)
+        
+        if not has_explanation(explanation):
             response["gradcam_error"] = "Could not generate visualization"
+        elif cacheable_explanation(explanation):
+            result_cache.put(key, response)
         
-        return jsonify(response)
+        return payload_response(response, 200, {"X-Cache": "miss"})
     
     except Exception as e:
         print(f"Error during prediction: {str(e)}")
         import traceback
         traceback.print_exc()  # Print full stack trace for debugging
         return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
-    finally:
-        # Clean up
-        if file_path and os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception as cleanup_error:
-                print(f"Error cleaning up file: {cleanup_error}")
-        
-        plt.close('all')
 
 @app.route("/gradcam", methods=["POST"])
 def get_gradcam():
     """Endpoint to get Grad-CAM visualization only"""
-    file_path = None
     try:
         layer_name = request.form.get("layer_name", None)
-        file_path, preprocessed_img, original_img, error, status_code = process_upload_file()
+        options = render_options(request.form)
+        data, file_ext, error, status_code = read_upload_file()
+        if error:
+            return jsonify({"error": error}), status_code
         
+        key = cache_key(data, "gradcam", dict(options, layer_name=layer_name))
+        cached = result_cache.get(key)
+        count_cache("binary", "result", cached is not None)
+        if cached is not None:
+            return payload_response(cached, 200, {"X-Cache": "hit"})
+        
+        preprocessed_img, original_img, validation, error, status_code = process_upload(data, file_ext)
         if error:
             return jsonify({"error": error}), status_code
         
-        # Generate Grad-CAM
-        gradcam_base64 = generate_gradcam(binary_model, preprocessed_img, original_img, layer_name)
+        # Generate Grad-CAM while validation runs
+        response = gradcam_fields(None, preprocessed_img, original_img, options, layer_name)
+        
+        # Discard the result if the image is not an MRI scan
+        error = validation_error(validation)
+        if error:
+            return jsonify({"error": error}), 400
         
-        if gradcam_base64 is None:
+        if not has_explanation(response):
             return jsonify({
                 "error": "Failed to generate Grad-CAM visualization",
                 "gradcam_visualization": None
             }), 500
-            
-        return jsonify({"gradcam_visualization": gradcam_base64})
+        
+        if cacheable_explanation(response):
+            result_cache.put(key, response)
+        return payload_response(response, 200, {"X-Cache": "miss"})
     
     except Exception as e:
         print(f"Error generating Grad-CAM: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": f"Grad-CAM generation failed: {str(e)}"}), 500
-    finally:
-        # Clean up
-        if file_path and os.path.exists(file_path):
+
+@app.route("/gradcam_jobs/<job_id>", methods=["GET"])
+def get_gradcam_job(job_id):
+    """Deferred Grad-CAM result; ?wait=N long-polls up to N seconds"""
+    try:
+        wait = min(max(0.0, float(request.args.get("wait", 0))), GRADCAM_JOB_MAX_WAIT)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    return job_response(gradcam_jobs, job_id, wait)
+
+@app.route("/gradcam_jobs/<job_id>/events", methods=["GET"])
+def gradcam_job_events(job_id):
+    """Server-sent events for a deferred Grad-CAM job"""
+    # The async front end buffers whole responses, so events would only arrive at the end
+    if SERVER_MODE == "async":
+        return jsonify({"error": "Event streams are not available with SERVER_MODE=async, "
+                                 "use GET /gradcam_jobs/<job_id>?wait=N"}), 501
+    return job_events(gradcam_jobs, job_id, max_seconds=GRADCAM_JOB_STREAM_SECONDS)
+
+@app.route("/gradcam_jobs/<job_id>", methods=["DELETE"])
+def discard_gradcam_job(job_id):
+    if not gradcam_jobs.discard(job_id):
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify({"job_id": job_id, "status": "discarded"})
+
+@app.route("/predict_volume", methods=["POST"])
+def predict_volume():
+    """Score every slice of a multi-frame DICOM or a zipped DICOM series"""
+    try:
+        if "file" not in request.files:
+            return jsonify({"error": "No file uploaded"}), 400
+        
+        file = request.files["file"]
+        if file_extension(file.filename) not in DICOM_EXTENSIONS + ARCHIVE_EXTENSIONS:
+            return jsonify({"error": "Please upload a DICOM file or a ZIP archive of a DICOM series."}), 400
+        
+        try:
+            data = read_upload(file)
+        except UploadTooLarge as e:
+            return jsonify({"error": str(e)}), 413
+        
+        top_k = max(0, int(request.form.get("top_k", VOLUME_TOP_K)))
+        options = render_options(request.form)
+        
+        # Slices are decoded as they are needed and scored in batches; only
+        # the top-k candidates for Grad-CAM are kept in memory
+        slice_results = []
+        top_slices = TopK(top_k)
+        for batch in batched(iter_slices(data, file.filename), VOLUME_BATCH_SIZE):
+            infos, inputs, originals = [], [], []
+            for info, pixels, scan in batch:
+                preprocessed_img, original_img = preprocess_dicom_pixels(pixels, scan)
+                if preprocessed_img is None:
+                    slice_results.append(dict(info, error="Error processing slice"))
+                    continue
+                infos.append(info)
+                inputs.append(preprocessed_img)
+                originals.append(original_img)
+            if not inputs:
+                continue
+            
+            with stage("binary", "inference"):
+                predictions = binary_served.predict(np.concatenate(inputs))
+            for info, preprocessed_img, original_img, prediction in zip(infos, inputs, originals, predictions):
+                pred_value = float(np.ravel(prediction)[0])
+                slice_results.append(dict(
+                    info,
+                    prediction=interpret_score(pred_value)[0],
+                    raw_score=pred_value
+                ))
+                top_slices.push(pred_value, (info["slice"], preprocessed_img, original_img))
+        
+        scores = np.array([r["raw_score"] for r in slice_results if "raw_score" in r])
+        if len(scores) == 0:
+            return jsonify({"error": "No readable DICOM slices found"}), 400
+        
+        # Volume-level aggregate
+        mean_score = float(scores.mean())
+        volume_label, volume_confidence = interpret_score(mean_score)
+        demented_slices = sum(1 for r in slice_results if r.get("prediction") == DEMENTED_LABEL)
+        volume = {
+            "prediction": volume_label,
+            "confidence": round(volume_confidence, 2),
+            "mean_score": mean_score,
+            "max_score": float(scores.max()),
+            "demented_slice_fraction": round(demented_slices / len(scores), 4),
+            "slices": len(scores)
+        }
+        
+        # Grad-CAM only for the most VAD-like slices, as one batch
+        gradcams = []
+        candidates = top_slices.items()
+        if candidates:
+            batch = np.concatenate([preprocessed_img for _, preprocessed_img, _ in candidates])
             try:
-                os.remove(file_path)
-            except Exception as cleanup_error:
-                print(f"Error cleaning up file: {cleanup_error}")
+                _, cams = binary_gradcam.explain(batch, class_indices=np.zeros(len(batch), dtype=np.int32))
+            except Exception as e:
+                print(f"Error generating volume Grad-CAM: {e}")
+                count_error("binary", "gradcam")
+                cams = None
+            masks = brain_masks([original_img for _, _, original_img in candidates], opened=True)
+            for i, (slice_index, preprocessed_img, original_img) in enumerate(candidates):
+                explanation = gradcam_fields(cams[i] if cams is not None else None, preprocessed_img, original_img,
+                                             options, brain_mask=masks[i])
+                explanation.pop("gradcam_mime_type", None)
+                gradcams.append({"slice": slice_index, **explanation})
         
-        # Make sure all matplotlib figures are closed
-        plt.close('all')
+        return jsonify({
+            "volume": volume,
+            "slices": slice_results,
+            "top_slices": gradcams,
+            "gradcam_mime_type": mime_type(options)
+        })
+    
+    except VolumeTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except Exception as e:
+        print(f"Error during volume prediction: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Volume prediction failed: {str(e)}"}), 500
+
+def score_batch(items, heatmaps=False, options=None):
+    """Results for a batch of uploads from one model call (and one Grad-CAM pass if requested)"""
+    records, ready = [], []
+    for item in items:
+        if "error" in item:
+            records.append(result_record(item, error=item["error"]))
+            continue
+        try:
+            preprocessed_img, original_img, validation, error, _ = process_upload(
+                item["data"], file_extension(item["filename"]))
+        except Exception as e:
+            error = f"Error processing image: {str(e)}"
+        if error:
+            records.append(result_record(item, error=error))
+            continue
+        ready.append((item, preprocessed_img, original_img, validation))
+    if not ready:
+        return records
+    
+    batch = np.concatenate([preprocessed_img for _, preprocessed_img, _, _ in ready])
+    with stage("binary", "inference"):
+        if heatmaps:
+            predictions, cams = run_binary_batch(batch)
+        else:
+            predictions, cams = binary_served.predict(batch), None
+    
+    # Brain masks for the heatmap panels in one pass over the batch
+    masks = brain_masks([original_img for _, _, original_img, _ in ready], opened=True) if heatmaps else None
+    for i, (item, preprocessed_img, original_img, validation) in enumerate(ready):
+        # Skip images that are not MRI scans
+        error = validation_error(validation)
+        if error:
+            records.append(result_record(item, error=error))
+            continue
+        pred_value = float(np.ravel(predictions[i])[0])
+        predicted_label, confidence = interpret_score(pred_value)
+        fields = {"prediction": predicted_label, "confidence": round(float(confidence), 2), "raw_score": pred_value}
+        if heatmaps:
+            fields.update(gradcam_fields(cams[i] if cams is not None else None, preprocessed_img, original_img,
+                                         options, brain_mask=masks[i]))
+            if not has_explanation(fields):
+                fields["gradcam_error"] = "Could not generate visualization"
+        records.append(result_record(item, **fields))
+    return records
+
+@app.route("/predict_batch", methods=["POST"])
+@upload_limit(MAX_BATCH_UPLOAD_BYTES)
+def predict_batch():
+    """Score many images/DICOMs (or zip archives of them), streaming one NDJSON line per file"""
+    files = batch_files()
+    if not files:
+        return jsonify({"error": "No file uploaded"}), 400
+    
+    # Grad-CAM is opt-in so large batches only pay for inference
+    heatmaps = request.form.get("heatmaps", "false").lower() in ("1", "true", "yes")
+    options = render_options(request.form)
+    return stream_batch(files, lambda items: score_batch(items, heatmaps, options))
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    """Request body exceeded MAX_CONTENT_LENGTH while streaming"""
+    return jsonify({"error": "Uploaded file is too large"}), 413
+
+@app.route("/health/live", methods=["GET"])
+def liveness():
+    """The process is up and handling requests"""
+    return jsonify({"status": "alive"})
+
+@app.route("/health/ready", methods=["GET"])
+def readiness():
+    """Model loaded and warmed up; only then should traffic be routed here"""
+    if not is_ready():
+        return jsonify({"status": "warming up"}), 503
+    return jsonify({"status": "ready", "warmup_seconds": warmup_state["seconds"]})
 
 @app.route("/health", methods=["GET"])
 def health_check():
@@ -415,7 +799,14 @@ def health_check():
     return jsonify({
         "status": "healthy", 
         "model": "Binary Model (epoch50)", 
-        "xai": "Grad-CAM available"
+        "backend": binary_served.backend,
+        "xai": "Grad-CAM available",
+        "batching": binary_scheduler.stats(),
+        "prediction_batching": binary_predict_scheduler.stats(),
+        "gradcam_jobs": gradcam_jobs.stats(),
+        "gradcam_layers": binary_gradcam.cached_layers(),
+        "result_cache": result_cache.stats(),
+        "validator": mri_validator.stats()
     })
 
 # Run Flask App
@@ -423,4 +814,11 @@ if __name__ == "__main__":
     print(f"Model loaded from: {BINARY_MODEL_PATH}")
     print(f"Expected input shape: {binary_model.input_shape}")
     print("Flask API is running on http://127.0.0.1:5000")
-    serve(app, host="127.0.0.1", port=5000)
\ No newline at end of file
+    print(f"Micro-batching: up to {BATCH_MAX_SIZE} images per batch, {BATCH_MAX_WAIT_MS} ms window")
+    if WARMUP:
+        warmup()
+    if SERVER_MODE == "async":
+        from async_server import serve_async
+        serve_async(app, host="127.0.0.1", port=5000)
+    else:
+        serve(app, host="127.0.0.1", port=5000, threads=SERVER_THREADS)
\ No newline at end of file
@@ -0,0 +1,216 @@
+import os
+import math
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from werkzeug.test import EnvironBuilder
+
+from uploads import MAX_UPLOAD_BYTES, MAX_BATCH_UPLOAD_BYTES
+
+ASYNC_MAX_CONCURRENCY = int(os.environ.get("ASYNC_MAX_CONCURRENCY", 4))
+ASYNC_MAX_QUEUE = int(os.environ.get("ASYNC_MAX_QUEUE", 16))
+ASYNC_QUEUE_TIMEOUT = float(os.environ.get("ASYNC_QUEUE_TIMEOUT", 10))
+# Largest body buffered on the event loop; the Flask app enforces the per-endpoint limits
+ASYNC_MAX_BODY_BYTES = max(MAX_UPLOAD_BYTES, MAX_BATCH_UPLOAD_BYTES) + 64 * 1024
+
+# Routes answered on the event loop, without waiting for admission
+ADMISSION_STATS_PATH = "/health/admission"
+
+
+class AdmissionController:
+    """Bounded admission for handler calls.
+
+    At most `max_concurrency` requests run at once and at most `max_queue`
+    wait for a slot (including while their bodies are read); anything beyond
+    that is rejected straight away instead of piling up behind slow requests.
+    """
+
+    def __init__(self, max_concurrency=ASYNC_MAX_CONCURRENCY, max_queue=ASYNC_MAX_QUEUE,
+                 queue_timeout=ASYNC_QUEUE_TIMEOUT):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.completed = 0
+        # Moving average of handler time, used for Retry-After
+        self.avg_service_s = 0.0
+
+    def reserve(self):
+        """Take a place in the queue before the request body is read;
+        returns None if queued, else the rejection reason"""
+        if self.active >= self.max_concurrency and self.waiting >= self.max_queue:
+            self.rejected += 1
+            return "queue full"
+        self.waiting += 1
+        return None
+
+    def cancel(self):
+        """Give up a reserved queue place without waiting for a slot"""
+        self.waiting -= 1
+
+    async def acquire(self):
+        """Wait for a slot after reserve(); returns None once admitted, else the rejection reason"""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            return "queue timeout"
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        self.admitted += 1
+        return None
+
+    def release(self, service_s):
+        self.active -= 1
+        self.completed += 1
+        if self.completed == 1:
+            self.avg_service_s = service_s
+        else:
+            self.avg_service_s = 0.9 * self.avg_service_s + 0.1 * service_s
+        self._slots.release()
+
+    def retry_after(self):
+        """Seconds until the current backlog should have drained"""
+        backlog = self.waiting + self.active
+        estimate = backlog * self.avg_service_s / self.max_concurrency
+        return max(1, math.ceil(estimate))
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout_s": self.queue_timeout,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_service_ms": round(self.avg_service_s * 1000, 2),
+        }
+
+
+def call_wsgi(wsgi_app, method, url, headers, body, remote_addr=None):
+    """Run a WSGI app on a fully buffered request and return (status, headers, body)"""
+    builder = EnvironBuilder(
+        method=method,
+        base_url=f"{url.scheme}://{url.host}:{url.port}" if url.port else f"{url.scheme}://{url.host}",
+        path=url.raw_path,
+        query_string=url.raw_query_string,
+        headers=[(key, value) for key, value in headers.items() if key.lower() not in ("host", "content-length")],
+        data=body,
+        environ_base={"REMOTE_ADDR": remote_addr or ""},
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+
+    response = {}
+    chunks = []
+
+    def start_response(status, response_headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = response_headers
+        return chunks.append
+
+    result = wsgi_app(environ, start_response)
+    try:
+        for chunk in result:
+            chunks.append(chunk)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response["status"], response["headers"], b"".join(chunks)
+
+
+def overloaded_response(admission, reason):
+    return web.json_response(
+        {"error": f"Server is busy ({reason}), please retry"},
+        status=503,
+        headers={"Retry-After": str(admission.retry_after()),
+                 "Access-Control-Allow-Origin": "*"},
+    )
+
+
+def create_async_app(wsgi_app, max_concurrency=ASYNC_MAX_CONCURRENCY, max_queue=ASYNC_MAX_QUEUE,
+                     queue_timeout=ASYNC_QUEUE_TIMEOUT, max_body_bytes=ASYNC_MAX_BODY_BYTES):
+    """aiohttp front end serving the routes of a Flask app.
+
+    Request bodies are read on the event loop once the request has a place
+    in the admission queue, so slow uploads do not hold a worker thread and
+    rejected requests are not buffered; decoding, inference and rendering
+    run in the handler on a thread pool sized to the admission limit.
+    """
+    admission = AdmissionController(max_concurrency, max_queue, queue_timeout)
+    executor = ThreadPoolExecutor(max_workers=admission.max_concurrency, thread_name_prefix="handler")
+
+    async def admission_stats(request):
+        return web.json_response(admission.stats())
+
+    async def handle(request):
+        # Answered without reading the body, so the connection cannot be reused
+        if request.content_length is not None and request.content_length > max_body_bytes:
+            response = web.json_response({"error": "Request body too large"}, status=413,
+                                         headers={"Access-Control-Allow-Origin": "*"})
+            response.force_close()
+            return response
+
+        rejection = admission.reserve()
+        if rejection:
+            response = overloaded_response(admission, rejection)
+            response.force_close()
+            return response
+        try:
+            # Bodies without a Content-Length are still cut off by aiohttp while reading (413)
+            body = await request.read()
+        except BaseException:
+            # Failed read or client gone: free the queue place
+            admission.cancel()
+            raise
+
+        rejection = await admission.acquire()
+        if rejection:
+            return overloaded_response(admission, rejection)
+
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(executor, call_wsgi, wsgi_app, request.method, request.url,
+                                      request.headers, body, request.remote)
+        # The slot is held until the handler thread finishes, even if the
+        # client disconnects and this coroutine is cancelled
+        future.add_done_callback(lambda _: admission.release(time.perf_counter() - started))
+        status, headers, payload = await asyncio.shield(future)
+
+        response = web.Response(status=status, body=payload)
+        for key, value in headers:
+            if key.lower() not in ("content-length", "transfer-encoding", "connection"):
+                response.headers.add(key, value)
+        return response
+
+    app = web.Application(client_max_size=max_body_bytes)
+    app["admission"] = admission
+    app.router.add_get(ADMISSION_STATS_PATH, admission_stats)
+    app.router.add_route("*", "/{tail:.*}", handle)
+
+    async def shutdown_executor(app):
+        executor.shutdown(wait=False)
+    app.on_cleanup.append(shutdown_executor)
+    return app
+
+
+def serve_async(wsgi_app, host="127.0.0.1", port=5000, **options):
+    app = create_async_app(wsgi_app, **options)
+    admission = app["admission"]
+    print(f"Async server: {admission.max_concurrency} concurrent requests, "
+          f"{admission.max_queue} queued, {admission.queue_timeout:g} s queue timeout")
+    web.run_app(app, host=host, port=port, print=None)
@@ -0,0 +1,107 @@
+import os
+import io
+import json
+import zipfile
+
+from flask import Response, request, stream_with_context
+
+from uploads import (read_upload, file_extension, UploadTooLarge, MAX_UPLOAD_BYTES, MAX_BATCH_UPLOAD_BYTES,
+                     IMAGE_EXTENSIONS, DICOM_EXTENSIONS)
+from volume import ARCHIVE_EXTENSIONS, batched
+
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", 1000))
+# Scans per model call on the batch endpoints
+BATCH_INFERENCE_SIZE = int(os.environ.get("BATCH_INFERENCE_SIZE", 16))
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+class BatchTooLarge(Exception):
+    pass
+
+
+def iter_archive(data, archive_name):
+    """Yield (filename, bytes, error) for the image/DICOM members of a zip"""
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for info in sorted(archive.infolist(), key=lambda i: i.filename):
+            if info.is_dir() or os.path.basename(info.filename).startswith("."):
+                continue
+            if file_extension(info.filename) not in IMAGE_EXTENSIONS + DICOM_EXTENSIONS:
+                continue
+            name = f"{archive_name}/{info.filename}"
+            # Checked before inflating so a small archive cannot expand without bound
+            if info.file_size > MAX_UPLOAD_BYTES:
+                yield name, None, "File exceeds the upload limit"
+                continue
+            yield name, archive.read(info), None
+
+
+def iter_batch_uploads(files, max_files=BATCH_MAX_FILES):
+    """Yield {"index", "filename", "data"} (or "error") for each uploaded file or zip member"""
+    index = 0
+    for file in files:
+        file_ext = file_extension(file.filename)
+        try:
+            data = read_upload(file, MAX_BATCH_UPLOAD_BYTES if file_ext in ARCHIVE_EXTENSIONS else MAX_UPLOAD_BYTES)
+        except UploadTooLarge as e:
+            entries = [(file.filename, None, str(e))]
+        else:
+            if file_ext in ARCHIVE_EXTENSIONS:
+                if zipfile.is_zipfile(io.BytesIO(data)):
+                    entries = iter_archive(data, file.filename)
+                else:
+                    entries = [(file.filename, None, "Unreadable ZIP archive")]
+            elif file_ext in IMAGE_EXTENSIONS + DICOM_EXTENSIONS:
+                entries = [(file.filename, data, None)]
+            else:
+                entries = [(file.filename, None, "Unsupported file format. Please upload JPG, PNG, DICOM or ZIP files.")]
+
+        for filename, entry_data, error in entries:
+            if index >= max_files:
+                raise BatchTooLarge(f"Batch has more than {max_files} files")
+            item = {"index": index, "filename": filename}
+            if error:
+                item["error"] = error
+            else:
+                item["data"] = entry_data
+            yield item
+            index += 1
+
+
+def batch_files():
+    """Uploaded files of a batch request (repeated `file` or `files` fields)"""
+    return request.files.getlist("file") + request.files.getlist("files")
+
+
+def ndjson(record):
+    return json.dumps(record) + "\n"
+
+
+def result_record(item, **fields):
+    """Result for one file, without its bytes"""
+    return dict({"index": item["index"], "filename": item["filename"]}, **fields)
+
+
+def stream_batch(files, score_batch, batch_size=BATCH_INFERENCE_SIZE):
+    """NDJSON response: one line per file as its batch finishes, then a summary line.
+
+    `score_batch(items)` returns the records for a list of upload items;
+    if it raises, every file of that batch gets an error record.
+    """
+    def generate():
+        counts = {"files": 0, "succeeded": 0, "failed": 0}
+        try:
+            for items in batched(iter_batch_uploads(files), batch_size):
+                try:
+                    records = list(score_batch(items))
+                except Exception as e:
+                    print(f"Error in batch prediction: {e}")
+                    records = [result_record(item, error=f"Prediction failed: {str(e)}") for item in items]
+                for record in records:
+                    counts["files"] += 1
+                    counts["failed" if "error" in record else "succeeded"] += 1
+                    yield ndjson(record)
+        except BatchTooLarge as e:
+            yield ndjson({"error": str(e)})
+        yield ndjson({"summary": counts})
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
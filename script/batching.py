@@ -0,0 +1,153 @@
+import threading
+import time
+import queue
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Collect concurrent inference requests and run them as one batch.
+
+    Each submitted item is an array with a leading batch axis (usually 1).
+    Items that arrive within `max_wait_ms` of the first queued item are
+    concatenated, up to `max_batch_size` rows, passed to `batch_fn` in a
+    single call and the output rows are handed back to each caller.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=5.0, name="model"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes = {}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        self._closed = False
+        self._running = False
+
+        self._worker = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, inputs):
+        """Queue `inputs` for the next batch and return a Future for its rows"""
+        if self._closed:
+            raise RuntimeError(f"{self.name} batcher is closed")
+        inputs = np.asarray(inputs)
+        future = Future()
+        self._queue.put((inputs, future, time.perf_counter()))
+        return future
+
+    def __call__(self, inputs, timeout=None):
+        """Blocking helper: submit and wait for the result"""
+        return self.submit(inputs).result(timeout=timeout)
+
+    def pending(self):
+        """Number of requests waiting for a batch slot"""
+        return self._queue.qsize()
+
+    def busy(self):
+        """True while a batch runs or requests are waiting for one"""
+        return self._running or not self._queue.empty()
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+
+    def stats(self):
+        with self._stats_lock:
+            batches = self._batches
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": batches,
+                "items": self._items,
+                "pending": self.pending(),
+                "avg_batch_size": round(self._items / batches, 3) if batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "avg_wait_ms": round(1000.0 * self._wait_total / self._items, 3) if self._items else 0.0,
+                "max_wait_ms_observed": round(1000.0 * self._wait_max, 3),
+                "avg_batch_run_ms": round(1000.0 * self._run_total / batches, 3) if batches else 0.0,
+            }
+
+    # Worker loop
+    def _collect(self):
+        """Block for the first request, then gather more until the window closes"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        rows = len(first[0])
+        deadline = first[2] + self.max_wait
+
+        while rows < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish the current batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            started = time.perf_counter()
+            futures = [future for _, future, _ in batch if future.set_running_or_notify_cancel()]
+            batch = [entry for entry in batch if not entry[1].cancelled()]
+            if not batch:
+                continue
+
+            self._running = True
+            try:
+                inputs = np.concatenate([inputs for inputs, _, _ in batch], axis=0)
+                outputs = self.batch_fn(inputs)
+            except Exception as e:
+                print(f"Error running {self.name} batch: {e}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            finally:
+                self._running = False
+
+            finished = time.perf_counter()
+            offset = 0
+            for inputs, future, _ in batch:
+                count = len(inputs)
+                future.set_result(_slice_rows(outputs, offset, offset + count))
+                offset += count
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._batch_sizes[offset] = self._batch_sizes.get(offset, 0) + 1
+                self._run_total += finished - started
+                for _, _, queued_at in batch:
+                    waited = started - queued_at
+                    self._wait_total += waited
+                    self._wait_max = max(self._wait_max, waited)
+
+
+def _slice_rows(outputs, start, stop):
+    """Slice an array, or each array in a tuple/list, along the batch axis"""
+    if outputs is None:
+        return None
+    if isinstance(outputs, (list, tuple)):
+        return type(outputs)(_slice_rows(o, start, stop) for o in outputs)
+    if isinstance(outputs, dict):
+        return {k: _slice_rows(v, start, stop) for k, v in outputs.items()}
+    return outputs[start:stop]
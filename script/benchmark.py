@@ -0,0 +1,395 @@
+# Load tests and micro-benchmarks on synthetic MRI/DICOM inputs.
+#
+#     python benchmark.py load --spawn server --concurrency 1 4 8 --out load.json
+#     python benchmark.py load --url http://127.0.0.1:5000 --endpoints predict gradcam
+#     python benchmark.py micro --out micro.json
+#     python benchmark.py compare baseline.json load.json --threshold 10
+#     python benchmark.py inputs ./synthetic
+#
+# --spawn starts startup.py with the stub MRI validator (no Roboflow calls) in
+# --models-dir, writing placeholder models there if the .h5 files are missing.
+# Results are JSON; `compare` reports percentage changes against an earlier run
+# and exits with status 1 if any p95 got slower than --threshold percent.
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import itertools
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from synthetic import INPUT_FORMATS, brain_slice, encode_input, write_inputs, ensure_models
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# name: (method, path, form fields)
+ENDPOINTS = {
+    "predict": ("POST", "/predict", {}),
+    "gradcam": ("POST", "/gradcam", {}),
+    "subclass_predict": ("POST", "/subclass_predict", {}),
+    "gradcam_heatmap": ("GET", None, {}),
+}
+# Endpoints served by each startup.py target
+TARGET_ENDPOINTS = {
+    "server": tuple(ENDPOINTS),
+    "app": ("predict", "gradcam"),
+    "subclass": ("subclass_predict", "gradcam_heatmap"),
+}
+TARGET_PORTS = {"server": 5000, "app": 5000, "subclass": 5001}
+
+
+def summarize(latencies_ms):
+    if not latencies_ms:
+        return {"count": 0}
+    values = np.asarray(latencies_ms)
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 2),
+        "min_ms": round(float(values.min()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+    }
+
+
+def run_metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    settings = ("INFERENCE_BACKEND", "TFLITE_MODE", "SERVER_MODE", "SERVER_THREADS", "BATCH_MAX_SIZE",
+                "BATCH_MAX_WAIT_MS", "MRI_VALIDATOR", "MRI_VALIDATOR_STUB_MS", "WORKERS")
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "settings": {name: os.environ[name] for name in settings if name in os.environ},
+        "args": {key: value for key, value in vars(args).items() if key != "func"},
+    }
+
+
+def write_results(results, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {path}")
+
+
+# Load tests
+def input_pool(count, sizes, formats, seed):
+    """`count` distinct uploads cycling through sizes and formats (no result-cache hits)"""
+    combinations = list(itertools.product(sizes, formats))
+    uploads = []
+    for index in range(count):
+        size, fmt = combinations[index % len(combinations)]
+        ext, data = encode_input(brain_slice(size, seed=seed + index), fmt)
+        uploads.append((f"bench_{seed + index}_{size}.{ext}", data))
+    return uploads
+
+
+def start_server(target, port, models_dir):
+    ensure_models(models_dir)
+    env = dict(os.environ, SERVER_PORT=str(port))
+    env.setdefault("MRI_VALIDATOR", "stub")
+    return subprocess.Popen([sys.executable, os.path.join(SCRIPT_DIR, "startup.py"), target],
+                            cwd=models_dir, env=env)
+
+
+def wait_ready(session, url, timeout=600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if session.get(f"{url}/health/ready", timeout=5).status_code == 200:
+                return True
+        except Exception:
+            pass
+        time.sleep(1)
+    return False
+
+
+def heatmap_urls(session, url, uploads):
+    """Heatmap URLs from unmeasured /subclass_predict calls, for the GET benchmark"""
+    urls = []
+    for filename, data in uploads:
+        response = session.post(f"{url}/subclass_predict", files={"file": (filename, data)})
+        if response.status_code == 200 and response.json().get("heatmap_url"):
+            urls.append(url + response.json()["heatmap_url"])
+    return urls
+
+
+def drive(url, endpoint, concurrency, uploads, heatmaps):
+    """Send len(uploads) requests from `concurrency` threads; latency summary and counts"""
+    import requests
+
+    method, path, fields = ENDPOINTS[endpoint]
+    total = len(uploads)
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies = []
+    statuses = {}
+    cache_hits = 0
+
+    def client():
+        nonlocal cache_hits
+        session = requests.Session()
+        while True:
+            index = next(counter)
+            if index >= total:
+                return
+            started = time.perf_counter()
+            try:
+                if method == "GET":
+                    response = session.get(heatmaps[index % len(heatmaps)], timeout=300)
+                else:
+                    filename, data = uploads[index]
+                    response = session.post(url + path, files={"file": (filename, data)}, data=fields, timeout=300)
+                status = response.status_code
+                hit = response.headers.get("X-Cache") == "hit"
+            except requests.RequestException:
+                status, hit = "error", False
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 200:
+                    latencies.append(elapsed_ms)
+                    cache_hits += hit
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(client)
+    wall_seconds = time.perf_counter() - started
+
+    result = summarize(latencies)
+    result.update({
+        "concurrency": concurrency,
+        "requests": total,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds > 0 else None,
+        "statuses": statuses,
+        "cache_hits": cache_hits,
+    })
+    return result
+
+
+def load_command(args):
+    import requests
+
+    process = None
+    url = args.url
+    endpoints = args.endpoints
+    if args.spawn:
+        port = args.port or TARGET_PORTS[args.spawn]
+        url = f"http://127.0.0.1:{port}"
+        endpoints = [name for name in endpoints if name in TARGET_ENDPOINTS[args.spawn]]
+        process = start_server(args.spawn, port, os.path.abspath(args.models_dir))
+    url = url.rstrip("/")
+
+    session = requests.Session()
+    results = {"meta": run_metadata(args), "load": {}}
+    try:
+        if not wait_ready(session, url):
+            print(f"Error: {url} did not become ready")
+            sys.exit(1)
+        results["meta"]["health"] = session.get(f"{url}/health").json()
+
+        seed = args.seed
+        for endpoint in endpoints:
+            heatmaps = None
+            if endpoint == "gradcam_heatmap":
+                heatmaps = heatmap_urls(session, url, input_pool(8, args.sizes, args.formats, seed))
+                seed += 8
+                if not heatmaps:
+                    print("Error: no heatmaps available for the gradcam_heatmap benchmark")
+                    continue
+
+            # Warm-up requests are not measured
+            drive(url, endpoint, 1, input_pool(args.warmup, args.sizes, args.formats, seed), heatmaps)
+            seed += args.warmup
+
+            results["load"][endpoint] = {}
+            for concurrency in args.concurrency:
+                count = args.requests
+                if args.cached:
+                    uploads = (input_pool(4, args.sizes, args.formats, args.seed) * count)[:count]
+                else:
+                    uploads = input_pool(count, args.sizes, args.formats, seed)
+                    seed += count
+                result = drive(url, endpoint, concurrency, uploads, heatmaps)
+                results["load"][endpoint][str(concurrency)] = result
+                print(f"{endpoint:<18} c={concurrency:<3} {result.get('throughput_rps')!s:>8} req/s  "
+                      f"p50 {result.get('p50_ms')!s:>8}  p95 {result.get('p95_ms')!s:>8}  "
+                      f"p99 {result.get('p99_ms')!s:>8} ms  {result['statuses']}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    if args.out:
+        write_results(results, args.out)
+
+
+# Micro-benchmarks
+def time_function(function, repeat, warmup=2):
+    for _ in range(warmup):
+        function()
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return summarize(latencies)
+
+
+def micro_cases(sizes):
+    """(name, callable) pairs; imports the services, so models are loaded here"""
+    import app
+    from render import render_options
+
+    options = render_options()
+    cases = []
+    for size in sizes:
+        gray = brain_slice(size, seed=size)
+        for fmt in INPUT_FORMATS:
+            if fmt.startswith("dcm"):
+                _, data = encode_input(gray, fmt)
+                cases.append((f"preprocess_dicom/{fmt}/{size}", lambda data=data: app.preprocess_dicom(data)))
+
+    preprocessed_img, original_img = app.preprocess_dicom(encode_input(brain_slice(256), "dcm16")[1])
+    # heatmap_from_cam returns a scratch buffer that generate_gradcam reuses
+    heatmap = app.heatmap_from_cam(np.random.default_rng(0).random((16, 16), dtype=np.float32)).copy()
+    cases.append(("generate_gradcam", lambda: app.generate_gradcam(
+        app.binary_gradcam, preprocessed_img, original_img, options=options)))
+    cases.append(("create_visualization", lambda: app.create_visualization(heatmap, original_img, options)))
+    return cases
+
+
+def micro_command(args):
+    models_dir = os.path.abspath(args.models_dir)
+    ensure_models(models_dir)
+    # The services resolve model paths from the working directory
+    os.chdir(models_dir)
+    os.environ.setdefault("MRI_VALIDATOR", "stub")
+
+    results = {"meta": run_metadata(args), "micro": {}}
+    for name, function in micro_cases(args.sizes):
+        result = time_function(function, args.repeat)
+        results["micro"][name] = result
+        print(f"{name:<28} p50 {result['p50_ms']:>9} ms  p95 {result['p95_ms']:>9} ms  p99 {result['p99_ms']:>9} ms")
+
+    if args.out:
+        write_results(results, args.out)
+
+
+# Comparison
+def flatten(results):
+    """{"load/predict/c=4": summary, "micro/generate_gradcam": summary}"""
+    rows = {}
+    for endpoint, levels in results.get("load", {}).items():
+        for concurrency, summary in levels.items():
+            rows[f"load/{endpoint}/c={concurrency}"] = summary
+    for name, summary in results.get("micro", {}).items():
+        rows[f"micro/{name}"] = summary
+    return rows
+
+
+def change(old, new):
+    if old is None or new is None or old == 0:
+        return None
+    return round((new - old) / old * 100, 1)
+
+
+def compare_command(args):
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = flatten(json.load(f))
+    with open(args.current, encoding="utf-8") as f:
+        current = flatten(json.load(f))
+
+    regressions = []
+    print(f"{'benchmark':<40}{'p50 ms':>18}{'p95 ms':>18}{'p99 ms':>18}{'req/s':>16}")
+    for key in sorted(set(baseline) & set(current)):
+        old, new = baseline[key], current[key]
+        cells = []
+        for field in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            delta = change(old.get(field), new.get(field))
+            cells.append(f"{new.get(field)!s} ({'' if delta is None else f'{delta:+}%'})")
+        print(f"{key:<40}" + "".join(f"{cell:>18}" for cell in cells[:3]) + f"{cells[3]:>16}")
+        delta = change(old.get("p95_ms"), new.get("p95_ms"))
+        if delta is not None and delta > args.threshold:
+            regressions.append((key, delta))
+
+    for key in sorted(set(baseline) ^ set(current)):
+        print(f"{key:<40} only in {'baseline' if key in baseline else 'current'}")
+    if regressions:
+        print(f"\n{len(regressions)} p95 regression(s) over {args.threshold}%:")
+        for key, delta in regressions:
+            print(f"  {key}: {delta:+}%")
+        sys.exit(1)
+
+
+def inputs_command(args):
+    filenames = write_inputs(args.directory, sizes=args.sizes, formats=args.formats, per_combination=args.count)
+    print(f"Wrote {len(filenames)} synthetic inputs to {args.directory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the prediction services")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("load", help="drive the HTTP endpoints at fixed concurrency levels")
+    load.add_argument("--url", default="http://127.0.0.1:5000")
+    load.add_argument("--spawn", choices=TARGET_ENDPOINTS, help="start this startup.py target first")
+    load.add_argument("--port", type=int)
+    load.add_argument("--models-dir", default=".")
+    load.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS))
+    load.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 8])
+    load.add_argument("--requests", type=int, default=40, help="requests per endpoint and concurrency level")
+    load.add_argument("--warmup", type=int, default=2)
+    load.add_argument("--cached", action="store_true", help="repeat a few uploads (result-cache hits)")
+    load.add_argument("--sizes", nargs="+", type=int, default=[256, 512])
+    load.add_argument("--formats", nargs="+", default=list(INPUT_FORMATS))
+    load.add_argument("--seed", type=int, default=0)
+    load.add_argument("--out")
+    load.set_defaults(func=load_command)
+
+    micro = commands.add_parser("micro", help="time preprocessing and Grad-CAM functions in-process")
+    micro.add_argument("--models-dir", default=".")
+    micro.add_argument("--sizes", nargs="+", type=int, default=[256, 512])
+    micro.add_argument("--repeat", type=int, default=20)
+    micro.add_argument("--out")
+    micro.set_defaults(func=micro_command)
+
+    compare = commands.add_parser("compare", help="compare two result files")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=10.0, help="allowed p95 slowdown in percent")
+    compare.set_defaults(func=compare_command)
+
+    inputs = commands.add_parser("inputs", help="write the synthetic inputs to a directory")
+    inputs.add_argument("directory")
+    inputs.add_argument("--sizes", nargs="+", type=int, default=[256, 512])
+    inputs.add_argument("--formats", nargs="+", default=list(INPUT_FORMATS))
+    inputs.add_argument("--count", type=int, default=2, help="slices per size")
+    inputs.set_defaults(func=inputs_command)
+
+    args = parser.parse_args()
+    unknown = [fmt for fmt in getattr(args, "formats", []) if fmt not in INPUT_FORMATS]
+    if unknown:
+        parser.error(f"unknown format(s): {', '.join(unknown)}")
+    unknown = [name for name in getattr(args, "endpoints", []) if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"unknown endpoint(s): {', '.join(unknown)}")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
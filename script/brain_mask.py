@@ -0,0 +1,80 @@
+import functools
+
+import cv2
+import numpy as np
+
+# Brain masks shared by preprocessing, Grad-CAM masking and rendering: the
+# 8-bit grayscale scan thresholded at 15 and closed with a 5x5 kernel (the
+# binary model's comparison panel also opens it). Computed once per image at
+# each model's working resolution and passed along with the image.
+MASK_THRESHOLD = 15
+MASK_KERNEL = np.ones((5, 5), np.uint8)
+
+
+def gray_uint8(image):
+    """8-bit grayscale of an RGB/grayscale image (floats in [0, 1] are scaled to 0-255)"""
+    image = np.asarray(image)
+    if image.ndim == 3 and image.shape[2] == 1:
+        image = image[:, :, 0]
+    if image.dtype != np.uint8:
+        image = image * 255 if image.max() <= 1.0 else image
+        image = image.astype(np.uint8)
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return image
+
+
+def brain_masks(images, opened=False):
+    """Masks (N, H, W uint8, 0/255) for a batch of same-sized images.
+
+    The threshold runs over the whole batch at once; the 5x5 morphology
+    is applied per slice.
+    """
+    gray = np.stack([gray_uint8(image) for image in images])
+    masks = np.where(gray > MASK_THRESHOLD, 255, 0).astype(np.uint8)
+    for mask in masks:
+        cv2.morphologyEx(mask, cv2.MORPH_CLOSE, MASK_KERNEL, dst=mask)
+        if opened:
+            cv2.morphologyEx(mask, cv2.MORPH_OPEN, MASK_KERNEL, dst=mask)
+    return masks
+
+
+def brain_mask(image, opened=False):
+    """Mask (H, W uint8, 0/255) for one image"""
+    return brain_masks([image], opened)[0]
+
+
+# Anatomical priors for heatmaps without gradients: ventricles at the brain's
+# center, the frontal lobe above it and both temporal lobes to its sides.
+# They only depend on the offset from the center, so one template per size
+# covers every center and each image takes a shifted window of it.
+@functools.lru_cache(maxsize=None)
+def prior_template(size):
+    y, x = np.ogrid[-(size - 1):size, -(size - 1):size]
+
+    def gaussian(center_y, center_x, sigma):
+        return np.exp(-((y - center_y) ** 2 + (x - center_x) ** 2) / (2 * sigma ** 2))
+
+    ventricle_weight = gaussian(0, 0, size / 6)
+    frontal_weight = gaussian(-(size // 5), 0, size / 5)
+    temp_weight = np.maximum(gaussian(0, -(size // 3), size / 6), gaussian(0, size // 3, size / 6))
+    template = 0.5 * ventricle_weight + 0.3 * temp_weight + 0.2 * frontal_weight
+    template.setflags(write=False)
+    return template
+
+
+def prior_heatmap(mask):
+    """8-bit prior weights inside a square brain mask, centered on the mask"""
+    size = mask.shape[0]
+    binary_mask = mask > 0
+    ys, xs = np.nonzero(binary_mask)
+    if len(ys) > 0:
+        center_y, center_x = int(ys.mean()), int(xs.mean())
+    else:
+        center_y, center_x = size // 2, size // 2
+
+    weights = prior_template(size)[size - 1 - center_y:2 * size - 1 - center_y,
+                                   size - 1 - center_x:2 * size - 1 - center_x]
+    heatmap = np.zeros(mask.shape, dtype=np.uint8)
+    heatmap[binary_mask] = np.uint8(weights[binary_mask] * 255)
+    return heatmap
@@ -0,0 +1,59 @@
+import threading
+import weakref
+
+import numpy as np
+
+# Per-thread scratch arrays for the image pipeline. Each call site asks for a
+# named buffer and gets the same array back on its thread while the shape and
+# dtype match, so rendering a request does not allocate full-size temporaries.
+# Scratch arrays are overwritten by the thread's next request: they must not
+# be returned, cached or handed to another thread.
+_local = threading.local()
+_pools = weakref.WeakSet()
+_pools_lock = threading.Lock()
+
+
+class _Pool:
+    def __init__(self):
+        self.arrays = {}
+        self.allocations = 0
+
+
+def _pool():
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        pool = _local.pool = _Pool()
+        with _pools_lock:
+            _pools.add(pool)
+    return pool
+
+
+def scratch(name, shape, dtype=np.float32):
+    """This thread's `name` buffer with the given shape and dtype (contents undefined)"""
+    pool = _pool()
+    shape = tuple(int(dim) for dim in shape)
+    array = pool.arrays.get(name)
+    if array is None or array.shape != shape or array.dtype != dtype:
+        array = pool.arrays[name] = np.empty(shape, dtype=dtype)
+        pool.allocations += 1
+    return array
+
+
+def scaled_uint8(image, name):
+    """uint8 of a [0, 1] float image times 255 (truncated, like astype), in scratch buffers"""
+    scaled = scratch(f"{name}.float", image.shape, np.float32)
+    np.multiply(image, 255, out=scaled)
+    result = scratch(name, image.shape, np.uint8)
+    np.copyto(result, scaled, casting="unsafe")
+    return result
+
+
+def stats():
+    with _pools_lock:
+        pools = list(_pools)
+    return {
+        "threads": len(pools),
+        "buffers": sum(len(pool.arrays) for pool in pools),
+        "bytes": sum(array.nbytes for pool in pools for array in list(pool.arrays.values())),
+        "allocations": sum(pool.allocations for pool in pools),
+    }
@@ -0,0 +1,361 @@
+# Offline bulk scoring of scan archives with both models.
+#
+#     python bulk_score.py /data/scans --out results.csv
+#     python bulk_score.py /data/scans --out results.parquet --heatmaps heatmaps/ --batch-size 64
+#
+# Files are read, decoded and preprocessed inside a tf.data pipeline (parallel
+# map, batching, prefetch) using the same preprocessing as the HTTP services.
+# After every batch the rows are flushed and a checkpoint is appended to the
+# manifest (<out>.manifest); rerunning the same command resumes from there.
+# There is no MRI validation offline.
+import os
+import sys
+import csv
+import json
+import time
+import base64
+import hashlib
+import argparse
+import importlib
+
+os.environ.setdefault("MRI_VALIDATOR", "stub")
+
+import numpy as np
+import tensorflow as tf
+
+from render import render_options, encode_image
+from dicom_loader import DicomScan
+from brain_mask import brain_masks
+from uploads import decode_image, file_extension, IMAGE_EXTENSIONS, DICOM_EXTENSIONS
+from preprocessing import (BINARY_IMG_SIZE, SUBCLASS_IMG_SIZE, SUBCLASS_CLASSES, interpret_score,
+                           binary_preprocess_image, binary_preprocess_dicom_pixels,
+                           subclass_preprocess_image, subclass_preprocess_dicom_pixels)
+
+MODELS = {"binary": "app", "subclass": "subclass"}
+
+
+def find_scans(inputs):
+    """Sorted image/DICOM paths under the given files and directories"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for name in sorted(files):
+                    if file_extension(name) in IMAGE_EXTENSIONS + DICOM_EXTENSIONS and not name.startswith("."):
+                        paths.append(os.path.join(root, name))
+        elif os.path.isfile(item):
+            paths.append(item)
+        else:
+            print(f"Skipping missing input {item}")
+    return paths
+
+
+# Preprocessing (runs inside tf.data)
+def load_scan(path, models):
+    """(error, binary input, original, subclass input, brain mask) with zeros for skipped parts"""
+    binary_input = np.zeros((BINARY_IMG_SIZE, BINARY_IMG_SIZE, 3), np.float32)
+    original = np.zeros((BINARY_IMG_SIZE, BINARY_IMG_SIZE, 3), np.float32)
+    subclass_input = np.zeros((SUBCLASS_IMG_SIZE, SUBCLASS_IMG_SIZE, 3), np.float32)
+    brain_mask = np.zeros((SUBCLASS_IMG_SIZE, SUBCLASS_IMG_SIZE), np.uint8)
+    try:
+        if file_extension(path) in DICOM_EXTENSIONS:
+            # Header first; pixel data is memory-mapped rather than read
+            scan = DicomScan(path)
+            if scan.has_pixels and scan.frames > 1:
+                raise ValueError("Multi-frame DICOM; score it with /predict_volume")
+            pixels = scan.frame()
+            binary = binary_preprocess_dicom_pixels(pixels, scan) if "binary" in models else None
+            subclass = subclass_preprocess_dicom_pixels(pixels, scan) if "subclass" in models else None
+        else:
+            with open(path, "rb") as f:
+                image_bgr = decode_image(f.read())
+            if image_bgr is None:
+                raise ValueError("Could not decode image")
+            binary = binary_preprocess_image(image_bgr) if "binary" in models else None
+            subclass = subclass_preprocess_image(image_bgr) if "subclass" in models else None
+
+        if binary is not None:
+            if binary[0] is None:
+                raise ValueError("Error processing image")
+            binary_input = binary[0][0]
+            # Grayscale DICOM originals are repeated to RGB like create_visualization does
+            original = binary[1] if binary[1].ndim == 3 else np.repeat(binary[1][:, :, np.newaxis], 3, axis=2)
+            original = np.asarray(original, dtype=np.float32)
+        if subclass is not None:
+            if subclass[0] is None:
+                raise ValueError("Failed to preprocess image")
+            subclass_input = subclass[0][0]
+            brain_mask = subclass[1]
+        error = ""
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    return error, binary_input, original, subclass_input, brain_mask
+
+
+def make_dataset(paths, models, batch_size, parallel_calls):
+    def load(path):
+        return load_scan(path.decode("utf-8"), models)
+
+    def load_tensors(path):
+        error, binary_input, original, subclass_input, brain_mask = tf.numpy_function(
+            load, [path], [tf.string, tf.float32, tf.float32, tf.float32, tf.uint8])
+        return {
+            "path": path,
+            "error": error,
+            "binary_input": tf.ensure_shape(binary_input, (BINARY_IMG_SIZE, BINARY_IMG_SIZE, 3)),
+            "original": tf.ensure_shape(original, (BINARY_IMG_SIZE, BINARY_IMG_SIZE, 3)),
+            "subclass_input": tf.ensure_shape(subclass_input, (SUBCLASS_IMG_SIZE, SUBCLASS_IMG_SIZE, 3)),
+            "brain_mask": tf.ensure_shape(brain_mask, (SUBCLASS_IMG_SIZE, SUBCLASS_IMG_SIZE)),
+        }
+
+    dataset = tf.data.Dataset.from_tensor_slices(paths)
+    dataset = dataset.map(load_tensors, num_parallel_calls=parallel_calls, deterministic=True)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+# Scoring
+def heatmap_path(directory, path, model_name):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(directory, f"{stem}-{digest}.{model_name}.png")
+
+
+def score_binary(service, batch, ok, heatmaps_dir, rows):
+    inputs = batch["binary_input"][ok]
+    if heatmaps_dir:
+        predictions, cams = service.run_binary_batch(inputs)
+    else:
+        predictions, cams = service.binary_served.predict(inputs), None
+    options = render_options(format="png")
+    masks = brain_masks(batch["original"][ok], opened=True) if heatmaps_dir else None
+    for i, index in enumerate(np.flatnonzero(ok)):
+        row = rows[index]
+        score = float(np.ravel(predictions[i])[0])
+        label, confidence = interpret_score(score)
+        row.update(binary_label=label, binary_confidence=round(float(confidence), 2), binary_score=score)
+        if heatmaps_dir:
+            original = batch["original"][index]
+            if cams is not None:
+                encoded = service.create_visualization(service.heatmap_from_cam(cams[i]), original, options, masks[i])
+            else:
+                encoded = service.generate_gradcam(service.binary_gradcam, inputs[i:i + 1], original,
+                                                   options=options, brain_mask=masks[i])
+            if encoded:
+                row["binary_heatmap"] = heatmap_path(heatmaps_dir, row["path"], "binary")
+                with open(row["binary_heatmap"], "wb") as f:
+                    f.write(base64.b64decode(encoded))
+
+
+def score_subclass(service, batch, ok, heatmaps_dir, rows):
+    inputs = batch["subclass_input"][ok]
+    if heatmaps_dir:
+        predictions, cams, _ = service.predict_and_explain(inputs)
+    else:
+        predictions, cams = service.subclass_served.predict(inputs), None
+    options = render_options(format="png")
+    for i, index in enumerate(np.flatnonzero(ok)):
+        row = rows[index]
+        class_index = int(np.argmax(predictions[i]))
+        row.update(subclass_label=SUBCLASS_CLASSES[class_index],
+                   subclass_confidence=round(float(predictions[i][class_index]) * 100, 2))
+        for label, prob in zip(SUBCLASS_CLASSES, predictions[i]):
+            row[f"p_{label}"] = round(float(prob), 6)
+        if heatmaps_dir and cams is not None:
+            _, overlaid_img = service.render_gradcam_overlay(cams[i], inputs[i:i + 1], batch["brain_mask"][index])
+            row["subclass_heatmap"] = heatmap_path(heatmaps_dir, row["path"], "subclass")
+            with open(row["subclass_heatmap"], "wb") as f:
+                f.write(encode_image(overlaid_img, options))
+
+
+def result_columns(models, heatmaps):
+    columns = ["path", "error"]
+    if "binary" in models:
+        columns += ["binary_label", "binary_confidence", "binary_score"] + (["binary_heatmap"] if heatmaps else [])
+    if "subclass" in models:
+        columns += ["subclass_label", "subclass_confidence"] + [f"p_{label}" for label in SUBCLASS_CLASSES]
+        columns += ["subclass_heatmap"] if heatmaps else []
+    return columns
+
+
+def numeric_column(column):
+    """Scores, confidences and class probabilities; every other column is text"""
+    return column.startswith("p_") or column.endswith(("_confidence", "_score"))
+
+
+# Output and checkpoints
+class CsvResults:
+    """Appends rows; a checkpoint is the file size after a flushed batch"""
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self._file = None
+
+    def restore(self, checkpoint):
+        # Drop rows written after the last checkpoint (an interrupted batch)
+        if os.path.exists(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(checkpoint or 0)
+
+    def write(self, rows):
+        if self._file is None:
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            self._file = open(self.path, "a", newline="", encoding="utf-8")
+            self._writer = csv.DictWriter(self._file, fieldnames=self.columns, extrasaction="ignore")
+            if new_file:
+                self._writer.writeheader()
+        self._writer.writerows(rows)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class ParquetResults:
+    """One part file per batch in a directory; a checkpoint is the part's name"""
+
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            print("Error: Parquet output needs pyarrow (pip install pyarrow); use a .csv output instead")
+            sys.exit(2)
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.columns = columns
+        # One explicit schema for every part: inferring it per batch gives null-typed
+        # columns for batches that are all errors, and the parts no longer read as one dataset
+        self.schema = pyarrow.schema([(column, pyarrow.float64() if numeric_column(column) else pyarrow.string())
+                                      for column in columns])
+        self.parts = []
+        os.makedirs(path, exist_ok=True)
+
+    def restore(self, checkpoint, parts=()):
+        self.parts = list(parts)
+        for name in os.listdir(self.path):
+            if name.startswith("part-") and name not in self.parts:
+                os.remove(os.path.join(self.path, name))
+
+    def write(self, rows):
+        name = f"part-{len(self.parts):06d}.parquet"
+        table = self.pa.Table.from_pylist([{column: row.get(column) for column in self.columns} for row in rows],
+                                          schema=self.schema)
+        self.pq.write_table(table, os.path.join(self.path, name))
+        self.parts.append(name)
+        return name
+
+    def close(self):
+        pass
+
+
+def read_manifest(path):
+    """(config, done paths, last checkpoint, parquet parts) from an existing manifest"""
+    config, done, checkpoint, parts = None, set(), None, []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A torn last line from an interrupted write
+                break
+            if "config" in entry:
+                config = entry["config"]
+            else:
+                done.update(entry["paths"])
+                checkpoint = entry["checkpoint"]
+                parts.append(entry["checkpoint"])
+    return config, done, checkpoint, parts
+
+
+def append_manifest(manifest, entry):
+    manifest.write(json.dumps(entry) + "\n")
+    manifest.flush()
+    os.fsync(manifest.fileno())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score directories of scans with the binary and subclass models")
+    parser.add_argument("inputs", nargs="+", help="image/DICOM files or directories (searched recursively)")
+    parser.add_argument("--out", required=True, help="results file: .csv, or .parquet (a directory of parts)")
+    parser.add_argument("--models", nargs="+", default=list(MODELS), help=f"any of: {', '.join(MODELS)}")
+    parser.add_argument("--heatmaps", help="write Grad-CAM PNGs to this directory")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--parallel", type=int, default=0, help="parallel decode calls (default: autotune)")
+    parser.add_argument("--manifest", help="checkpoint manifest (default: <out>.manifest)")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing manifest and start over")
+    args = parser.parse_args()
+    unknown = [name for name in args.models if name not in MODELS]
+    if unknown:
+        parser.error(f"unknown model(s): {', '.join(unknown)}")
+
+    models = [name for name in MODELS if name in args.models]
+    out_format = "parquet" if args.out.lower().endswith(".parquet") else "csv"
+    config = {"models": models, "heatmaps": bool(args.heatmaps), "format": out_format}
+    columns = result_columns(models, bool(args.heatmaps))
+    results = (ParquetResults if out_format == "parquet" else CsvResults)(args.out, columns)
+    manifest_path = args.manifest or f"{args.out}.manifest"
+
+    done, checkpoint, parts = set(), None, []
+    if os.path.exists(manifest_path) and not args.restart:
+        previous, done, checkpoint, parts = read_manifest(manifest_path)
+        if previous is not None and previous != config:
+            print(f"Error: {manifest_path} is from a run with {previous}; use --restart to start over")
+            sys.exit(2)
+        print(f"Resuming: {len(done)} files already scored")
+    elif os.path.exists(args.out) and out_format == "csv":
+        os.remove(args.out)
+    if out_format == "parquet":
+        results.restore(checkpoint, parts if done else [])
+    else:
+        results.restore(checkpoint)
+
+    paths = [path for path in find_scans(args.inputs) if path not in done]
+    print(f"{len(paths)} files to score with {', '.join(models)}")
+    if not paths:
+        return
+    if args.heatmaps:
+        os.makedirs(args.heatmaps, exist_ok=True)
+
+    services = {name: importlib.import_module(MODELS[name]) for name in models}
+    dataset = make_dataset(paths, models, args.batch_size, args.parallel or tf.data.AUTOTUNE)
+
+    mode = "a" if done else "w"
+    started = time.perf_counter()
+    scored = failed = 0
+    with open(manifest_path, mode, encoding="utf-8") as manifest:
+        if not done:
+            append_manifest(manifest, {"config": config})
+        for batch in dataset.as_numpy_iterator():
+            batch_paths = [path.decode("utf-8") for path in batch["path"]]
+            errors = [error.decode("utf-8") for error in batch["error"]]
+            ok = np.array([not error for error in errors])
+            rows = [{"path": path, "error": error or None} for path, error in zip(batch_paths, errors)]
+            if ok.any():
+                try:
+                    if "binary" in services:
+                        score_binary(services["binary"], batch, ok, args.heatmaps, rows)
+                    if "subclass" in services:
+                        score_subclass(services["subclass"], batch, ok, args.heatmaps, rows)
+                except Exception as e:
+                    # The batch is not checkpointed, so a rerun retries it
+                    print(f"Error scoring batch starting at {batch_paths[0]}: {e}")
+                    raise
+            append_manifest(manifest, {"checkpoint": results.write(rows), "paths": batch_paths})
+
+            scored += int(ok.sum())
+            failed += int((~ok).sum())
+            elapsed = time.perf_counter() - started
+            print(f"{scored + failed}/{len(paths)} files ({failed} unreadable), "
+                  f"{(scored + failed) / elapsed:.1f} files/s", flush=True)
+    results.close()
+    print(f"Done: {scored} scored, {failed} unreadable; results in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import threading
+
+import numpy as np
+
+# Largest batch run in one call; larger batches run in chunks to bound activation memory
+PREDICT_MAX_BATCH = max(1, int(os.environ.get("PREDICT_MAX_BATCH", 32)))
+
+
+class CompiledPredictor:
+    """Inference through one `tf.function` with a fixed input signature.
+
+    The function is traced once, when the predictor is built, instead of
+    Keras `predict` setting up a data adapter and step loop on every call.
+    The batch dimension of the signature is left open, so every batch size
+    runs on that one trace without padding; inputs that do not match the
+    signature raise instead of retracing.
+    """
+
+    def __init__(self, model, name="model", max_batch=PREDICT_MAX_BATCH):
+        import tensorflow as tf
+        self.model = model
+        self.name = name
+        self.max_batch = max(1, int(max_batch))
+        self.input_shape = tuple(int(dim) for dim in model.input_shape[1:])
+
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._rows = 0
+
+        @tf.function(input_signature=[tf.TensorSpec(shape=(None,) + self.input_shape, dtype=tf.float32)])
+        def forward(images):
+            return model(images, training=False)
+
+        self._forward = forward
+        self._forward.get_concrete_function()
+
+    def predict(self, batch):
+        """Scores for a batch, as a NumPy array with one row per input"""
+        batch = np.asarray(batch, dtype=np.float32)
+        outputs = []
+        for start in range(0, len(batch), self.max_batch):
+            chunk = batch[start:start + self.max_batch]
+            outputs.append(self._forward(chunk).numpy())
+            with self._lock:
+                self._calls += 1
+                self._rows += len(chunk)
+        return np.concatenate(outputs) if len(outputs) > 1 else outputs[0]
+
+    def warmup(self, max_rows=None):
+        """Run a single row and a `max_rows` batch once so their kernels are set up"""
+        for rows in sorted({1, min(max_rows or 1, self.max_batch)}):
+            self._forward(np.zeros((rows,) + self.input_shape, dtype=np.float32))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "input_signature": [None, *self.input_shape],
+                "max_batch": self.max_batch,
+                "calls": self._calls,
+                "rows": self._rows,
+            }
@@ -0,0 +1,22 @@
+import argparse
+
+import tensorflow as tf
+
+from registry import save_fast_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert .h5 models to the fast-loading format used at startup")
+    parser.add_argument("models", nargs="+", help="paths to .h5 model files")
+    args = parser.parse_args()
+
+    for path in args.models:
+        try:
+            model = tf.keras.models.load_model(path, compile=False)
+            print(f"{path} -> {save_fast_model(model, path)}")
+        except Exception as e:
+            print(f"Error converting {path}: {e}")
+
+
+if __name__ == "__main__":
+    main()
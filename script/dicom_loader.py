@@ -0,0 +1,161 @@
+import io
+import os
+import struct
+
+import cv2
+import numpy as np
+from pydicom import dcmread
+from pydicom.filereader import data_element_offset_to_value
+from pydicom.multival import MultiValue
+
+# Shared DICOM ingestion for both models: the header is read and checked
+# before any pixel data is touched, uncompressed pixel data is viewed in
+# place (memory-mapped for files) and frames are resized in their stored
+# integer type before the float32 rescale/window to [0, 1].
+DICOM_MAX_PIXELS = int(os.environ.get("DICOM_MAX_PIXELS", 256 * 1024 * 1024))
+# Elements larger than this (overlays, icons, private blobs) are not parsed
+DICOM_DEFER_BYTES = 64 * 1024
+
+PIXEL_DATA_TAG = b"\xe0\x7f\x10\x00"
+UNDEFINED_LENGTH = 0xFFFFFFFF
+# Transfer syntaxes whose pixel data can be viewed without decoding
+UNCOMPRESSED_SYNTAXES = (
+    "1.2.840.10008.1.2",    # Implicit VR Little Endian
+    "1.2.840.10008.1.2.1",  # Explicit VR Little Endian
+)
+# Stored types cv2.resize handles natively
+RESIZE_DTYPES = (np.uint8, np.uint16, np.int16, np.float32)
+
+
+class DicomError(ValueError):
+    pass
+
+
+class DicomScan:
+    """Header of a DICOM file or upload, with its pixel data loaded on demand.
+
+    `source` is the file's bytes or a path; paths are memory-mapped.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        fp = open(source, "rb") if isinstance(source, str) else io.BytesIO(source)
+        try:
+            try:
+                self.header = dcmread(fp, stop_before_pixels=True, defer_size=DICOM_DEFER_BYTES)
+            except Exception as e:
+                raise DicomError(f"Unreadable DICOM header: {e}")
+            # Reading stops at the Pixel Data tag; note where its value starts
+            pixel_tell = fp.tell()
+            element = fp.read(12)
+        finally:
+            if isinstance(source, str):
+                fp.close()
+
+        self.has_pixels = element[:4] == PIXEL_DATA_TAG
+        if not self.has_pixels:
+            return
+        header = self.header
+        try:
+            self.rows = int(header.Rows)
+            self.columns = int(header.Columns)
+            self.bits_allocated = int(header.BitsAllocated)
+        except (AttributeError, TypeError, ValueError):
+            raise DicomError("DICOM header is missing the image dimensions")
+        self.frames = int(header.get("NumberOfFrames", 1) or 1)
+        self.samples = int(header.get("SamplesPerPixel", 1) or 1)
+        self.bits_stored = int(header.get("BitsStored", self.bits_allocated) or self.bits_allocated)
+        self.signed = int(header.get("PixelRepresentation", 0) or 0) == 1
+        if min(self.rows, self.columns, self.frames) < 1:
+            raise DicomError("DICOM header has empty image dimensions")
+        if self.rows * self.columns * self.frames * self.samples > DICOM_MAX_PIXELS:
+            raise DicomError(f"DICOM image exceeds {DICOM_MAX_PIXELS} pixels")
+
+        # Native little-endian pixel data can be viewed without pydicom decoding it
+        self.pixel_offset = None
+        syntax = str(getattr(getattr(header, "file_meta", None), "TransferSyntaxUID", ""))
+        if syntax in UNCOMPRESSED_SYNTAXES and self.bits_allocated in (8, 16, 32):
+            implicit = syntax == UNCOMPRESSED_SYNTAXES[0]
+            vr = "OW" if implicit else element[4:6].decode("ascii", "replace")
+            value_offset = data_element_offset_to_value(implicit, vr)
+            length = struct.unpack("<I", element[value_offset - 4:value_offset])[0]
+            if length != UNDEFINED_LENGTH:
+                expected = self.rows * self.columns * self.frames * self.samples * self.bits_allocated // 8
+                available = (os.path.getsize(source) if isinstance(source, str) else len(source)) - pixel_tell - value_offset
+                if min(length, available) < expected:
+                    raise DicomError("DICOM pixel data is truncated")
+                self.pixel_offset = pixel_tell + value_offset
+
+    def pixels(self):
+        """Stored values as (frames, rows, columns[, samples]), without copying where possible"""
+        if not self.has_pixels:
+            raise DicomError("DICOM file has no pixel data")
+        shape = (self.frames, self.rows, self.columns) + ((self.samples,) if self.samples > 1 else ())
+        if self.pixel_offset is not None:
+            dtype = np.dtype(("<i" if self.signed else "<u") + str(self.bits_allocated // 8))
+            if isinstance(self.source, str):
+                return np.memmap(self.source, dtype=dtype, mode="r", offset=self.pixel_offset, shape=shape)
+            count = int(np.prod(shape))
+            return np.frombuffer(self.source, dtype=dtype, count=count, offset=self.pixel_offset).reshape(shape)
+
+        # Compressed or unusual encodings: let pydicom decode the whole element
+        fp = open(self.source, "rb") if isinstance(self.source, str) else io.BytesIO(self.source)
+        try:
+            pixel_array = dcmread(fp).pixel_array
+        finally:
+            if isinstance(self.source, str):
+                fp.close()
+        return pixel_array.reshape(shape)
+
+    def frame(self, index=0):
+        return self.pixels()[index]
+
+
+def intensity_range(pixels, header=None, bits_stored=None):
+    """(low, high) stored values mapped to 0 and 1 for a frame.
+
+    The header's VOI window is used when present (through the modality
+    rescale); otherwise 8-bit data keeps its 0-255 range like JPG/PNG
+    uploads and deeper data is stretched over the frame's min-max.
+    """
+    slope = float(header.get("RescaleSlope", 1) or 1) if header is not None else 1.0
+    intercept = float(header.get("RescaleIntercept", 0) or 0) if header is not None else 0.0
+    center = header.get("WindowCenter") if header is not None else None
+    width = header.get("WindowWidth") if header is not None else None
+    if center is not None and width is not None:
+        # Multi-valued windows list alternatives; the first is the default
+        center = float(center[0] if isinstance(center, MultiValue) else center)
+        width = float(width[0] if isinstance(width, MultiValue) else width)
+        if width > 0 and slope != 0:
+            low, high = sorted(((center - width / 2 - intercept) / slope, (center + width / 2 - intercept) / slope))
+            return low, high
+
+    if pixels.dtype == np.uint8 or (bits_stored or 16) <= 8:
+        return 0.0, 255.0
+    low, high = float(pixels.min()), float(pixels.max())
+    if high <= low:
+        return low, low + 1.0
+    return low, high
+
+
+def scale_frame(pixels, size, scan=None):
+    """One frame as float32 in [0, 1] at size x size.
+
+    The frame is resized in its stored type and only the small result is
+    converted, so full-resolution float copies are never made.
+    """
+    if scan is not None:
+        low, high = intensity_range(pixels, scan.header, scan.bits_stored)
+    else:
+        low, high = intensity_range(pixels)
+    if pixels.dtype not in RESIZE_DTYPES:
+        pixels = pixels.astype(np.float32)
+    resized = cv2.resize(np.ascontiguousarray(pixels), (size, size))
+    scaled = resized.astype(np.float32)
+    scaled -= low
+    scaled *= 1.0 / (high - low)
+    np.clip(scaled, 0.0, 1.0, out=scaled)
+    if scan is not None and str(scan.header.get("PhotometricInterpretation", "")) == "MONOCHROME1":
+        # MONOCHROME1 stores bright as low values
+        scaled = 1.0 - scaled
+    return scaled
@@ -0,0 +1,196 @@
+import os
+import gc
+import json
+import time
+import argparse
+import importlib
+
+import numpy as np
+import tensorflow as tf
+
+from registry import registry, load_keras_model
+from tflite_backend import TFLiteModel, TFLITE_MODES, tflite_path
+from uploads import decode_image, file_extension, IMAGE_EXTENSIONS, DICOM_EXTENSIONS
+
+# Model name -> service module (its preprocessing is used for samples)
+SERVICES = {"binary": "app", "subclass": "subclass"}
+
+
+def load_samples(service, directory, limit):
+    """Model inputs for the images/DICOMs in `directory`, preprocessed as when serving"""
+    inputs = []
+    if not directory:
+        return inputs
+    for filename in sorted(os.listdir(directory)):
+        file_ext = file_extension(filename)
+        if file_ext not in IMAGE_EXTENSIONS + DICOM_EXTENSIONS:
+            continue
+        with open(os.path.join(directory, filename), "rb") as f:
+            data = f.read()
+        if file_ext in IMAGE_EXTENSIONS:
+            image_bgr = decode_image(data)
+            preprocessed_img = service.preprocess_image(image_bgr)[0] if image_bgr is not None else None
+        else:
+            preprocessed_img = service.preprocess_dicom(data)[0]
+        if preprocessed_img is None:
+            print(f"Skipping unreadable sample {filename}")
+            continue
+        inputs.append(preprocessed_img.astype(np.float32))
+        if len(inputs) >= limit:
+            break
+    return inputs
+
+
+def convert(model, mode, calibration):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == "int8":
+        if not calibration:
+            raise ValueError("int8 export needs calibration samples (--samples)")
+        # Integer kernels inside; float input/output so the serving code is unchanged
+        converter.representative_dataset = lambda: ([x] for x in calibration)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def rss_mb():
+    """Resident set size of this process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def latency(predict, inputs, warmup=2):
+    for x in inputs[:warmup]:
+        predict(x)
+    times = []
+    outputs = []
+    for x in inputs:
+        started = time.perf_counter()
+        outputs.append(predict(x))
+        times.append((time.perf_counter() - started) * 1000)
+    return np.concatenate(outputs), {
+        "mean_ms": round(float(np.mean(times)), 2),
+        "p50_ms": round(float(np.percentile(times, 50)), 2),
+        "p95_ms": round(float(np.percentile(times, 95)), 2),
+    }
+
+
+def agreement(reference, candidate):
+    """Label agreement and largest score difference against the Keras outputs"""
+    if reference.shape[-1] == 1:
+        same = (reference[:, 0] > 0.5) == (candidate[:, 0] > 0.5)
+    else:
+        same = np.argmax(reference, axis=-1) == np.argmax(candidate, axis=-1)
+    return {
+        "label_agreement": round(float(np.mean(same)), 4),
+        "max_abs_diff": round(float(np.max(np.abs(reference - candidate))), 6),
+        "mean_abs_diff": round(float(np.mean(np.abs(reference - candidate))), 6),
+    }
+
+
+def export_model(name, modes, samples_dir, reference_dir, max_samples):
+    service = importlib.import_module(SERVICES[name])
+    served = registry.get(name)
+    model = served.model
+
+    calibration = load_samples(service, samples_dir, max_samples)
+    reference = load_samples(service, reference_dir, max_samples)
+    reference_kind = "samples"
+    if not reference:
+        # Latency only; agreement on noise says little about accuracy
+        rng = np.random.default_rng(0)
+        reference = [rng.random((1, served.input_size, served.input_size, 3), dtype=np.float32) for _ in range(16)]
+        reference_kind = "random"
+
+    # Measured like the interpreters below: RSS growth from loading a copy of
+    # the model and running it. The copy stays loaded so the interpreters do
+    # not reuse its freed memory.
+    gc.collect()
+    rss_before = rss_mb()
+    keras_model = load_keras_model(served.path)
+    keras_outputs, keras_latency = latency(lambda x: keras_model(x, training=False).numpy(), reference)
+    report = {
+        "model": name,
+        "reference": reference_kind,
+        "reference_size": len(reference),
+        "keras": dict(keras_latency, size_mb=round(os.path.getsize(served.path) / (1024 * 1024), 2),
+                      rss_delta_mb=round(rss_mb() - rss_before, 1)),
+    }
+
+    for mode in modes:
+        try:
+            content = convert(model, mode, calibration)
+        except Exception as e:
+            print(f"Error exporting {name} ({mode}): {e}")
+            report[mode] = {"error": str(e)}
+            continue
+
+        path = tflite_path(served.path, mode)
+        with open(path, "wb") as f:
+            f.write(content)
+
+        # Let the converter's temporaries go before measuring the interpreter
+        gc.collect()
+        rss_before = rss_mb()
+        tflite_model = TFLiteModel(path)
+        outputs, tflite_latency = latency(tflite_model.predict, reference)
+        report[mode] = dict(
+            tflite_latency,
+            path=path,
+            size_mb=round(len(content) / (1024 * 1024), 2),
+            rss_delta_mb=round(rss_mb() - rss_before, 1),
+            **agreement(keras_outputs, outputs),
+        )
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['model']} ({report['reference_size']} {report['reference']} reference inputs)")
+    print(f"{'backend':<10}{'p50 ms':>9}{'p95 ms':>9}{'size MB':>9}{'rss MB':>8}{'agree':>8}{'max diff':>11}")
+    keras = report["keras"]
+    print(f"{'keras':<10}{keras['p50_ms']:>9}{keras['p95_ms']:>9}{keras['size_mb']:>9}"
+          f"{keras['rss_delta_mb']:>8}{'-':>8}{'-':>11}")
+    for mode in TFLITE_MODES:
+        result = report.get(mode)
+        if result is None:
+            continue
+        if "error" in result:
+            print(f"{mode:<10} failed: {result['error']}")
+            continue
+        print(f"{mode:<10}{result['p50_ms']:>9}{result['p95_ms']:>9}{result['size_mb']:>9}"
+              f"{result['rss_delta_mb']:>8}{result['label_agreement']:>8}{result['max_abs_diff']:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the models to TFLite and compare them with Keras")
+    parser.add_argument("models", nargs="*", help=f"models to export: {', '.join(SERVICES)} (default: all)")
+    parser.add_argument("--modes", nargs="+", default=list(TFLITE_MODES), choices=TFLITE_MODES)
+    parser.add_argument("--samples", help="directory of JPG/PNG/DICOM files for int8 calibration")
+    parser.add_argument("--reference", help="directory of files for the comparison (default: --samples)")
+    parser.add_argument("--max-samples", type=int, default=200)
+    parser.add_argument("--report", help="write the comparison as JSON to this path")
+    args = parser.parse_args()
+    unknown = [name for name in args.models if name not in SERVICES]
+    if unknown:
+        parser.error(f"unknown model(s): {', '.join(unknown)}")
+
+    reports = []
+    for name in args.models or list(SERVICES):
+        report = export_model(name, args.modes, args.samples, args.reference or args.samples, args.max_samples)
+        print_report(report)
+        reports.append(report)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nReport written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
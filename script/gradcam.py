@@ -0,0 +1,199 @@
+import threading
+from collections import OrderedDict
+
+import tensorflow as tf
+import numpy as np
+
+
+def build_grad_model(model, layer_name):
+    """Model mapping the input to (target layer activations, predictions)"""
+    target_layer = model.get_layer(layer_name)
+    try:
+        return tf.keras.models.Model(
+            inputs=model.inputs,
+            outputs=[target_layer.output, model.output]
+        )
+    except Exception:
+        # A nested base model (e.g. the VGG16 block of the subclass model) has
+        # its own input tensor, so re-chain the outer layers around it
+        return _rechain_grad_model(model, target_layer)
+
+
+def _rechain_grad_model(model, target_layer):
+    inputs = tf.keras.layers.Input(shape=model.input_shape[1:])
+    x = inputs
+    target_output = None
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.InputLayer):
+            continue
+        x = layer(x)
+        if layer is target_layer:
+            target_output = x
+
+    if target_output is None:
+        raise ValueError(f"Layer {target_layer.name} is not on the main path of the model")
+    return tf.keras.models.Model(inputs=inputs, outputs=[target_output, x])
+
+
+class GradCamEngine:
+    """Grad-CAM for one model with cached, compiled per-layer steps.
+
+    The default target layer is resolved once when the engine is created.
+    For every layer that is explained, the Grad-CAM sub-model and a
+    `tf.function` with a fixed input signature are built once and kept in a
+    small LRU cache, so repeated requests reuse the traced graph.
+    """
+
+    def __init__(self, model, default_layer=None, max_cached_layers=4):
+        self.model = model
+        self.default_layer = default_layer
+        self.max_cached_layers = max(1, int(max_cached_layers))
+        self.input_shape = tuple(model.input_shape[1:])
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.builds = 0
+
+        if default_layer is not None:
+            try:
+                self._entry(default_layer)
+            except Exception as e:
+                print(f"Error preparing Grad-CAM for layer {default_layer}: {e}")
+
+    def layer_output_shape(self, layer_name=None):
+        """Spatial (height, width) of the target layer's activations"""
+        grad_model = self._entry(layer_name or self.default_layer)["grad_model"]
+        return tuple(grad_model.outputs[0].shape.as_list()[1:3])
+
+    def cached_layers(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def explain(self, images, class_indices=None, layer_name=None):
+        """Class scores and raw Grad-CAM maps from one taped forward pass.
+
+        `class_indices` selects the output explained for each image; -1 (the
+        default) uses the arg-max class. Returns (predictions, cams) where
+        cams has shape (batch, h, w) at the target layer's resolution, or
+        None if no gradient reaches that layer.
+        """
+        layer_name = layer_name or self.default_layer
+        if layer_name is None:
+            raise ValueError("No Grad-CAM target layer available")
+
+        entry = self._entry(layer_name)
+        step, state = entry["step"], entry["state"]
+        images = np.asarray(images, dtype=np.float32)
+        if class_indices is None:
+            class_indices = np.full(len(images), -1, dtype=np.int32)
+        else:
+            class_indices = np.asarray(class_indices, dtype=np.int32).reshape(-1)
+
+        predictions, cams = step(tf.constant(images), tf.constant(class_indices))
+        if not state["has_gradients"]:
+            return predictions.numpy(), None
+        return predictions.numpy(), cams.numpy()
+
+    def explain_all_classes(self, images, layer_name=None):
+        """Grad-CAM maps for every output class from one forward pass.
+
+        The per-class gradients come from a single batch jacobian of the
+        class scores with respect to the target activations, and the channel
+        weighting is applied to all classes at once. Returns (predictions,
+        cams) with cams shaped (batch, classes, h, w), or None for cams if no
+        gradient reaches the layer.
+        """
+        layer_name = layer_name or self.default_layer
+        if layer_name is None:
+            raise ValueError("No Grad-CAM target layer available")
+
+        entry = self._entry(layer_name)
+        with self._lock:
+            if entry["all_classes_step"] is None:
+                entry["all_classes_step"] = self._compile_all_classes_step(entry["grad_model"], entry["state"])
+                entry["all_classes_step"].get_concrete_function()
+            step = entry["all_classes_step"]
+
+        images = np.asarray(images, dtype=np.float32)
+        predictions, cams = step(tf.constant(images))
+        if not entry["state"]["has_gradients"]:
+            return predictions.numpy(), None
+        return predictions.numpy(), cams.numpy()
+
+    # Cache
+    def _entry(self, layer_name):
+        with self._lock:
+            entry = self._entries.get(layer_name)
+            if entry is not None:
+                self._entries.move_to_end(layer_name)
+                return entry
+
+            grad_model = build_grad_model(self.model, layer_name)
+            step, state = self._compile_step(grad_model)
+            # Trace now so the first request does not pay for it
+            step.get_concrete_function()
+
+            entry = {
+                "grad_model": grad_model,
+                "step": step,
+                "state": state,
+                "all_classes_step": None,
+            }
+            self._entries[layer_name] = entry
+            self.builds += 1
+            while len(self._entries) > self.max_cached_layers:
+                # The default layer always stays warm
+                oldest = next(name for name in self._entries if name != self.default_layer)
+                del self._entries[oldest]
+            return entry
+
+    def _signature(self):
+        return tf.TensorSpec(shape=(None,) + self.input_shape, dtype=tf.float32)
+
+    def _compile_step(self, grad_model):
+        state = {"has_gradients": True}
+
+        @tf.function(input_signature=[
+            self._signature(),
+            tf.TensorSpec(shape=(None,), dtype=tf.int32),
+        ])
+        def step(images, class_indices):
+            with tf.GradientTape() as tape:
+                conv_outputs, predictions = grad_model(images, training=False)
+                argmax = tf.argmax(predictions, axis=-1, output_type=tf.int32)
+                class_indices = tf.where(class_indices < 0, argmax, class_indices)
+                # Images in a batch are independent, so the gradient of the
+                # summed class scores gives each image its own gradients
+                target_scores = tf.gather(predictions, class_indices, axis=1, batch_dims=1)
+                loss = tf.reduce_sum(target_scores)
+
+            grads = tape.gradient(loss, conv_outputs)
+            if grads is None:
+                state["has_gradients"] = False
+                return predictions, tf.zeros(tf.shape(conv_outputs)[:3])
+
+            # Channel weights are the spatially pooled gradients of each image
+            pooled_grads = tf.reduce_mean(grads, axis=(1, 2))
+            cams = tf.einsum("bhwc,bc->bhw", conv_outputs, pooled_grads)
+            return predictions, cams
+
+        return step, state
+
+    def _compile_all_classes_step(self, grad_model, state):
+        @tf.function(input_signature=[self._signature()])
+        def step(images):
+            with tf.GradientTape() as tape:
+                conv_outputs, predictions = grad_model(images, training=False)
+
+            # (batch, classes, h, w, channels) in one vectorized backward pass
+            jacobian = tape.batch_jacobian(predictions, conv_outputs)
+            if jacobian is None:
+                state["has_gradients"] = False
+                shape = tf.shape(conv_outputs)
+                return predictions, tf.zeros([shape[0], tf.shape(predictions)[1], shape[1], shape[2]])
+
+            pooled_grads = tf.reduce_mean(jacobian, axis=(2, 3))
+            cams = tf.einsum("bhwc,bkc->bkhw", conv_outputs, pooled_grads)
+            return predictions, cams
+
+        return step
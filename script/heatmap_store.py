@@ -0,0 +1,81 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class HeatmapStore:
+    """In-memory store for encoded heatmaps, keyed by a per-request ID.
+
+    Entries expire `ttl_seconds` after they are stored, and the least
+    recently used entries are evicted once the total size passes `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_seconds=600):
+        self.max_bytes = int(max_bytes)
+        self.ttl_seconds = float(ttl_seconds)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def put(self, data, mimetype="image/jpeg"):
+        """Store encoded image bytes and return their ID"""
+        heatmap_id = uuid.uuid4().hex
+        now = time.monotonic()
+        with self._lock:
+            self._entries[heatmap_id] = (data, mimetype, now + self.ttl_seconds)
+            self._total_bytes += len(data)
+            self._evict(now)
+        return heatmap_id
+
+    def get(self, heatmap_id):
+        """(bytes, mimetype) for a stored heatmap, or None if unknown/expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(heatmap_id)
+            if entry is None:
+                return None
+            if entry[2] <= now:
+                self._remove(heatmap_id)
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(heatmap_id)
+            return entry[0], entry[1]
+
+    def pop(self, heatmap_id):
+        """Remove a stored heatmap and return (bytes, mimetype), or None"""
+        with self._lock:
+            entry = self._entries.get(heatmap_id)
+            if entry is None:
+                return None
+            self._remove(heatmap_id)
+            return entry[0], entry[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _remove(self, heatmap_id):
+        data = self._entries.pop(heatmap_id)[0]
+        self._total_bytes -= len(data)
+
+    def _evict(self, now):
+        # Drop expired entries, then the least recently used until under budget
+        expired = [key for key, entry in self._entries.items() if entry[2] <= now]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
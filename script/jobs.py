@@ -0,0 +1,265 @@
+import json
+import time
+import uuid
+import queue
+import threading
+
+from flask import Response, jsonify
+
+from payloads import payload_response
+
+PENDING = ("queued", "running")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Background jobs with results fetched later by ID.
+
+    At most `max_queue` jobs wait for the `workers` threads; submit() raises
+    JobQueueFull beyond that. Before starting a job a worker yields while
+    `busy()` is true (for up to `max_yield_s`), so foreground work such as
+    classification batches goes first. Jobs that are not run or whose
+    results are not fetched within `ttl_seconds` expire.
+
+    Long-polls and event streams each hold a server thread while they wait,
+    so at most `max_waiters` of them run at once (see hold_waiter()).
+    """
+
+    def __init__(self, workers=1, max_queue=32, ttl_seconds=300, busy=None, max_yield_s=1.0, name="jobs",
+                 max_waiters=2):
+        self.max_queue = max(1, int(max_queue))
+        self.max_waiters = max(0, int(max_waiters))
+        self.ttl_seconds = float(ttl_seconds)
+        self.busy = busy
+        self.max_yield_s = float(max_yield_s)
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._jobs = {}
+        self._waiter_slots = threading.BoundedSemaphore(self.max_waiters) if self.max_waiters else None
+        self.waiters = 0
+        self.waiters_rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expirations = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+
+        self._workers = [threading.Thread(target=self._run, name=f"{name}-job-{i}", daemon=True)
+                         for i in range(max(1, int(workers)))]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, fn, *args):
+        """Queue fn(*args) and return the job ID"""
+        job_id = uuid.uuid4().hex
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._jobs[job_id] = {"status": "queued", "call": (fn, args), "result": None, "error": None,
+                                  "queued_at": now, "expires": now + self.ttl_seconds}
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+                self.rejected += 1
+            raise JobQueueFull(f"{self.name} queue is full")
+        return job_id
+
+    def status(self, job_id):
+        """Snapshot of a job, or None if unknown/expired"""
+        with self._lock:
+            job = self._live(job_id, time.monotonic())
+            return self._snapshot(job_id, job) if job is not None else None
+
+    def wait(self, job_id, timeout, seen=None):
+        """Block up to `timeout` seconds until the job has finished, or until
+        its status differs from `seen` if given; returns its latest snapshot"""
+        deadline = time.monotonic() + max(0.0, float(timeout))
+        with self._changed:
+            while True:
+                now = time.monotonic()
+                job = self._live(job_id, now)
+                if job is None:
+                    return None
+                changed = job["status"] != seen if seen is not None else job["status"] not in PENDING
+                if changed or now >= deadline:
+                    return self._snapshot(job_id, job)
+                self._changed.wait(deadline - now)
+
+    def hold_waiter(self):
+        """Take a waiter slot without blocking; False when all are in use"""
+        if self._waiter_slots is None or not self._waiter_slots.acquire(blocking=False):
+            with self._lock:
+                self.waiters_rejected += 1
+            return False
+        with self._lock:
+            self.waiters += 1
+        return True
+
+    def release_waiter(self):
+        with self._lock:
+            self.waiters -= 1
+        self._waiter_slots.release()
+
+    def discard(self, job_id):
+        """Drop a job; a queued job is not run. Returns False if unknown"""
+        with self._changed:
+            job = self._jobs.pop(job_id, None)
+            self._changed.notify_all()
+        return job is not None
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            statuses = [job["status"] for job in self._jobs.values()]
+            started = self.completed + self.failed
+            return {
+                "workers": len(self._workers),
+                "max_queue": self.max_queue,
+                "ttl_seconds": self.ttl_seconds,
+                "queued": statuses.count("queued"),
+                "running": statuses.count("running"),
+                "finished": len(statuses) - statuses.count("queued") - statuses.count("running"),
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "expirations": self.expirations,
+                "waiters": self.waiters,
+                "max_waiters": self.max_waiters,
+                "waiters_rejected": self.waiters_rejected,
+                "avg_wait_ms": round(1000.0 * self._wait_total / started, 3) if started else 0.0,
+                "avg_run_ms": round(1000.0 * self._run_total / started, 3) if started else 0.0,
+            }
+
+    def _snapshot(self, job_id, job):
+        snapshot = {"job_id": job_id, "status": job["status"],
+                    "expires_in": round(max(0.0, job["expires"] - time.monotonic()), 1)}
+        if job["status"] == "done":
+            snapshot["result"] = job["result"]
+        elif job["status"] == "failed":
+            snapshot["error"] = job["error"]
+        return snapshot
+
+    def _live(self, job_id, now):
+        job = self._jobs.get(job_id)
+        if job is not None and job["status"] != "running" and job["expires"] <= now:
+            del self._jobs[job_id]
+            self.expirations += 1
+            return None
+        return job
+
+    def _expire(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["status"] != "running" and job["expires"] <= now]
+        for job_id in expired:
+            del self._jobs[job_id]
+        self.expirations += len(expired)
+
+    # Worker loop
+    def _yield(self):
+        """Let foreground work run first, without starving the queue"""
+        deadline = time.monotonic() + self.max_yield_s
+        while self.busy is not None and self.busy() and time.monotonic() < deadline:
+            time.sleep(0.002)
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            self._yield()
+            started = time.monotonic()
+            with self._changed:
+                job = self._live(job_id, started)
+                if job is None:
+                    # Expired or discarded while queued
+                    continue
+                job["status"] = "running"
+                fn, args = job.pop("call")
+                self._changed.notify_all()
+
+            try:
+                result, error = fn(*args), None
+            except Exception as e:
+                print(f"Error in {self.name} job: {e}")
+                result, error = None, str(e)
+
+            finished = time.monotonic()
+            with self._changed:
+                job.update(status="done" if error is None else "failed", result=result, error=error,
+                           expires=finished + self.ttl_seconds)
+                if error is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self._wait_total += started - job["queued_at"]
+                self._run_total += finished - started
+                self._changed.notify_all()
+
+
+def waiters_busy_response(jobs):
+    return jsonify({"error": f"Too many clients waiting on {jobs.name} jobs, poll without waiting"}), 503, \
+        {"Retry-After": "1"}
+
+
+def job_response(jobs, job_id, wait=0.0):
+    """Job status for polling: 200 once finished, 202 while pending, 404 if unknown/expired.
+    A long-poll (wait > 0) needs a waiter slot, else 503"""
+    if wait > 0:
+        if not jobs.hold_waiter():
+            return waiters_busy_response(jobs)
+        try:
+            snapshot = jobs.wait(job_id, wait)
+        finally:
+            jobs.release_waiter()
+    else:
+        snapshot = jobs.status(job_id)
+    if snapshot is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    if snapshot["status"] in PENDING:
+        return jsonify(snapshot), 202, {"Retry-After": "1"}
+    return payload_response(snapshot)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def job_events(jobs, job_id, heartbeat_s=5.0, max_seconds=30.0):
+    """Server-sent events for a job: one event per status change, ending with
+    `done`, `failed` or `expired`; comment lines keep idle connections open.
+    The stream holds a waiter slot until it is closed, else 503"""
+    snapshot = jobs.status(job_id)
+    if snapshot is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    if not jobs.hold_waiter():
+        return waiters_busy_response(jobs)
+
+    def generate():
+        current = snapshot
+        deadline = time.monotonic() + max_seconds
+        yield sse_event(current["status"], current)
+        while current["status"] in PENDING and time.monotonic() < deadline:
+            latest = jobs.wait(job_id, heartbeat_s, seen=current["status"])
+            if latest is None:
+                yield sse_event("expired", {"job_id": job_id})
+                return
+            if latest["status"] == current["status"]:
+                yield ": keep-alive\n\n"
+            else:
+                yield sse_event(latest["status"], latest)
+            current = latest
+
+    response = Response(generate(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Runs when the server closes the response, even if the stream never started
+    response.call_on_close(jobs.release_waiter)
+    return response
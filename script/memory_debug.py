@@ -0,0 +1,126 @@
+import gc
+import os
+import sys
+import resource
+import threading
+import tracemalloc
+
+from flask import g, jsonify, request
+
+import buffers
+from metrics import Histogram
+
+# MEMORY_DEBUG=1 adds GET /debug/memory: process RSS, scratch buffers, gc
+# state, open matplotlib figures and, from tracing Python allocations
+# (including NumPy arrays, not TensorFlow's), the top allocation sites and the
+# growth since the previous ?diff=1 call. Each request's traced peak goes to a
+# histogram. Tracing slows requests down and the endpoint exposes process
+# internals, so neither is enabled by default.
+MEMORY_DEBUG = os.environ.get("MEMORY_DEBUG", "0") == "1"
+MEMORY_TRACE_FRAMES = int(os.environ.get("MEMORY_TRACE_FRAMES", 1))
+MEMORY_TOP = 15
+PEAK_BUCKETS = tuple(2 ** power for power in range(16, 31, 2))
+
+REQUEST_PEAK_BYTES = Histogram("neurofind_request_traced_peak_bytes",
+                               "Peak traced Python/NumPy memory during a request (MEMORY_DEBUG=1)",
+                               ("endpoint",), buckets=PEAK_BUCKETS)
+
+_baseline = {"snapshot": None}
+_baseline_lock = threading.Lock()
+# tracemalloc keeps one peak per process; overlapping requests share it
+_active = {"requests": 0}
+_active_lock = threading.Lock()
+
+
+def rss_bytes():
+    """Current resident set size, from /proc where available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss_bytes():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def open_figures():
+    """Open matplotlib figures, if anything in the process imported pyplot"""
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    return len(pyplot.get_fignums()) if pyplot is not None else None
+
+
+def allocation_sites(stats):
+    return [{
+        "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+        "bytes": getattr(stat, "size_diff", stat.size),
+        "total_bytes": stat.size,
+        "blocks": stat.count,
+    } for stat in stats[:MEMORY_TOP]]
+
+
+def memory_report(diff=False):
+    report = {
+        "rss_bytes": rss_bytes(),
+        "max_rss_bytes": max_rss_bytes(),
+        "scratch_buffers": buffers.stats(),
+        "gc": {"counts": list(gc.get_count()), "garbage": len(gc.garbage)},
+        "matplotlib_figures": open_figures(),
+        "tracemalloc": None,
+    }
+    if not tracemalloc.is_tracing():
+        return report
+
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ))
+    traced = {"current_bytes": current, "peak_bytes": peak,
+              "top": allocation_sites(snapshot.statistics("lineno"))}
+    if diff:
+        with _baseline_lock:
+            previous, _baseline["snapshot"] = _baseline["snapshot"], snapshot
+        # Sites that grew since the previous ?diff=1 call (the first call sets the baseline)
+        traced["growth"] = (allocation_sites(snapshot.compare_to(previous, "lineno"))
+                            if previous is not None else None)
+    report["tracemalloc"] = traced
+    return report
+
+
+def track_memory(app):
+    """GET /debug/memory and per-request traced peaks for a Flask app; a no-op unless MEMORY_DEBUG=1"""
+    if not MEMORY_DEBUG:
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(MEMORY_TRACE_FRAMES)
+
+    @app.before_request
+    def start_memory_peak():
+        with _active_lock:
+            _active["requests"] += 1
+            if _active["requests"] == 1:
+                tracemalloc.reset_peak()
+        g.memory_started = tracemalloc.get_traced_memory()[0]
+
+    @app.teardown_request
+    def finish_memory_peak(error=None):
+        started = g.pop("memory_started", None)
+        if started is None:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        with _active_lock:
+            _active["requests"] -= 1
+        REQUEST_PEAK_BYTES.observe(max(0, peak - started), request.endpoint or "unmatched")
+
+    def debug_memory():
+        """Memory usage report; ?diff=1 adds allocation growth since the previous diff call"""
+        if request.args.get("gc", "").lower() in ("1", "true", "yes"):
+            gc.collect()
+        diff = request.args.get("diff", "").lower() in ("1", "true", "yes")
+        return jsonify(memory_report(diff))
+
+    app.add_url_rule("/debug/memory", "debug_memory", debug_memory, methods=["GET"])
@@ -0,0 +1,202 @@
+import os
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+# Prometheus text-format metrics without a client library dependency.
+# stage() spans feed a histogram and, per request, the optional
+# Server-Timing header (SERVER_TIMING=1).
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def lines(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def lines(self):
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in sorted(self._series.items())]
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', repr(bound))])} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', '+Inf')])} {count}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {round(total, 6)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+class CollectedMetric:
+    """Values read from an existing stats() call at scrape time"""
+
+    def __init__(self, name, help_text, kind, labelnames, collect):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        REGISTRY.append(self)
+
+    def lines(self):
+        try:
+            values = list(self.collect())
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            return
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+REQUEST_SECONDS = Histogram("neurofind_request_seconds", "HTTP request latency", ("endpoint", "status"))
+STAGE_SECONDS = Histogram("neurofind_stage_seconds", "Time spent in each processing stage", ("service", "stage"))
+FALLBACKS = Counter("neurofind_fallbacks_total", "Heatmap fallback paths taken", ("service", "fallback"))
+# Counted by the code that handles a failure (count_error), once per failure; unhandled
+# exceptions show up as 5xx statuses in neurofind_request_seconds instead
+ERRORS = Counter("neurofind_errors_total", "Handled errors by processing stage", ("service", "stage"))
+CACHE_REQUESTS = Counter("neurofind_cache_requests_total", "Cache lookups by outcome", ("service", "cache", "outcome"))
+
+
+def render():
+    output = []
+    for metric in REGISTRY:
+        lines = list(metric.lines())
+        if not lines:
+            continue
+        output.append(f"# HELP {metric.name} {metric.help}")
+        output.append(f"# TYPE {metric.name} {metric.kind}")
+        output.extend(lines)
+    return "\n".join(output) + "\n"
+
+
+# Per-request stage timings (the request is handled on one thread)
+_trace = threading.local()
+
+
+@contextmanager
+def stage(service, name):
+    """Time a block (including one that raises); errors are counted with count_error()"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(seconds, service, name)
+        stages = getattr(_trace, "stages", None)
+        if stages is not None:
+            stages.append((f"{service}.{name}", seconds))
+
+
+def timed(service, name):
+    """Decorator form of stage()"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(service, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_fallback(service, fallback):
+    FALLBACKS.inc(service, fallback)
+
+
+def count_error(service, stage_name):
+    ERRORS.inc(service, stage_name)
+
+
+def count_cache(service, cache, hit):
+    CACHE_REQUESTS.inc(service, cache, "hit" if hit else "miss")
+
+
+def server_timing(stages, total_seconds):
+    """Server-Timing header value; repeated stages are summed"""
+    totals = {}
+    for name, seconds in stages:
+        totals[name] = totals.get(name, 0.0) + seconds
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def metrics_view():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+def instrument(app):
+    """Request latency histogram, Server-Timing header and GET /metrics for a Flask app"""
+
+    @app.before_request
+    def start_request_timing():
+        g.request_started = time.perf_counter()
+        _trace.stages = []
+
+    @app.after_request
+    def finish_request_timing(response):
+        started = g.pop("request_started", None)
+        stages, _trace.stages = getattr(_trace, "stages", None), None
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        REQUEST_SECONDS.observe(elapsed, request.endpoint or "unmatched", str(response.status_code))
+        if SERVER_TIMING and stages is not None:
+            response.headers["Server-Timing"] = server_timing(stages, elapsed)
+        return response
+
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
@@ -0,0 +1,200 @@
+import os
+import gzip
+import base64
+import struct
+
+from flask import Response, jsonify, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Response bodies for the prediction endpoints: JSON by default, or
+# MessagePack/CBOR when asked for (Accept header or `response_format` field).
+# In the binary formats base64 image/grid fields are sent as raw bytes.
+# Small encoders without a library dependency; they cover the types these
+# responses use (dict, list, str, bytes, int, float, bool, None).
+RESPONSE_FORMATS = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+    "cbor": "application/cbor",
+}
+BASE64_FIELDS = ("gradcam_visualization", "gradcam_grid", "class_heatmaps")
+
+# gzip (or br, when the brotli package is installed) for large responses
+COMPRESS_RESPONSES = os.environ.get("COMPRESS_RESPONSES", "1") == "1"
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+COMPRESSIBLE_TYPES = ("application/json", "application/msgpack", "application/cbor", "text/plain")
+
+
+def _plain(value):
+    """numpy scalars to Python numbers"""
+    if hasattr(value, "item") and not isinstance(value, (bytes, str)):
+        return value.item()
+    return value
+
+
+def encode_msgpack(value):
+    value = _plain(value)
+    if value is None:
+        return b"\xc0"
+    if value is True:
+        return b"\xc3"
+    if value is False:
+        return b"\xc2"
+    if isinstance(value, int):
+        if 0 <= value < 128 or -32 <= value < 0:
+            return struct.pack(">b" if value < 0 else ">B", value)
+        for code, fmt, low, high in ((0xcc, ">B", 0, 0xff), (0xcd, ">H", 0, 0xffff), (0xce, ">I", 0, 0xffffffff),
+                                     (0xd0, ">b", -0x80, 0x7f), (0xd1, ">h", -0x8000, 0x7fff),
+                                     (0xd2, ">i", -0x80000000, 0x7fffffff)):
+            if low <= value <= high:
+                return bytes([code]) + struct.pack(fmt, value)
+        return (b"\xcf" + struct.pack(">Q", value)) if value > 0 else (b"\xd3" + struct.pack(">q", value))
+    if isinstance(value, float):
+        return b"\xcb" + struct.pack(">d", value)
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        if len(data) < 32:
+            return bytes([0xa0 | len(data)]) + data
+        return _msgpack_length(len(data), 0xd9, 0xda, 0xdb) + data
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        data = bytes(value)
+        return _msgpack_length(len(data), 0xc4, 0xc5, 0xc6) + data
+    if isinstance(value, dict):
+        head = bytes([0x80 | len(value)]) if len(value) < 16 else _msgpack_length(len(value), None, 0xde, 0xdf)
+        return head + b"".join(encode_msgpack(str(k)) + encode_msgpack(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        head = bytes([0x90 | len(value)]) if len(value) < 16 else _msgpack_length(len(value), None, 0xdc, 0xdd)
+        return head + b"".join(encode_msgpack(v) for v in value)
+    raise TypeError(f"Cannot encode {type(value).__name__} as MessagePack")
+
+
+def _msgpack_length(length, code8, code16, code32):
+    if code8 is not None and length < 0x100:
+        return bytes([code8, length])
+    if length < 0x10000:
+        return bytes([code16]) + struct.pack(">H", length)
+    return bytes([code32]) + struct.pack(">I", length)
+
+
+def encode_cbor(value):
+    value = _plain(value)
+    if value is None:
+        return b"\xf6"
+    if value is True:
+        return b"\xf5"
+    if value is False:
+        return b"\xf4"
+    if isinstance(value, int):
+        return _cbor_head(0, value) if value >= 0 else _cbor_head(1, -1 - value)
+    if isinstance(value, float):
+        return b"\xfb" + struct.pack(">d", value)
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        return _cbor_head(3, len(data)) + data
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        data = bytes(value)
+        return _cbor_head(2, len(data)) + data
+    if isinstance(value, dict):
+        return _cbor_head(5, len(value)) + b"".join(encode_cbor(str(k)) + encode_cbor(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return _cbor_head(4, len(value)) + b"".join(encode_cbor(v) for v in value)
+    raise TypeError(f"Cannot encode {type(value).__name__} as CBOR")
+
+
+def _cbor_head(major, number):
+    if number < 24:
+        return bytes([major << 5 | number])
+    for extra, fmt, limit in ((24, ">B", 0x100), (25, ">H", 0x10000), (26, ">I", 0x100000000)):
+        if number < limit:
+            return bytes([major << 5 | extra]) + struct.pack(fmt, number)
+    return bytes([major << 5 | 27]) + struct.pack(">Q", number)
+
+
+ENCODERS = {"msgpack": encode_msgpack, "cbor": encode_cbor}
+
+
+def raw_fields(value):
+    """Copy of a response with the base64 fields decoded to bytes"""
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if key in BASE64_FIELDS and isinstance(item, str):
+                result[key] = base64.b64decode(item)
+            elif key in BASE64_FIELDS and isinstance(item, dict):
+                result[key] = {k: base64.b64decode(v) if isinstance(v, str) else v for k, v in item.items()}
+            else:
+                result[key] = raw_fields(item)
+        return result
+    if isinstance(value, list):
+        return [raw_fields(item) for item in value]
+    return value
+
+
+def response_format():
+    """Requested body format: `response_format` field, then the Accept header"""
+    requested = (request.form.get("response_format") or request.args.get("response_format") or "").lower()
+    if requested in RESPONSE_FORMATS:
+        return requested
+    best = request.accept_mimetypes.best_match(list(RESPONSE_FORMATS.values()), default=RESPONSE_FORMATS["json"])
+    return next(name for name, mimetype in RESPONSE_FORMATS.items() if mimetype == best)
+
+
+def payload_response(payload, status=200, headers=None):
+    """Flask response for a successful result in the requested format"""
+    body_format = response_format()
+    if body_format == "json":
+        response = jsonify(payload)
+    else:
+        response = Response(ENCODERS[body_format](raw_fields(payload)), mimetype=RESPONSE_FORMATS[body_format])
+    response.status_code = status
+    response.headers.extend(headers or {})
+    response.vary.add("Accept")
+    return response
+
+
+def accepted_encoding(header):
+    """Best content coding we can produce for an Accept-Encoding header"""
+    offered = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            offered[name.strip().lower()] = quality
+    for coding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if offered.get(coding, offered.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+def compress(app):
+    """Compress large JSON/MessagePack/CBOR/text responses of a Flask app"""
+    if not COMPRESS_RESPONSES:
+        return
+
+    @app.after_request
+    def compress_response(response):
+        if response.direct_passthrough or response.is_streamed or "Content-Encoding" in response.headers:
+            return response
+        if response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+        response.vary.add("Accept-Encoding")
+        coding = accepted_encoding(request.headers.get("Accept-Encoding"))
+        data = response.get_data()
+        if coding is None or len(data) < COMPRESS_MIN_BYTES:
+            return response
+        if coding == "br":
+            data = brotli.compress(data, quality=min(COMPRESS_LEVEL, 11))
+        else:
+            data = gzip.compress(data, compresslevel=min(max(COMPRESS_LEVEL, 1), 9))
+        response.set_data(data)
+        response.headers["Content-Encoding"] = coding
+        return response
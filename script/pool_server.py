@@ -0,0 +1,321 @@
+from flask import Flask, request, jsonify, Response
+from flask_cors import CORS
+import numpy as np
+import os
+import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from waitress import serve
+from worker_pool import WorkerPool, PoolBusy, WorkerError, WORKER_TIMEOUT
+from heatmap_store import HeatmapStore
+from result_cache import ResultCache
+from render import render_options, mime_type
+from payloads import payload_response, compress
+from memory_debug import track_memory
+from validators import create_validator, INVALID_MESSAGE
+from metrics import instrument, stage, count_cache, count_error, CollectedMetric
+from preprocessing import (interpret_score, SUBCLASS_CLASSES,
+                           binary_preprocess_image, binary_preprocess_dicom,
+                           subclass_preprocess_image, subclass_preprocess_dicom)
+from uploads import (configure_app, read_upload, decode_image, file_extension,
+                     UploadTooLarge, IMAGE_EXTENSIONS, DICOM_EXTENSIONS)
+
+# Multi-process serving: this front end parses and preprocesses uploads without
+# TensorFlow; model workers (worker_pool.py) run inference and rendering
+app = Flask(__name__)
+CORS(app)
+configure_app(app)
+# Front-end stages only; model time shows up as the "worker" stage
+instrument(app)
+compress(app)
+# MEMORY_DEBUG=1: GET /debug/memory and per-request allocation tracing
+track_memory(app)
+
+WORKERS = int(os.environ.get("WORKERS", 0)) or max(1, (os.cpu_count() or 2) // 2)
+SERVER_PORT = int(os.environ.get("SERVER_PORT", 5000))
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", 8))
+# Result cache for repeat uploads; set RESULT_CACHE_DIR to keep results across restarts
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 64))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR") or None
+VALIDATION_WORKERS = int(os.environ.get("VALIDATION_WORKERS", 4))
+
+heatmap_store = HeatmapStore(
+    max_bytes=int(float(os.environ.get("HEATMAP_STORE_MB", 64)) * 1024 * 1024),
+    ttl_seconds=float(os.environ.get("HEATMAP_TTL_SECONDS", 600)),
+)
+# One cache for both models (keys include the model version). Cached subclass
+# results carry the heatmap itself, so entries stay valid after a restart.
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_SIZE,
+    disk_dir=os.path.join(RESULT_CACHE_DIR, "pool") if RESULT_CACHE_DIR else None,
+)
+mri_validator = create_validator()
+validation_executor = ThreadPoolExecutor(max_workers=VALIDATION_WORKERS, thread_name_prefix="validate")
+
+# Started from __main__; workers are spawned processes
+pool = None
+CollectedMetric("neurofind_pool_slots_in_use", "Worker pool shared-memory slots in use", "gauge", (),
+                lambda: [((), pool.stats()["slots_in_use"])] if pool is not None else [])
+
+
+def read_upload_file():
+    if "file" not in request.files:
+        return None, None, "No file uploaded", 400
+    file = request.files["file"]
+    if file.filename == "":
+        return None, None, "No selected file", 400
+    file_ext = file_extension(file.filename)
+    if file_ext not in IMAGE_EXTENSIONS + DICOM_EXTENSIONS:
+        return None, None, "Unsupported file format. Please upload a JPG, PNG, or DICOM file.", 400
+    try:
+        return read_upload(file), file_ext, None, 200
+    except UploadTooLarge as e:
+        return None, None, str(e), 413
+
+
+def validate_mri(image_bgr, content_key):
+    try:
+        return mri_validator.validate(image_bgr, content_key)
+    except Exception as e:
+        print(f"Error during MRI validation: {e}")
+        return False, f"Error validating image: {str(e)}"
+
+
+def preprocess(data, file_ext, preprocess_image, preprocess_dicom, validate=False):
+    """Model input, companion array and (for images) a validation future"""
+    if file_ext in DICOM_EXTENSIONS:
+        return preprocess_dicom(data) + (None,)
+    image_bgr = decode_image(data)
+    if image_bgr is None:
+        return None, None, None
+    validation = None
+    if validate:
+        validation = validation_executor.submit(validate_mri, image_bgr, hashlib.sha256(data).hexdigest())
+    return preprocess_image(image_bgr) + (validation,)
+
+
+def validation_error(validation):
+    if validation is None:
+        return None
+    is_mri, message = validation.result()
+    return None if is_mri else message
+
+
+def run_task(model_name, inputs, params):
+    """(outputs, meta, error response)"""
+    try:
+        with stage(model_name, "worker"):
+            outputs, meta = pool.run(model_name, inputs, params, timeout=WORKER_TIMEOUT)
+        return outputs, meta, None
+    except PoolBusy as e:
+        return None, None, (jsonify({"error": f"Server is busy ({e}), please retry"}), 503, {"Retry-After": "1"})
+    except TimeoutError:
+        count_error(model_name, "worker")
+        return None, None, (jsonify({"error": "Model worker timed out"}), 504)
+    except WorkerError:
+        count_error(model_name, "worker")
+        raise
+
+
+def binary_request(mode, options, cache_options):
+    data, file_ext, error, status_code = read_upload_file()
+    if error:
+        return jsonify({"error": error}), status_code
+
+    key = None
+    if "binary" in pool.versions:
+        key = ResultCache.make_key(data, pool.versions["binary"], cache_options)
+        cached = result_cache.get(key)
+        count_cache("binary", "result", cached is not None)
+        if cached is not None:
+            return payload_response(cached, 200, {"X-Cache": "hit"})
+
+    with stage("binary", "preprocess"):
+        preprocessed_img, original_img, validation = preprocess(
+            data, file_ext, binary_preprocess_image, binary_preprocess_dicom, validate=True)
+    if preprocessed_img is None:
+        if file_ext in IMAGE_EXTENSIONS:
+            # Not a decodable JPEG/PNG despite the extension
+            return jsonify({"error": INVALID_MESSAGE}), 400
+        return jsonify({"error": "Error processing image"}), 500
+
+    outputs, meta, error_response = run_task(
+        "binary",
+        {"input": preprocessed_img, "original": original_img},
+        {"mode": mode, "options": options, "layer_name": request.form.get("layer_name")},
+    )
+    if error_response:
+        return error_response
+
+    # Discard the result if the image is not an MRI scan
+    error = validation_error(validation)
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Grid fields come back in meta, an encoded image through shared memory
+    explanation = dict(meta)
+    if "gradcam_grid" not in explanation:
+        explanation["gradcam_visualization"] = outputs["gradcam"].decode("ascii") or None
+    explained = bool(explanation.get("gradcam_grid") or explanation.get("gradcam_visualization"))
+    if mode == "gradcam":
+        if not explained:
+            return jsonify({"error": "Failed to generate Grad-CAM visualization", "gradcam_visualization": None}), 500
+        response = explanation
+    else:
+        pred_value = float(np.ravel(outputs["scores"])[0])
+        predicted_label, confidence = interpret_score(pred_value)
+        response = {
+            "prediction": predicted_label,
+            "confidence": round(float(confidence), 2),
+            "raw_score": pred_value,
+            "is_valid_mri": True,
+            **explanation
+        }
+        if not explained:
+            response["gradcam_error"] = "Could not generate visualization"
+
+    # Fallback heatmaps are not Grad-CAM and are never cached
+    if key is not None and explained and "gradcam_fallback" not in explanation:
+        result_cache.put(key, response)
+    return payload_response(response, 200, {"X-Cache": "miss"})
+
+
+@app.route("/predict", methods=["POST"])
+def predict():
+    try:
+        options = render_options(request.form)
+        return binary_request("predict", options, dict(options, endpoint="predict"))
+    except Exception as e:
+        print(f"Error during prediction: {str(e)}")
+        return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
+
+
+@app.route("/gradcam", methods=["POST"])
+def get_gradcam():
+    try:
+        options = render_options(request.form)
+        layer_name = request.form.get("layer_name", None)
+        return binary_request("gradcam", options, dict(options, endpoint="gradcam", layer_name=layer_name))
+    except Exception as e:
+        print(f"Error generating Grad-CAM: {str(e)}")
+        return jsonify({"error": f"Grad-CAM generation failed: {str(e)}"}), 500
+
+
+@app.route("/subclass_predict", methods=["POST"])
+def subclass_predict():
+    try:
+        data, file_ext, error, status_code = read_upload_file()
+        if error:
+            return jsonify({"error": error}), status_code
+
+        all_classes = request.form.get("all_classes", "false").lower() in ("1", "true", "yes")
+        options = render_options(request.form, format="jpeg")
+
+        key = None
+        if "subclass" in pool.versions:
+            key = ResultCache.make_key(data, pool.versions["subclass"], dict(options, all_classes=all_classes))
+            cached = result_cache.get(key)
+            count_cache("subclass", "result", cached is not None)
+            if cached is not None:
+                heatmap_id = heatmap_store.put(base64.b64decode(cached["heatmap"]), cached["heatmap_mime_type"])
+                return payload_response(dict(cached["response"], heatmap_url=f"/gradcam_heatmap/{heatmap_id}"),
+                                        200, {"X-Cache": "hit"})
+
+        with stage("subclass", "preprocess"):
+            preprocessed_img, brain_mask, _ = preprocess(data, file_ext, subclass_preprocess_image, subclass_preprocess_dicom)
+        if preprocessed_img is None:
+            if file_ext in IMAGE_EXTENSIONS:
+                return jsonify({"error": "Failed to decode image"}), 400
+            return jsonify({"error": "Failed to preprocess image"}), 500
+
+        outputs, meta, error_response = run_task(
+            "subclass",
+            {"input": preprocessed_img, "brain_mask": brain_mask},
+            {"all_classes": all_classes, "options": options},
+        )
+        if error_response:
+            return error_response
+
+        scores = outputs["scores"]
+        class_index = int(np.argmax(scores))
+        heatmap_id = heatmap_store.put(outputs["heatmap"], meta["heatmap_mime_type"])
+        response = {
+            "prediction": SUBCLASS_CLASSES[class_index],
+            "confidence": round(float(scores[class_index]) * 100, 2),
+            "class_probabilities": {label: round(float(prob) * 100, 2) for label, prob in zip(SUBCLASS_CLASSES, scores)},
+            "heatmap_url": f"/gradcam_heatmap/{heatmap_id}"
+        }
+        if meta["heatmap_fallback"]:
+            response["heatmap_fallback"] = True
+        response.update(meta.get("grid", {}))
+        if all_classes:
+            if meta["class_heatmaps"]:
+                response["class_heatmaps"] = {label: outputs[f"class:{label}"].decode("ascii") for label in SUBCLASS_CLASSES}
+                response["class_heatmaps_mime_type"] = mime_type(options)
+            else:
+                response["class_heatmaps_error"] = "Could not generate per-class heatmaps"
+
+        # Only real GradCAM results are cached, not the fallback template
+        if key is not None and not meta["heatmap_fallback"]:
+            result_cache.put(key, {
+                "response": {k: v for k, v in response.items() if k != "heatmap_url"},
+                "heatmap": base64.b64encode(outputs["heatmap"]).decode("utf-8"),
+                "heatmap_mime_type": meta["heatmap_mime_type"],
+            })
+        return payload_response(response, 200, {"X-Cache": "miss"})
+
+    except Exception as e:
+        print(f"Error in prediction: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/gradcam_heatmap/<heatmap_id>", methods=["GET"])
+def get_heatmap(heatmap_id):
+    stored = heatmap_store.get(heatmap_id)
+    if stored is None:
+        return jsonify({"error": "Heatmap unavailable"}), 404
+    data, mimetype = stored
+    return Response(data, mimetype=mimetype, headers={"Cache-Control": "private, max-age=600"})
+
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    return jsonify({"error": "Uploaded file is too large"}), 413
+
+
+@app.route("/health/live", methods=["GET"])
+def liveness():
+    return jsonify({"status": "alive"})
+
+
+@app.route("/health/ready", methods=["GET"])
+def readiness():
+    if pool is None or not pool.is_ready():
+        return jsonify({"status": "starting workers"}), 503
+    return jsonify({"status": "ready"})
+
+
+@app.route("/health", methods=["GET"])
+def health_check():
+    return jsonify({
+        "status": "healthy",
+        "workers": pool.stats() if pool is not None else None,
+        "model_versions": pool.versions if pool is not None else {},
+        "result_cache": result_cache.stats(),
+        "heatmap_store": heatmap_store.stats(),
+        "validator": mri_validator.stats()
+    })
+
+
+if __name__ == "__main__":
+    pool = WorkerPool(WORKERS, warmup=os.environ.get("WARMUP", "1") == "1")
+    print(f"Started {WORKERS} model workers ({pool.intra_threads} intra-op threads each)")
+    print(f"Front end running on http://127.0.0.1:{SERVER_PORT}")
+    try:
+        if os.environ.get("SERVER_MODE", "waitress").lower() == "async":
+            from async_server import serve_async
+            serve_async(app, host="127.0.0.1", port=SERVER_PORT)
+        else:
+            serve(app, host="127.0.0.1", port=SERVER_PORT, threads=SERVER_THREADS)
+    finally:
+        pool.close()
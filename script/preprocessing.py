@@ -0,0 +1,97 @@
+import numpy as np
+
+from uploads import resize_rgb
+from dicom_loader import DicomScan, scale_frame
+from brain_mask import brain_mask as compute_brain_mask
+
+# Model inputs and labels, kept free of TensorFlow so HTTP front ends can
+# preprocess uploads without loading the models
+BINARY_IMG_SIZE = 256
+SUBCLASS_IMG_SIZE = 128
+DEMENTED_LABEL = "VAD-Demented"
+NON_DEMENTED_LABEL = "Non-Demented"
+SUBCLASS_CLASSES = [
+    "Hemorrhagic Dementia",
+    "Binswanger Dementia",
+    "Strategic Dementia",
+    "Subcortical Dementia"
+]
+
+def model_input(image):
+    """(1, H, W, 3) float32 model input in one allocation: uint8 RGB images are
+    scaled to [0, 1], float frames in [0, 1] are copied (grayscale to all channels)"""
+    batch = np.empty((1,) + image.shape[:2] + (3,), dtype=np.float32)
+    if image.dtype == np.uint8:
+        np.divide(image, 255, out=batch[0], dtype=np.float32)
+    else:
+        batch[0] = image[:, :, np.newaxis] if image.ndim == 2 else image
+    return batch
+
+def interpret_score(pred_value):
+    """Label and confidence (%) for a sigmoid score"""
+    if pred_value > 0.5:
+        return DEMENTED_LABEL, pred_value * 100
+    return NON_DEMENTED_LABEL, (1 - pred_value) * 100
+
+# Binary model (256x256, scaled to [0, 1])
+def binary_preprocess_image(image_bgr, image_rgb=None):
+    """Process decoded JPEG/PNG images (image_rgb: already resized to BINARY_IMG_SIZE)"""
+    try:
+        original_img = image_rgb if image_rgb is not None else resize_rgb(image_bgr, BINARY_IMG_SIZE)
+        return model_input(original_img), original_img
+    except Exception as e:
+        print(f"Error preprocessing image: {e}")
+        return None, None
+
+def binary_preprocess_dicom(dicom_bytes):
+    """Process DICOM images (the first frame of multi-frame files)"""
+    try:
+        scan = DicomScan(dicom_bytes)
+        return binary_preprocess_dicom_pixels(scan.frame(), scan)
+    except Exception as e:
+        print(f"Error processing DICOM file: {e}")
+        return None, None
+
+def binary_preprocess_dicom_pixels(pixel_array, scan=None):
+    """Process one DICOM slice's stored pixel data (scan: its DicomScan, for rescale/window)"""
+    try:
+        original_img = scale_frame(pixel_array, BINARY_IMG_SIZE, scan)
+        
+        # Grayscale is repeated to RGB in the model input only
+        return model_input(original_img), original_img
+    except Exception as e:
+        print(f"Error processing DICOM file: {e}")
+        return None, None
+
+# Subclass model (128x128, plus a brain mask for the heatmaps)
+def subclass_preprocess_image(image_bgr, image_rgb=None):
+    # image_rgb: the upload already resized to SUBCLASS_IMG_SIZE by a shared decode
+    if image_rgb is None:
+        image_rgb = resize_rgb(image_bgr, SUBCLASS_IMG_SIZE)
+    # Brain mask carried along for the heatmaps
+    brain_mask = compute_brain_mask(image_rgb)
+    return model_input(image_rgb), brain_mask
+
+# Process DICOM files (the first frame of multi-frame files)
+def subclass_preprocess_dicom(dicom_bytes):
+    try:
+        scan = DicomScan(dicom_bytes)
+        return subclass_preprocess_dicom_pixels(scan.frame(), scan)
+    except Exception as e:
+        print(f"Error processing DICOM: {e}")
+        return None, None
+
+# Process one DICOM slice's stored pixel data (scan: its DicomScan, for rescale/window)
+def subclass_preprocess_dicom_pixels(pixel_array, scan=None):
+    try:
+        # Resize and scale to [0, 1] the same way as for the binary model
+        img_resized = scale_frame(pixel_array, SUBCLASS_IMG_SIZE, scan)
+        
+        # Brain mask carried along for the heatmaps
+        brain_mask = compute_brain_mask(img_resized)
+        
+        # Grayscale is repeated to RGB by model_input
+        return model_input(img_resized), brain_mask
+    except Exception as e:
+        print(f"Error processing DICOM: {e}")
+        return None, None
@@ -0,0 +1,194 @@
+import os
+import time
+import threading
+
+from result_cache import file_version
+
+# Prefer a converted "<model>.fast" directory (see convert_models.py) when present
+FAST_MODEL_LOAD = os.environ.get("FAST_MODEL_LOAD", "1") == "1"
+FAST_MODEL_SUFFIX = ".fast"
+
+# Prediction backend: "keras", or "tflite" to score with the TFLITE_MODE export
+# from export_tflite.py. Only prediction-only requests (deferred Grad-CAM, volumes,
+# batches without heatmaps) use TFLite; requests with Grad-CAM take their scores
+# from the Keras Grad-CAM pass, which computes them anyway.
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "keras").lower()
+TFLITE_MODE = os.environ.get("TFLITE_MODE", "dynamic").lower()
+# Keras predictions through a compiled fixed-signature function (compiled_predictor.py)
+COMPILED_PREDICT = os.environ.get("COMPILED_PREDICT", "1") == "1"
+
+
+def load_keras_model(path):
+    import tensorflow as tf
+    return tf.keras.models.load_model(path)
+
+
+def fast_model_dir(path):
+    return os.path.splitext(path)[0] + FAST_MODEL_SUFFIX
+
+
+def save_fast_model(model, path):
+    """Write a model's architecture (JSON) and weights (npz) next to `path`.
+
+    Rebuilding from the JSON config and assigning the arrays skips the HDF5
+    parsing and compile step of load_model, which dominates cold start.
+    """
+    import numpy as np
+    directory = fast_model_dir(path)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "model.json"), "w", encoding="utf-8") as f:
+        f.write(model.to_json())
+    np.savez(os.path.join(directory, "weights.npz"), *model.get_weights())
+    # Tie the converted copy to the exact source file it came from
+    with open(os.path.join(directory, "source.txt"), "w", encoding="utf-8") as f:
+        f.write(file_version(path))
+    return directory
+
+
+def load_fast_model(path):
+    """Model from the converted directory for `path`, or None if missing or stale"""
+    directory = fast_model_dir(path)
+    try:
+        with open(os.path.join(directory, "source.txt"), "r", encoding="utf-8") as f:
+            if f.read().strip() != file_version(path):
+                print(f"Ignoring stale converted model in {directory}")
+                return None
+        with open(os.path.join(directory, "model.json"), "r", encoding="utf-8") as f:
+            config = f.read()
+    except FileNotFoundError:
+        return None
+
+    import numpy as np
+    import tensorflow as tf
+    try:
+        model = tf.keras.models.model_from_json(config)
+        with np.load(os.path.join(directory, "weights.npz")) as weights:
+            model.set_weights([weights[f"arr_{i}"] for i in range(len(weights.files))])
+        return model
+    except Exception as e:
+        print(f"Error loading converted model from {directory}: {e}")
+        return None
+
+
+class ServedModel:
+    """A loaded model and the objects used to serve it"""
+
+    def __init__(self, name, model, version, input_size, path=None, source="h5", load_seconds=None):
+        self.name = name
+        self.model = model
+        self.version = version
+        self.input_size = input_size
+        self.path = path
+        self.source = source
+        self.load_seconds = load_seconds
+        # TFLite interpreter used for predictions when INFERENCE_BACKEND=tflite
+        self.tflite = None
+        # CompiledPredictor used for Keras predictions
+        self.predictor = None
+        # Filled in by the service that owns the model
+        self.gradcam = None
+        self.scheduler = None
+
+    @property
+    def backend(self):
+        return f"tflite-{TFLITE_MODE}" if self.tflite is not None else "keras"
+
+    def predict(self, batch):
+        """Scores for a batch from the selected backend"""
+        if self.tflite is not None:
+            return self.tflite.predict(batch)
+        if self.predictor is not None:
+            return self.predictor.predict(batch)
+        return self.model.predict(batch, verbose=0)
+
+    def warmup_predict(self, batch_size):
+        """Run the prediction path once before serving, up to `batch_size` rows"""
+        import numpy as np
+        if self.tflite is None and self.predictor is not None:
+            self.predictor.warmup(batch_size)
+        else:
+            self.predict(np.zeros((batch_size,) + tuple(self.model.input_shape[1:]), dtype=np.float32))
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "input_size": self.input_size,
+            "source": self.source,
+            "backend": self.backend,
+            "load_seconds": self.load_seconds,
+            "gradcam": self.gradcam is not None,
+            "batching": self.scheduler is not None,
+            "predictor": self.predictor.stats() if self.predictor is not None else None,
+        }
+
+
+class ModelRegistry:
+    """Models served by this process, keyed by name.
+
+    A model file is loaded at most once per process, so services that are
+    imported into the same server share TensorFlow and the loaded weights.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        self._by_path = {}
+
+    def load(self, name, path, loader=None, input_size=None):
+        """Load `path` (once) and register it as `name`"""
+        with self._lock:
+            served = self._models.get(name)
+            if served is not None:
+                return served
+
+            started = time.perf_counter()
+            key = os.path.realpath(path)
+            model, source = self._by_path.get(key, (None, None))
+            if model is None:
+                model = load_fast_model(path) if FAST_MODEL_LOAD else None
+                source = "fast" if model is not None else "h5"
+                if model is None:
+                    model = (loader or load_keras_model)(path)
+                self._by_path[key] = (model, source)
+            load_seconds = round(time.perf_counter() - started, 3)
+            print(f"Loaded model '{name}' ({source}) in {load_seconds} s")
+
+            if input_size is None:
+                input_size = int(model.input_shape[1])
+            served = ServedModel(name, model, file_version(path), input_size, path, source, load_seconds)
+            if INFERENCE_BACKEND == "tflite":
+                from tflite_backend import load_tflite
+                served.tflite = load_tflite(path, TFLITE_MODE)
+            if served.tflite is None and COMPILED_PREDICT:
+                from compiled_predictor import CompiledPredictor
+                try:
+                    served.predictor = CompiledPredictor(model, name)
+                except Exception as e:
+                    print(f"Error compiling predictor for '{name}', using Model.predict: {e}")
+            self._models[name] = served
+            return served
+
+    def get(self, name):
+        with self._lock:
+            return self._models[name]
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._models
+
+    def names(self):
+        with self._lock:
+            return list(self._models)
+
+    def input_sizes(self):
+        """Distinct input sizes, largest first"""
+        with self._lock:
+            return sorted({served.input_size for served in self._models.values()}, reverse=True)
+
+    def stats(self):
+        with self._lock:
+            return {name: served.stats() for name, served in self._models.items()}
+
+
+# Process-wide registry shared by app.py, subclass.py and server.py
+registry = ModelRegistry()
@@ -0,0 +1,133 @@
+import os
+import base64
+
+import cv2
+import numpy as np
+
+# Output defaults; each can be overridden per request
+RENDER_FORMAT = os.environ.get("RENDER_FORMAT", "png").lower()
+RENDER_PNG_COMPRESSION = int(os.environ.get("RENDER_PNG_COMPRESSION", 3))
+RENDER_QUALITY = int(os.environ.get("RENDER_QUALITY", 90))
+RENDER_PANEL_SIZE = int(os.environ.get("RENDER_PANEL_SIZE", 384))
+RENDER_GAP = 4
+# Heatmap output: the side-by-side panel, the overlay alone, or the raw
+# Grad-CAM grid at the conv layer's resolution for the client to upsample
+RENDER_HEATMAP = os.environ.get("RENDER_HEATMAP", "panel").lower()
+HEATMAP_FORMATS = ("panel", "overlay", "grid")
+GRID_DTYPES = ("uint8", "float16")
+
+FORMATS = {
+    "png": (".png", "image/png"),
+    "jpeg": (".jpg", "image/jpeg"),
+    "jpg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+}
+
+
+def render_options(form=None, **defaults):
+    """Encoding options from env defaults, call-site defaults and request fields"""
+    options = {
+        "format": RENDER_FORMAT,
+        "png_compression": RENDER_PNG_COMPRESSION,
+        "quality": RENDER_QUALITY,
+        "panel_size": RENDER_PANEL_SIZE,
+        "heatmap": RENDER_HEATMAP,
+        "grid_dtype": "uint8",
+    }
+    options.update(defaults)
+    if form is not None:
+        if form.get("image_format"):
+            options["format"] = form.get("image_format").lower()
+        if form.get("heatmap_format"):
+            options["heatmap"] = form.get("heatmap_format").lower()
+        if form.get("grid_dtype"):
+            options["grid_dtype"] = form.get("grid_dtype").lower()
+        for field, key in (("png_compression", "png_compression"),
+                           ("image_quality", "quality"),
+                           ("image_size", "panel_size")):
+            value = form.get(field)
+            if value:
+                try:
+                    options[key] = int(value)
+                except ValueError:
+                    pass
+
+    if options["format"] not in FORMATS:
+        options["format"] = "png"
+    if options["heatmap"] not in HEATMAP_FORMATS:
+        options["heatmap"] = "panel"
+    if options["grid_dtype"] not in GRID_DTYPES:
+        options["grid_dtype"] = "uint8"
+    options["png_compression"] = min(max(options["png_compression"], 0), 9)
+    options["quality"] = min(max(options["quality"], 1), 100)
+    options["panel_size"] = min(max(options["panel_size"], 32), 2048)
+    return options
+
+
+def mime_type(options):
+    return FORMATS[options["format"]][1]
+
+
+def side_by_side(left_rgb, right_rgb, panel_size=None, gap=RENDER_GAP):
+    """Two RGB images resized to square panels and joined on a white gap"""
+    panels = []
+    for img in (left_rgb, right_rgb):
+        if panel_size and img.shape[:2] != (panel_size, panel_size):
+            interpolation = cv2.INTER_AREA if img.shape[0] > panel_size else cv2.INTER_LINEAR
+            img = cv2.resize(img, (panel_size, panel_size), interpolation=interpolation)
+        panels.append(img)
+
+    height = panels[0].shape[0]
+    spacer = np.full((height, gap, 3), 255, dtype=np.uint8)
+    return np.hstack([panels[0], spacer, panels[1]])
+
+
+def encode_image(image_bgr, options):
+    """Encode a BGR uint8 image with the requested format and quality"""
+    ext = FORMATS[options["format"]][0]
+    if ext == ".png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, options["png_compression"]]
+    elif ext == ".jpg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, options["quality"]]
+    else:
+        params = [cv2.IMWRITE_WEBP_QUALITY, options["quality"]]
+
+    ok, buffer = cv2.imencode(ext, image_bgr, params)
+    if not ok:
+        raise ValueError(f"Could not encode image as {options['format']}")
+    return buffer.tobytes()
+
+
+def encode_base64(image_bgr, options):
+    return base64.b64encode(encode_image(image_bgr, options)).decode("utf-8")
+
+
+def render_comparison(original_rgb, overlay_rgb, options):
+    """Base64 side-by-side original + overlay composite"""
+    composite = side_by_side(original_rgb, overlay_rgb, options["panel_size"])
+    return encode_base64(cv2.cvtColor(composite, cv2.COLOR_RGB2BGR), options)
+
+
+def render_overlay(overlay_rgb, options):
+    """Base64 overlay panel alone, for clients that already show the original"""
+    size = options["panel_size"]
+    if overlay_rgb.shape[:2] != (size, size):
+        interpolation = cv2.INTER_AREA if overlay_rgb.shape[0] > size else cv2.INTER_LINEAR
+        overlay_rgb = cv2.resize(overlay_rgb, (size, size), interpolation=interpolation)
+    return encode_base64(cv2.cvtColor(overlay_rgb, cv2.COLOR_RGB2BGR), options)
+
+
+def grid_fields(cam, options):
+    """Response fields for a raw Grad-CAM map: min-max scaled to [0, 1] and
+    sent as row-major uint8 (0-255) or little-endian float16, base64 encoded"""
+    grid = np.maximum(np.asarray(cam, dtype=np.float32), 0)
+    grid = (grid - grid.min()) / (grid.max() - grid.min() + 1e-10)
+    if options["grid_dtype"] == "float16":
+        data = grid.astype("<f2")
+    else:
+        data = np.round(grid * 255).astype(np.uint8)
+    return {
+        "gradcam_grid": base64.b64encode(data.tobytes()).decode("utf-8"),
+        "gradcam_grid_shape": list(grid.shape),
+        "gradcam_grid_dtype": options["grid_dtype"],
+    }
@@ -0,0 +1,211 @@
+from flask import Flask, request, jsonify
+from flask_cors import CORS
+import numpy as np
+import os
+import hashlib
+from waitress import serve
+from registry import registry
+from metrics import instrument, stage
+from render import render_options
+from payloads import payload_response, compress
+from memory_debug import track_memory
+from uploads import configure_app, decode_image, resize_rgb_sizes, UndecodableImage, IMAGE_EXTENSIONS
+from dicom_loader import DicomScan
+from preprocessing import DEMENTED_LABEL
+
+# Both services in one process: TensorFlow is imported once and each model is
+# loaded once into the shared registry
+import app as binary_service
+import subclass as subclass_service
+
+SERVER_PORT = int(os.environ.get("SERVER_PORT", 5000))
+SERVER_THREADS = int(os.environ.get("SERVER_THREADS", 8))
+SERVER_MODE = os.environ.get("SERVER_MODE", "waitress").lower()
+
+server = Flask(__name__)
+CORS(server)
+configure_app(server)
+# One /metrics for both services (their metrics share a registry)
+instrument(server)
+compress(server)
+# MEMORY_DEBUG=1: GET /debug/memory and per-request allocation tracing
+track_memory(server)
+
+
+def mount(service, prefix):
+    """Serve a service's routes (except /health, /metrics and /debug) from the combined server"""
+    for rule in service.app.url_map.iter_rules():
+        if rule.endpoint in ("static", "metrics", "debug_memory") or rule.rule.startswith("/health"):
+            continue
+        server.add_url_rule(
+            rule.rule,
+            endpoint=f"{prefix}.{rule.endpoint}",
+            view_func=service.app.view_functions[rule.endpoint],
+            methods=sorted(rule.methods - {"HEAD", "OPTIONS"}),
+        )
+
+mount(binary_service, "binary")
+mount(subclass_service, "subclass")
+
+
+class SharedUpload:
+    """One decode of an upload, preprocessed per model on demand.
+
+    Images are converted to RGB once and resized to every registered input
+    size; the DICOM header is parsed once and its first frame preprocessed per model.
+    """
+
+    def __init__(self, data, file_ext):
+        self.image_bgr = None
+        self.resized = {}
+        self.scan = None
+        self.pixel_array = None
+        self.validation = None
+        if file_ext in IMAGE_EXTENSIONS:
+            with stage("cascade", "decode"):
+                self.image_bgr = decode_image(data)
+            if self.image_bgr is None:
+                raise UndecodableImage(binary_service.INVALID_MESSAGE)
+            # Validate MRI for image files while preprocessing and inference run
+            self.validation = binary_service.validation_executor.submit(
+                binary_service.validate_mri, self.image_bgr, hashlib.sha256(data).hexdigest())
+            with stage("cascade", "resize"):
+                self.resized = resize_rgb_sizes(self.image_bgr, registry.input_sizes())
+        else:
+            with stage("cascade", "decode"):
+                self.scan = DicomScan(data)
+                self.pixel_array = self.scan.frame()
+
+    def preprocess(self, service):
+        """Model input and the service's companion array (original image or brain mask)"""
+        if self.image_bgr is not None:
+            return service.preprocess_image(self.image_bgr, self.resized[service.IMG_SIZE])
+        return service.preprocess_dicom_pixels(self.pixel_array, self.scan)
+
+
+def run_subclass(upload):
+    """Subclass prediction and heatmap ID for a shared upload"""
+    with stage("subclass", "preprocess"):
+        preprocessed_img, brain_mask = upload.preprocess(subclass_service)
+    if preprocessed_img is None:
+        raise ValueError("Failed to preprocess image")
+
+    with stage("subclass", "inference"):
+        prediction, cams, _ = subclass_service.predict_and_explain(preprocessed_img)
+
+    class_index = int(np.argmax(prediction[0]))
+    heatmap_id, fallback = subclass_service.store_prediction_heatmap(cams, preprocessed_img, class_index, brain_mask)
+    result = {
+        "prediction": subclass_service.CLASSES[class_index],
+        "confidence": round(float(prediction[0][class_index]) * 100, 2),
+        "class_probabilities": {label: round(float(prob) * 100, 2)
+                                for label, prob in zip(subclass_service.CLASSES, prediction[0])},
+        "heatmap_url": f"/gradcam_heatmap/{heatmap_id}"
+    }
+    if fallback:
+        result["heatmap_fallback"] = True
+    return result
+
+
+@server.route("/cascade_predict", methods=["POST"])
+def cascade_predict():
+    """Binary prediction; the subclass model runs only for VAD-Demented scans"""
+    try:
+        data, file_ext, error, status_code = binary_service.read_upload_file()
+        if error:
+            return jsonify({"error": error}), status_code
+        options = render_options(request.form)
+
+        try:
+            upload = SharedUpload(data, file_ext)
+        except UndecodableImage as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            print(f"Error decoding upload: {e}")
+            return jsonify({"error": "Error processing image"}), 500
+
+        with stage("binary", "preprocess"):
+            preprocessed_img, original_img = upload.preprocess(binary_service)
+        if preprocessed_img is None:
+            return jsonify({"error": "Error processing image"}), 500
+
+        with stage("binary", "inference"):
+            prediction, cam = registry.get("binary").scheduler(preprocessed_img)
+
+        # Discard the result if the image is not an MRI scan
+        error = binary_service.validation_error(upload.validation)
+        if error:
+            return jsonify({"error": error}), 400
+
+        pred_value = float(np.ravel(prediction)[0])
+        predicted_label, confidence = binary_service.interpret_score(pred_value)
+        explanation = binary_service.gradcam_fields(
+            cam[0] if cam is not None else None, preprocessed_img, original_img, options)
+
+        response = {
+            "prediction": predicted_label,
+            "is_valid_mri": True,
+            "binary": {
+                "prediction": predicted_label,
+                "confidence": round(float(confidence), 2),
+                "raw_score": pred_value,
+                **explanation
+            },
+            "subclass": None
+        }
+
+        if predicted_label == DEMENTED_LABEL:
+            response["subclass"] = run_subclass(upload)
+            response["prediction"] = response["subclass"]["prediction"]
+
+        return payload_response(response)
+
+    except Exception as e:
+        print(f"Error during cascade prediction: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
+
+
+@server.errorhandler(413)
+def upload_too_large(error):
+    return jsonify({"error": "Uploaded file is too large"}), 413
+
+
+def warmup():
+    binary_service.warmup()
+    subclass_service.warmup()
+
+
+@server.route("/health/live", methods=["GET"])
+def liveness():
+    return jsonify({"status": "alive"})
+
+
+@server.route("/health/ready", methods=["GET"])
+def readiness():
+    if not (binary_service.is_ready() and subclass_service.is_ready()):
+        return jsonify({"status": "warming up"}), 503
+    return jsonify({"status": "ready", "models": registry.names()})
+
+
+@server.route("/health", methods=["GET"])
+def health_check():
+    return jsonify({
+        "status": "healthy",
+        "models": registry.stats(),
+        "binary": binary_service.health_check().get_json(),
+        "subclass": subclass_service.health_check().get_json()
+    })
+
+
+# Run the combined server
+if __name__ == "__main__":
+    if binary_service.WARMUP:
+        warmup()
+    print(f"Serving models {registry.names()} on http://127.0.0.1:{SERVER_PORT}")
+    if SERVER_MODE == "async":
+        from async_server import serve_async
+        serve_async(server, host="127.0.0.1", port=SERVER_PORT)
+    else:
+        serve(server, host="127.0.0.1", port=SERVER_PORT, threads=SERVER_THREADS)
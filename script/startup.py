@@ -0,0 +1,113 @@
+# Fast-start entry point: listen first, load models in the background.
+#
+#     python startup.py [server|app|subclass]
+#
+# The port opens before TensorFlow is imported. /health/live answers at once;
+# /health/ready and every other route return 503 (with Retry-After) until the
+# target module is imported, its models are loaded and warmed up.
+import os
+import sys
+import json
+import time
+import importlib
+import threading
+
+from waitress import serve
+
+# target: (module, WSGI attribute, default port)
+TARGETS = {
+    "server": ("server", "server", 5000),
+    "app": ("app", "app", 5000),
+    "subclass": ("subclass", "app", 5001),
+}
+STARTUP_RETRY_AFTER = int(os.environ.get("STARTUP_RETRY_AFTER", 5))
+
+
+class LazyApp:
+    """WSGI app that imports and warms up the real app in a background thread"""
+
+    def __init__(self, module_name, attribute, warmup=True):
+        self.module_name = module_name
+        self.attribute = attribute
+        self.warmup = warmup
+        self.app = None
+        self.state = "starting"
+        self.error = None
+        self.timings = {}
+        self._started = time.perf_counter()
+
+    def start(self):
+        threading.Thread(target=self._load, name="model-loader", daemon=True).start()
+        return self
+
+    def _load(self):
+        try:
+            self.state = "loading"
+            started = time.perf_counter()
+            module = importlib.import_module(self.module_name)
+            self.timings["load_seconds"] = round(time.perf_counter() - started, 3)
+
+            if self.warmup and hasattr(module, "warmup"):
+                self.state = "warming up"
+                started = time.perf_counter()
+                module.warmup()
+                self.timings["warmup_seconds"] = round(time.perf_counter() - started, 3)
+
+            self.app = getattr(module, self.attribute)
+            self.state = "ready"
+            self.timings["ready_after_seconds"] = round(time.perf_counter() - self._started, 3)
+            print(f"{self.module_name} ready: {self.timings}")
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.state = "failed"
+            self.error = str(e)
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path == "/health/live":
+            return self._json(start_response, "200 OK", {"status": "alive", "state": self.state})
+        if path == "/health/ready":
+            if self.app is None:
+                return self._json(start_response, "503 Service Unavailable",
+                                  {"status": self.state, "error": self.error})
+            return self._json(start_response, "200 OK", {"status": "ready", **self.timings})
+        if self.app is not None:
+            return self.app(environ, start_response)
+
+        error = "Service failed to start" if self.state == "failed" else "Service is starting, models are loading"
+        return self._json(start_response, "503 Service Unavailable", {"error": error},
+                          [("Retry-After", str(STARTUP_RETRY_AFTER))])
+
+    @staticmethod
+    def _json(start_response, status, payload, extra_headers=()):
+        body = json.dumps(payload).encode("utf-8")
+        start_response(status, [
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(body))),
+            ("Access-Control-Allow-Origin", "*"),
+            *extra_headers,
+        ])
+        return [body]
+
+
+def main():
+    target = sys.argv[1] if len(sys.argv) > 1 else "server"
+    if target not in TARGETS:
+        print(f"Unknown target {target}, expected one of {', '.join(TARGETS)}")
+        sys.exit(2)
+
+    module_name, attribute, default_port = TARGETS[target]
+    port = int(os.environ.get("SERVER_PORT", default_port))
+    lazy_app = LazyApp(module_name, attribute, warmup=os.environ.get("WARMUP", "1") == "1").start()
+
+    print(f"Listening on http://127.0.0.1:{port}, loading {module_name} in the background")
+    if os.environ.get("SERVER_MODE", "waitress").lower() == "async":
+        from async_server import serve_async
+        serve_async(lazy_app, host="127.0.0.1", port=port)
+    else:
+        serve(lazy_app, host="127.0.0.1", port=port, threads=int(os.environ.get("SERVER_THREADS", 8)))
+
+
+if __name__ == "__main__":
+    main()
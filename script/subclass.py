@@ -1,77 +1,95 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import tensorflow as tf
 import numpy as np
 import os
 import cv2
-from tensorflow.keras.preprocessing import image
-from pydicom import dcmread
+import base64
+import time
 from waitress import serve
-from tensorflow.keras.models import Model
+from gradcam import GradCamEngine
+from render import render_options, encode_image, encode_base64, grid_fields, mime_type
+from payloads import payload_response, compress
+from memory_debug import track_memory
+from heatmap_store import HeatmapStore
+from result_cache import ResultCache
+from registry import registry
+from metrics import instrument, stage, timed, count_fallback, count_error, count_cache, CollectedMetric
+from volume import (iter_slices, batched, TopK, VolumeTooLarge,
+                    ARCHIVE_EXTENSIONS, VOLUME_BATCH_SIZE, VOLUME_TOP_K)
+from uploads import (configure_app, read_upload, decode_image, file_extension, upload_limit,
+                     UploadTooLarge, UndecodableImage, DICOM_EXTENSIONS, MAX_BATCH_UPLOAD_BYTES)
+from batch_uploads import batch_files, stream_batch, result_record
+from brain_mask import brain_mask as compute_brain_mask, prior_heatmap
+from buffers import scaled_uint8
+from preprocessing import (SUBCLASS_IMG_SIZE, SUBCLASS_CLASSES as CLASSES,
+                           subclass_preprocess_image as preprocess_image,
+                           subclass_preprocess_dicom as preprocess_dicom,
+                           subclass_preprocess_dicom_pixels as preprocess_dicom_pixels)
 
 # Initialize Flask App
 app = Flask(__name__)
 CORS(app)
+configure_app(app)
+# Request/stage latency histograms and GET /metrics
+instrument(app)
+# gzip/br for large responses (COMPRESS_RESPONSES=0 to disable)
+compress(app)
+# MEMORY_DEBUG=1: GET /debug/memory and per-request allocation tracing
+track_memory(app)
 
+IMG_SIZE = SUBCLASS_IMG_SIZE
 SUBCLASS_MODEL_PATH = os.path.join(os.getcwd(), "VGG16_4_real_subclass.h5")
-subclass_model = tf.keras.models.load_model(SUBCLASS_MODEL_PATH)
+# Loaded once per process, shared with server.py
+subclass_served = registry.load("subclass", SUBCLASS_MODEL_PATH, input_size=IMG_SIZE)
+subclass_model = subclass_served.model
+# Cached results are only reused for the same model file and backend
+SUBCLASS_MODEL_VERSION = f"{subclass_served.version}:{subclass_served.backend}"
 
-print("Model layers:")
-for i, layer in enumerate(subclass_model.layers):
-    print(f"Layer {i}: {layer.name} ({type(layer).__name__})")
+if os.environ.get("PRINT_MODEL_LAYERS", "0") == "1":
+    print("Model layers:")
+    for i, layer in enumerate(subclass_model.layers):
+        print(f"Layer {i}: {layer.name} ({type(layer).__name__})")
 
-IMG_SIZE = 128
-HEATMAP_PATH = os.path.join(os.getcwd(), "gradcam_heatmap.jpg")
-COMBINED_HEATMAP_PATH = os.path.join(os.getcwd(), "combined_heatmap.jpg")
+GRADCAM_CACHE_SIZE = int(os.environ.get("GRADCAM_CACHE_SIZE", 4))
+# Run dummy predict/GradCAM passes before serving so the first request is not slow
+WARMUP = os.environ.get("WARMUP", "1") == "1"
 
-# Image preprocessing function
-def preprocess_image(img_path):
-    img = image.load_img(img_path, target_size=(IMG_SIZE, IMG_SIZE))
-    img_array = image.img_to_array(img) / 255.0
-    
-    # Create a brain mask for later use
-    gray_img = cv2.cvtColor(np.uint8(img_array*255), cv2.COLOR_RGB2GRAY)
-    _, brain_mask = cv2.threshold(gray_img, 15, 255, cv2.THRESH_BINARY)
-    kernel = np.ones((5,5), np.uint8)
-    brain_mask = cv2.morphologyEx(brain_mask, cv2.MORPH_CLOSE, kernel)
-    
-    cv2.imwrite("brain_mask.jpg", brain_mask)
-    
-    img_array = np.expand_dims(img_array, axis=0)
-    return img_array, brain_mask
+# Encoded heatmaps are kept in memory per request, bounded by size and age
+HEATMAP_STORE_MB = float(os.environ.get("HEATMAP_STORE_MB", 64))
+HEATMAP_TTL_SECONDS = float(os.environ.get("HEATMAP_TTL_SECONDS", 600))
+heatmap_store = HeatmapStore(
+    max_bytes=int(HEATMAP_STORE_MB * 1024 * 1024),
+    ttl_seconds=HEATMAP_TTL_SECONDS,
+)
+CollectedMetric("neurofind_heatmap_store_bytes", "Bytes held by the heatmap store", "gauge", (),
+                lambda: [((), heatmap_store.stats()["bytes"])])
 
-# Process DICOM files
-def preprocess_dicom(dicom_path):
-    try:
-        dicom_data = dcmread(dicom_path)
-        pixel_array = dicom_data.pixel_array
-        
-        # Normalize the image
-        if np.max(pixel_array) > 0:
-            pixel_array = pixel_array / np.max(pixel_array)
-        
-        # Resize to target size
-        img_resized = cv2.resize(pixel_array, (IMG_SIZE, IMG_SIZE))
-        
-        # Create a brain mask for later use
-        _, brain_mask = cv2.threshold(np.uint8(img_resized*255), 15, 255, cv2.THRESH_BINARY)
-        kernel = np.ones((5,5), np.uint8)
-        brain_mask = cv2.morphologyEx(brain_mask, cv2.MORPH_CLOSE, kernel)
-        
-        # Save mask for debugging
-        cv2.imwrite("brain_mask.jpg", brain_mask)
-        
-        # Convert to RGB by repeating the channel
-        if len(img_resized.shape) == 2:
-            img_rgb = np.stack((img_resized,) * 3, axis=-1)
-        else:
-            img_rgb = img_resized
-            
-        img_reshaped = np.expand_dims(img_rgb, axis=0)
-        return img_reshaped, brain_mask
-    except Exception as e:
-        print(f"Error processing DICOM: {e}")
-        return None, None
+# "async" serves the same routes behind a bounded admission queue (async_server.py)
+SERVER_MODE = os.environ.get("SERVER_MODE", "waitress").lower()
+
+# Result cache for repeat uploads; set RESULT_CACHE_DIR to keep results across restarts
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 64))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR") or None
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_SIZE,
+    disk_dir=os.path.join(RESULT_CACHE_DIR, "subclass") if RESULT_CACHE_DIR else None,
+)
+
+# Encode an overlay and keep it in the heatmap store
+def store_heatmap(image_bgr, options=None):
+    if options is None:
+        options = render_options(format="jpeg")
+    return heatmap_store.put(encode_image(image_bgr, options), mime_type(options))
+
+# Placeholder image with a short message
+def message_image(*lines):
+    blank = np.ones((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8) * 255
+    y = IMG_SIZE // 2 - 10 if len(lines) > 1 else IMG_SIZE // 2
+    for line in lines:
+        cv2.putText(blank, line, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+        y += 30
+    return blank
 
 # Find the target layer for GradCAM
 def find_target_layer(model):
@@ -96,140 +114,133 @@ def find_target_layer(model):
     
     return model.layers[-1].name
 
-# Improved GradCAM implementation
-def generate_accurate_gradcam(img_array, model, class_index, brain_mask=None):
+# Improved GradCAM implementation; None when no GradCAM map could be computed
+def generate_accurate_gradcam(img_array, engine, class_index, brain_mask=None, layer_name=None, options=None):
     try:
-        # Get the last convolutional layer
-        target_layer_name = find_target_layer(model)
+        # The target layer is resolved once when the engine is created
+        target_layer_name = layer_name or engine.default_layer
         
         if not target_layer_name:
             print("Could not find appropriate target layer for GradCAM")
+            count_fallback("subclass", "no_target_layer")
             return None
         
-        if target_layer_name == 'vgg16':
-            vgg_layer = model.get_layer('vgg16')
-            
-            if hasattr(vgg_layer, 'output'):
-                grad_model = Model(
-                    inputs=model.inputs,
-                    outputs=[vgg_layer.output, model.output]
-                )
-            else:
-                print("VGG16 layer doesn't have expected structure, using fallback")
-                return generate_fallback_gradcam(img_array, brain_mask)
-        else:
-            grad_model = Model(
-                inputs=model.inputs,
-                outputs=[
-                    model.get_layer(target_layer_name).output,
-                    model.output
-                ]
-            )
-        
-        # Record operations for automatic differentiation
-        with tf.GradientTape() as tape:
-            conv_outputs, predictions = grad_model(img_array)
-            target_class_output = predictions[:, class_index]
-        
-        grads = tape.gradient(target_class_output, conv_outputs)
-        
-        # Vector of mean gradients for each filter
-        pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-        
-        # Weight output feature maps with gradients
-        weighted_output = tf.reduce_sum(
-            tf.multiply(pooled_grads, conv_outputs[0]),
-            axis=-1
-        )
-        
-        # Create heatmap
-        heatmap = np.maximum(weighted_output.numpy(), 0)
-        
-        # Normalize heatmap
-        if np.max(heatmap) > 0:
-            heatmap = heatmap / np.max(heatmap)
-        
-        heatmap_resized = cv2.resize(heatmap, (IMG_SIZE, IMG_SIZE))
-        
-        if brain_mask is not None:
-            # Convert brain mask to binary (0 or 1)
-            binary_mask = brain_mask > 0
-            
-            heatmap_resized = heatmap_resized * (binary_mask.astype(float)/255)
-        
-        heatmap_resized = np.clip(heatmap_resized, 0, 1)
-        
-        heatmap_8bit = np.uint8(255 * heatmap_resized)
-        colored_heatmap = cv2.applyColorMap(heatmap_8bit, cv2.COLORMAP_JET)
-        
-        # Save colored heatmap
-        cv2.imwrite(HEATMAP_PATH, colored_heatmap)
-        
-        # Get the original image for overlay
-        orig_img = np.uint8(img_array[0] * 255)
-        
-        # Overlap heatmap and original image
-        alpha = 0.6  # transparency factor
-        overlaid_img = cv2.addWeighted(orig_img, 1 - alpha, colored_heatmap, alpha, 0)
-        
-        # Save the overlaid image
-        cv2.imwrite(COMBINED_HEATMAP_PATH, overlaid_img)
+        _, cams = engine.explain(img_array, class_indices=[class_index], layer_name=target_layer_name)
+        if cams is None:
+            print("Gradients are None, using fallback")
+            count_fallback("subclass", "no_gradients")
+            return None
         
-        return COMBINED_HEATMAP_PATH
+        return save_gradcam_heatmap(cams[0], img_array, brain_mask, options)
     
     except Exception as e:
         print(f"Error generating GradCAM: {e}")
+        count_error("subclass", "gradcam")
         import traceback
         traceback.print_exc()
-        # Use fallback method
-        return generate_fallback_gradcam(img_array, brain_mask)
+        return None
+
+# Render a raw GradCAM map and save the heatmap and overlay
+def render_gradcam_overlay(cam, img_array, brain_mask=None):
+    # Create heatmap
+    heatmap = np.maximum(cam, 0)
+    
+    # Normalize heatmap
+    if np.max(heatmap) > 0:
+        heatmap = heatmap / np.max(heatmap)
+    
+    heatmap_resized = cv2.resize(heatmap, (IMG_SIZE, IMG_SIZE))
+    
+    if brain_mask is not None:
+        # Zero the heatmap outside the brain
+        heatmap_resized[brain_mask == 0] = 0
+    
+    np.clip(heatmap_resized, 0, 1, out=heatmap_resized)
+    
+    heatmap_8bit = scaled_uint8(heatmap_resized, "overlay.heatmap")
+    colored_heatmap = cv2.applyColorMap(heatmap_8bit, cv2.COLORMAP_JET)
+    
+    # Get the original image for overlay
+    orig_img = scaled_uint8(img_array[0], "overlay.original")
+    
+    # Overlap heatmap and original image
+    alpha = 0.6  # transparency factor
+    overlaid_img = cv2.addWeighted(orig_img, 1 - alpha, colored_heatmap, alpha, 0)
+    
+    return colored_heatmap, overlaid_img
+
+@timed("subclass", "heatmap")
+def save_gradcam_heatmap(cam, img_array, brain_mask=None, options=None):
+    _, overlaid_img = render_gradcam_overlay(cam, img_array, brain_mask)
+    
+    # Keep the overlaid image for this request
+    return store_heatmap(overlaid_img, options)
+
+# Class scores, the predicted class's GradCAM map and (optionally) every class's map,
+# all from one Keras forward pass. The GradCAM pass already produces the scores, so
+# the TFLite backend is only used on prediction-only paths (subclass_served.predict).
+def predict_and_explain(img_array, all_classes=False):
+    try:
+        if all_classes:
+            prediction, all_cams = subclass_gradcam.explain_all_classes(img_array)
+            if all_cams is None:
+                return prediction, None, None
+            return prediction, all_cams[:, np.argmax(prediction[0])], all_cams[0]
+        
+        prediction, cams = subclass_gradcam.explain(img_array)
+        return prediction, cams, None
+    except Exception as e:
+        print(f"Error in fused GradCAM step, predicting without it: {e}")
+        count_error("subclass", "gradcam")
+        return subclass_served.predict(img_array), None, None
+
+# Heatmap ID for a prediction and whether it is a fallback rather than GradCAM.
+# Falls back to the prior template when no GradCAM map could be computed.
+def store_prediction_heatmap(cams, img_array, class_index, brain_mask=None, options=None):
+    try:
+        if cams is not None:
+            heatmap_id = save_gradcam_heatmap(cams[0], img_array, brain_mask, options=options)
+        else:
+            heatmap_id = generate_accurate_gradcam(
+                img_array,
+                subclass_gradcam,
+                class_index,
+                brain_mask,
+                options=options
+            )
+    except Exception as e:
+        print(f"Error in primary GradCAM method: {e}. Using fallback method.")
+        count_error("subclass", "gradcam")
+        heatmap_id = None
+    
+    if heatmap_id is None:
+        return generate_fallback_gradcam(img_array, brain_mask, options), True
+    return heatmap_id, False
+
+# Per-class GradCAM overlays as base64 images
+@timed("subclass", "class_heatmaps")
+def encode_class_heatmaps(class_cams, classes, img_array, brain_mask=None, options=None):
+    if options is None:
+        options = render_options(format="jpeg")
+    class_heatmaps = {}
+    for label, cam in zip(classes, class_cams):
+        _, overlaid_img = render_gradcam_overlay(cam, img_array, brain_mask)
+        class_heatmaps[label] = encode_base64(overlaid_img, options)
+    return class_heatmaps
 
 # Fallback GradCAM implementation if the accurate one fails
-def generate_fallback_gradcam(img_array, brain_mask=None):
+@timed("subclass", "fallback_heatmap")
+def generate_fallback_gradcam(img_array, brain_mask=None, options=None):
+    count_fallback("subclass", "prior_heatmap")
     try:
         # Get original image
-        orig_img = np.uint8(img_array[0] * 255)
+        orig_img = scaled_uint8(img_array[0], "fallback.original")
         
         if brain_mask is None:
-            gray_img = cv2.cvtColor(orig_img, cv2.COLOR_RGB2GRAY)
-            _, brain_mask = cv2.threshold(gray_img, 15, 255, cv2.THRESH_BINARY)
-            kernel = np.ones((5,5), np.uint8)
-            brain_mask = cv2.morphologyEx(brain_mask, cv2.MORPH_CLOSE, kernel)
+            brain_mask = compute_brain_mask(img_array[0])
         
-        heatmap = np.zeros((IMG_SIZE, IMG_SIZE), dtype=np.uint8)
-        
-        # Get binary mask of brain region
-        binary_mask = brain_mask > 0
-        
-        y, x = np.ogrid[:IMG_SIZE, :IMG_SIZE]
-        
-        # Find the center of the brain mask
-        brain_pixels = np.argwhere(binary_mask)
-        if len(brain_pixels) > 0:
-            center_y, center_x = np.mean(brain_pixels, axis=0).astype(int)
-        else:
-            center_y, center_x = IMG_SIZE // 2, IMG_SIZE // 2
-        
-        # distance Calaculation
-        ventricle_dist = np.sqrt((y - center_y)**2 + (x - center_x)**2)
-        ventricle_weight = np.exp(-ventricle_dist**2 / (2*(IMG_SIZE/6)**2))
-        
-        frontal_y, frontal_x = center_y - IMG_SIZE//5, center_x
-        frontal_dist = np.sqrt((y - frontal_y)**2 + (x - frontal_x)**2)
-        frontal_weight = np.exp(-frontal_dist**2 / (2*(IMG_SIZE/5)**2))
-        
-        left_temp_y, left_temp_x = center_y, center_x - IMG_SIZE//3
-        right_temp_y, right_temp_x = center_y, center_x + IMG_SIZE//3
-        
-        left_temp_dist = np.sqrt((y - left_temp_y)**2 + (x - left_temp_x)**2)
-        right_temp_dist = np.sqrt((y - right_temp_y)**2 + (x - right_temp_x)**2)
-        
-        temp_dist = np.minimum(left_temp_dist, right_temp_dist)
-        temp_weight = np.exp(-temp_dist**2 / (2*(IMG_SIZE/6)**2))
-        
-        combined_weight = 0.5 * ventricle_weight + 0.3 * temp_weight + 0.2 * frontal_weight
-        
-        heatmap[binary_mask] = np.uint8(combined_weight[binary_mask] * 255)
+        # Anatomical priors centered on the brain mask
+        heatmap = prior_heatmap(brain_mask)
         
         # Apply colormap
         colored_heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
@@ -237,24 +248,65 @@ def generate_fallback_gradcam(img_array, brain_mask=None):
         alpha = 0.6
         overlaid_img = cv2.addWeighted(orig_img, 1 - alpha, colored_heatmap, alpha, 0)
         
-        # Save images
-        cv2.imwrite(HEATMAP_PATH, colored_heatmap)
-        cv2.imwrite(COMBINED_HEATMAP_PATH, overlaid_img)
-        
-        return COMBINED_HEATMAP_PATH
+        # Keep the overlaid image for this request
+        return store_heatmap(overlaid_img, options)
     
     except Exception as e:
         print(f"Error in fallback GradCAM: {e}")
+        count_fallback("subclass", "error_image")
         import traceback
         traceback.print_exc()
         
-        blank = np.ones((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8) * 255
-        cv2.putText(blank, "Error generating", (10, IMG_SIZE//2 - 10),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
-        cv2.putText(blank, "heatmap", (10, IMG_SIZE//2 + 20),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
-        cv2.imwrite(COMBINED_HEATMAP_PATH, blank)
-        return COMBINED_HEATMAP_PATH
+        return store_heatmap(message_image("Error generating", "heatmap"), options)
+
+# GradCAM engine: target layer resolved once, compiled steps cached per layer
+subclass_gradcam = GradCamEngine(
+    subclass_model,
+    default_layer=find_target_layer(subclass_model),
+    max_cached_layers=GRADCAM_CACHE_SIZE,
+)
+subclass_served.gradcam = subclass_gradcam
+
+warmup_state = {"done": False, "seconds": None}
+
+def is_ready():
+    return warmup_state["done"] or not WARMUP
+
+# Exercise predict, GradCAM and heatmap encoding once with a blank image
+def warmup():
+    started = time.perf_counter()
+    try:
+        dummy = np.zeros((1, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+        _, cams = subclass_gradcam.explain(dummy)
+        if cams is not None:
+            render_gradcam_overlay(cams[0], dummy)
+        subclass_gradcam.explain_all_classes(dummy)
+        
+        # Every padded batch shape (volume endpoint, batches and fallbacks)
+        subclass_served.warmup_predict(VOLUME_BATCH_SIZE)
+        encode_image(message_image("warm-up"), render_options(format="jpeg"))
+    except Exception as e:
+        print(f"Error during warm-up: {e}")
+    warmup_state["done"] = True
+    warmup_state["seconds"] = round(time.perf_counter() - started, 3)
+    print(f"Subclass model warm-up took {warmup_state['seconds']} s")
+
+# Model input and brain mask for uploaded image/DICOM bytes
+def preprocess_upload(data, file_ext):
+    if file_ext in DICOM_EXTENSIONS:
+        with stage("subclass", "preprocess"):
+            preprocessed_img, brain_mask = preprocess_dicom(data)
+    else:
+        with stage("subclass", "decode"):
+            image_bgr = decode_image(data)
+        if image_bgr is None:
+            raise UndecodableImage("Failed to decode image")
+        with stage("subclass", "preprocess"):
+            preprocessed_img, brain_mask = preprocess_image(image_bgr)
+    
+    if preprocessed_img is None:
+        raise Exception("Failed to preprocess image")
+    return preprocessed_img, brain_mask
 
 # Subclass prediction endpoint
 @app.route("/subclass_predict", methods=["POST"])
@@ -266,103 +318,288 @@ def subclass_predict():
     if file.filename == "":
         return jsonify({"error": "No selected file"}), 400
     
-    # Save uploaded file
-    file_path = os.path.join(os.getcwd(), file.filename)
-    file.save(file_path)
+    # Read uploaded file into memory
+    try:
+        with stage("subclass", "read_upload"):
+            data = read_upload(file)
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    
+    # Heatmaps for every class are optional
+    all_classes = request.form.get("all_classes", "false").lower() in ("1", "true", "yes")
+    options = render_options(request.form, format="jpeg")
+    
+    # Repeat uploads reuse the stored result and heatmap
+    cache_key = ResultCache.make_key(data, SUBCLASS_MODEL_VERSION, dict(options, all_classes=all_classes))
+    cached = result_cache.get(cache_key)
+    count_cache("subclass", "result", cached is not None)
+    if cached is not None:
+        heatmap_id = heatmap_store.put(base64.b64decode(cached["heatmap"]), cached["heatmap_mime_type"])
+        response = dict(cached["response"], heatmap_url=f"/gradcam_heatmap/{heatmap_id}")
+        return payload_response(response, 200, {"X-Cache": "hit"})
     
     try:
         # Process file based on extension
-        file_ext = os.path.splitext(file.filename)[-1].lower()
-        
-        if file_ext in ['.jpg', '.jpeg', '.png']:
-            preprocessed_img, brain_mask = preprocess_image(file_path)
-        elif file_ext == '.dcm':
-            preprocessed_img, brain_mask = preprocess_dicom(file_path)
-        else:
-            preprocessed_img, brain_mask = preprocess_image(file_path)  
-        
-        if preprocessed_img is None:
-            raise Exception("Failed to preprocess image")
-        
-        prediction = subclass_model.predict(preprocessed_img)
+        preprocessed_img, brain_mask = preprocess_upload(data, file_extension(file.filename))
         
-        # Define classes
-        classes = [
-            "Hemorrhagic Dementia",
-            "Binswanger Dementia",
-            "Strategic Dementia",
-            "Subcortical Dementia"
-        ]
+        # Class scores and GradCAM map(s)
+        with stage("subclass", "inference"):
+            prediction, cams, class_cams = predict_and_explain(preprocessed_img, all_classes)
         
         # Get results
         class_index = np.argmax(prediction)
-        predicted_class = classes[class_index]
+        predicted_class = CLASSES[class_index]
         confidence = round(float(np.max(prediction)) * 100, 2)
         
         class_probs = {label: round(float(prob) * 100, 2) 
-                      for label, prob in zip(classes, prediction[0])}
+                      for label, prob in zip(CLASSES, prediction[0])}
         
         # Generate GradCAM visualization
-        try:
-            heatmap_path = generate_accurate_gradcam(
-                preprocessed_img,
-                subclass_model,
-                class_index,
-                brain_mask
-            )
-        except Exception as e:
-            print(f"Error in primary GradCAM method: {e}. Using fallback method.")
-            # If that fails, use the fallback method
-            heatmap_path = generate_fallback_gradcam(preprocessed_img, brain_mask)
+        heatmap_id, fallback = store_prediction_heatmap(cams, preprocessed_img, class_index, brain_mask, options)
         
         # Return results with guaranteed heatmap URL
-        return jsonify({
+        response = {
             "prediction": predicted_class,
             "confidence": confidence,
             "class_probabilities": class_probs,
-            "heatmap_url": "/gradcam_heatmap"
-        })
+            "heatmap_url": f"/gradcam_heatmap/{heatmap_id}"
+        }
+        if fallback:
+            response["heatmap_fallback"] = True
+        # Raw map of the predicted class for clients that composite it themselves
+        if options["heatmap"] == "grid" and cams is not None:
+            response.update(grid_fields(cams[0], options))
+        
+        if all_classes:
+            if class_cams is not None:
+                response["class_heatmaps"] = encode_class_heatmaps(class_cams, CLASSES, preprocessed_img, brain_mask, options)
+                response["class_heatmaps_mime_type"] = mime_type(options)
+            else:
+                response["class_heatmaps_error"] = "Could not generate per-class heatmaps"
+        
+        # Only real GradCAM results are cached, not the fallback template
+        stored = heatmap_store.get(heatmap_id) if not fallback else None
+        if stored is not None:
+            result_cache.put(cache_key, {
+                "response": {k: v for k, v in response.items() if k != "heatmap_url"},
+                "heatmap": base64.b64encode(stored[0]).decode("utf-8"),
+                "heatmap_mime_type": stored[1],
+            })
+        
+        return payload_response(response, 200, {"X-Cache": "miss"})
     
+    except UndecodableImage as e:
+        # Not a decodable JPEG/PNG despite the extension
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error in prediction: {e}")
         import traceback
         traceback.print_exc()
         
-        blank = np.ones((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8) * 255
-        cv2.putText(blank, "Error processing", (10, IMG_SIZE//2 - 10),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
-        cv2.putText(blank, "image", (10, IMG_SIZE//2 + 20),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
-        cv2.imwrite(COMBINED_HEATMAP_PATH, blank)
+        heatmap_id = store_heatmap(message_image("Error processing", "image"))
         
         return jsonify({
             "error": str(e),
-            "heatmap_url": "/gradcam_heatmap"
+            "heatmap_url": f"/gradcam_heatmap/{heatmap_id}"
         }), 500
+
+# Volume endpoint: multi-frame DICOM or zipped DICOM series
+@app.route("/subclass_predict_volume", methods=["POST"])
+def subclass_predict_volume():
+    if "file" not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+    
+    file = request.files["file"]
+    if file_extension(file.filename) not in DICOM_EXTENSIONS + ARCHIVE_EXTENSIONS:
+        return jsonify({"error": "Please upload a DICOM file or a ZIP archive of a DICOM series."}), 400
+    
+    try:
+        data = read_upload(file)
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
     
-    finally:
-        if os.path.exists(file_path):
+    try:
+        top_k = max(0, int(request.form.get("top_k", VOLUME_TOP_K)))
+        
+        # Slices are decoded as they are needed and scored in batches; only
+        # the top-k candidates for GradCAM are kept in memory
+        slice_results = []
+        probabilities = []
+        top_slices = TopK(top_k)
+        for batch in batched(iter_slices(data, file.filename), VOLUME_BATCH_SIZE):
+            infos, inputs, masks = [], [], []
+            for info, pixels, scan in batch:
+                preprocessed_img, brain_mask = preprocess_dicom_pixels(pixels, scan)
+                if preprocessed_img is None:
+                    slice_results.append(dict(info, error="Error processing slice"))
+                    continue
+                infos.append(info)
+                inputs.append(preprocessed_img)
+                masks.append(brain_mask)
+            if not inputs:
+                continue
+            
+            with stage("subclass", "inference"):
+                predictions = subclass_served.predict(np.concatenate(inputs))
+            for info, preprocessed_img, brain_mask, prediction in zip(infos, inputs, masks, predictions):
+                class_index = int(np.argmax(prediction))
+                probabilities.append(prediction)
+                slice_results.append(dict(
+                    info,
+                    prediction=CLASSES[class_index],
+                    confidence=round(float(prediction[class_index]) * 100, 2),
+                    class_probabilities={label: round(float(prob) * 100, 2) for label, prob in zip(CLASSES, prediction)}
+                ))
+                top_slices.push(prediction[class_index], (info["slice"], class_index, preprocessed_img, brain_mask))
+        
+        if not probabilities:
+            return jsonify({"error": "No readable DICOM slices found"}), 400
+        
+        # Volume-level aggregate: mean class probabilities over slices
+        mean_probs = np.mean(probabilities, axis=0)
+        volume_index = int(np.argmax(mean_probs))
+        volume = {
+            "prediction": CLASSES[volume_index],
+            "confidence": round(float(mean_probs[volume_index]) * 100, 2),
+            "class_probabilities": {label: round(float(prob) * 100, 2) for label, prob in zip(CLASSES, mean_probs)},
+            "slice_votes": {label: sum(1 for r in slice_results if r.get("prediction") == label) for label in CLASSES},
+            "slices": len(probabilities)
+        }
+        
+        # GradCAM only for the most confident slices, as one batch
+        top_results = []
+        candidates = top_slices.items()
+        if candidates:
+            batch = np.concatenate([preprocessed_img for _, _, preprocessed_img, _ in candidates])
+            class_indices = [class_index for _, class_index, _, _ in candidates]
             try:
-                os.remove(file_path)
-            except:
-                pass
+                _, cams = subclass_gradcam.explain(batch, class_indices=class_indices)
+            except Exception as e:
+                print(f"Error generating volume GradCAM: {e}")
+                count_error("subclass", "gradcam")
+                cams = None
+            for i, (slice_index, class_index, preprocessed_img, brain_mask) in enumerate(candidates):
+                if cams is not None:
+                    heatmap_id = save_gradcam_heatmap(cams[i], preprocessed_img, brain_mask)
+                else:
+                    heatmap_id = generate_fallback_gradcam(preprocessed_img, brain_mask)
+                top_results.append({"slice": slice_index, "heatmap_url": f"/gradcam_heatmap/{heatmap_id}"})
+        
+        return jsonify({
+            "volume": volume,
+            "slices": slice_results,
+            "top_slices": top_results
+        })
+    
+    except VolumeTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except Exception as e:
+        print(f"Error in volume prediction: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Volume prediction failed: {str(e)}"}), 500
+
+# Results for a batch of uploads from one model call (and one GradCAM pass if requested)
+def score_batch(items, heatmaps=False, options=None):
+    if options is None:
+        options = render_options(format="jpeg")
+    records, ready = [], []
+    for item in items:
+        if "error" in item:
+            records.append(result_record(item, error=item["error"]))
+            continue
+        try:
+            preprocessed_img, brain_mask = preprocess_upload(item["data"], file_extension(item["filename"]))
+        except Exception as e:
+            records.append(result_record(item, error=str(e)))
+            continue
+        ready.append((item, preprocessed_img, brain_mask))
+    if not ready:
+        return records
+    
+    batch = np.concatenate([preprocessed_img for _, preprocessed_img, _ in ready])
+    with stage("subclass", "inference"):
+        if heatmaps:
+            predictions, cams, _ = predict_and_explain(batch)
+        else:
+            predictions, cams = subclass_served.predict(batch), None
+    
+    for i, (item, preprocessed_img, brain_mask) in enumerate(ready):
+        class_index = int(np.argmax(predictions[i]))
+        fields = {
+            "prediction": CLASSES[class_index],
+            "confidence": round(float(predictions[i][class_index]) * 100, 2),
+            "class_probabilities": {label: round(float(prob) * 100, 2) for label, prob in zip(CLASSES, predictions[i])}
+        }
+        if heatmaps:
+            heatmap_id, fallback = store_prediction_heatmap(cams[i:i + 1] if cams is not None else None,
+                                                            preprocessed_img, class_index, brain_mask, options)
+            fields["heatmap_url"] = f"/gradcam_heatmap/{heatmap_id}"
+            if fallback:
+                fields["heatmap_fallback"] = True
+            if options["heatmap"] == "grid" and cams is not None:
+                fields.update(grid_fields(cams[i], options))
+        records.append(result_record(item, **fields))
+    return records
+
+# Batch endpoint: many images/DICOMs (or zip archives), one NDJSON line per file
+@app.route("/subclass_predict_batch", methods=["POST"])
+@upload_limit(MAX_BATCH_UPLOAD_BYTES)
+def subclass_predict_batch():
+    files = batch_files()
+    if not files:
+        return jsonify({"error": "No file uploaded"}), 400
+    
+    # GradCAM is opt-in so large batches only pay for inference
+    heatmaps = request.form.get("heatmaps", "false").lower() in ("1", "true", "yes")
+    options = render_options(request.form, format="jpeg")
+    return stream_batch(files, lambda items: score_batch(items, heatmaps, options))
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    return jsonify({"error": "Uploaded file is too large"}), 413
 
 # Heatmap endpoint
 @app.route("/gradcam_heatmap", methods=["GET"])
-def get_gradcam():
-    if os.path.exists(COMBINED_HEATMAP_PATH):
-        return send_file(COMBINED_HEATMAP_PATH, mimetype="image/jpeg")
-    elif os.path.exists(HEATMAP_PATH):
-        return send_file(HEATMAP_PATH, mimetype="image/jpeg")
+@app.route("/gradcam_heatmap/<heatmap_id>", methods=["GET"])
+def get_gradcam(heatmap_id=None):
+    stored = heatmap_store.get(heatmap_id) if heatmap_id else None
+    if stored is not None:
+        data, mimetype = stored
+        return Response(data, mimetype=mimetype, headers={"Cache-Control": "private, max-age=600"})
     
-    # If no heatmap exists, create a blank one
-    blank = np.ones((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8) * 255
-    cv2.putText(blank, "Heatmap unavailable", (10, IMG_SIZE//2),
-               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
-    cv2.imwrite(COMBINED_HEATMAP_PATH, blank)
-    return send_file(COMBINED_HEATMAP_PATH, mimetype="image/jpeg")
+    # Unknown or expired heatmap
+    blank = message_image("Heatmap unavailable")
+    return Response(encode_image(blank, render_options(format="jpeg")), status=404, mimetype="image/jpeg")
+
+@app.route("/health/live", methods=["GET"])
+def liveness():
+    return jsonify({"status": "alive"})
+
+# Ready once the model is loaded and warmed up
+@app.route("/health/ready", methods=["GET"])
+def readiness():
+    if not is_ready():
+        return jsonify({"status": "warming up"}), 503
+    return jsonify({"status": "ready", "warmup_seconds": warmup_state["seconds"]})
+
+@app.route("/health", methods=["GET"])
+def health_check():
+    return jsonify({
+        "status": "healthy",
+        "model": "VGG16 subclass model",
+        "backend": subclass_served.backend,
+        "result_cache": result_cache.stats(),
+        "heatmap_store": heatmap_store.stats()
+    })
 
 # Run server
 if __name__ == "__main__":
+    if WARMUP:
+        warmup()
     print("API running on http://127.0.0.1:5001")
-    serve(app, host="127.0.0.1", port=5001)
\ No newline at end of file
+    if SERVER_MODE == "async":
+        from async_server import serve_async
+        serve_async(app, host="127.0.0.1", port=5001)
+    else:
+        serve(app, host="127.0.0.1", port=5001)
\ No newline at end of file
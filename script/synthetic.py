@@ -0,0 +1,155 @@
+import io
+import os
+
+import cv2
+import numpy as np
+
+# Synthetic inputs for benchmarks: deterministic brain-like axial slices
+# encoded as JPEG/PNG and 8/12/16-bit DICOM, plus placeholder models
+BINARY_MODEL_FILE = "binary_epoch50.h5"
+SUBCLASS_MODEL_FILE = "VGG16_4_real_subclass.h5"
+INPUT_FORMATS = ("jpg", "png", "dcm8", "dcm12", "dcm16")
+
+
+def brain_slice(size=256, seed=0):
+    """uint8 grayscale slice: dark background, skull ring, textured brain, ventricles"""
+    rng = np.random.default_rng(seed)
+    img = np.zeros((size, size), np.float32)
+    center = (size // 2 + int(rng.integers(-size // 40, size // 40 + 1)), size // 2)
+    axes = (int(size * rng.uniform(0.33, 0.38)), int(size * rng.uniform(0.40, 0.45)))
+
+    cv2.ellipse(img, center, axes, 0, 0, 360, 170, -1)
+    inner = (int(axes[0] * 0.92), int(axes[1] * 0.92))
+    brain = np.zeros_like(img)
+    cv2.ellipse(brain, center, inner, 0, 0, 360, 1, -1)
+
+    # Gyri: a few random sinusoids give cortex-like folding
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    texture = np.zeros_like(img)
+    for _ in range(6):
+        fx, fy = rng.uniform(8, 24, 2)
+        phase = rng.uniform(0, 2 * np.pi)
+        texture += np.sin(2 * np.pi * (fx * xx + fy * yy) + phase)
+    img = np.where(brain > 0, 95 + 12 * texture, img)
+
+    for side in (-1, 1):
+        ventricle = (center[0] + side * axes[0] // 6, center[1])
+        cv2.ellipse(img, ventricle, (axes[0] // 10, axes[1] // 4), side * 10, 0, 360, 30, -1)
+
+    img += rng.normal(0, 6, img.shape).astype(np.float32)
+    img = cv2.GaussianBlur(img, (3, 3), 0)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def encode_image(gray, fmt="jpg", quality=90):
+    ext = ".jpg" if fmt == "jpg" else ".png"
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if fmt == "jpg" else []
+    ok, buffer = cv2.imencode(ext, cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), params)
+    if not ok:
+        raise ValueError(f"Could not encode synthetic {fmt} image")
+    return buffer.tobytes()
+
+
+def dicom_bytes(gray, bits=16, frames=1):
+    """Uncompressed MR DICOM of the slice with `bits` stored bits (8, 12 or 16)"""
+    from pydicom.dataset import FileDataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds = FileDataset("synthetic.dcm", {}, file_meta=meta, preamble=b"\0" * 128)
+    ds.Modality = "MR"
+    ds.Rows, ds.Columns = gray.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 8 if bits == 8 else 16
+    ds.BitsStored = bits
+    ds.HighBit = bits - 1
+    ds.PixelRepresentation = 0
+
+    if bits == 8:
+        pixels = gray
+    else:
+        pixels = (gray.astype(np.uint32) * ((1 << bits) - 1) // 255).astype(np.uint16)
+    if frames > 1:
+        ds.NumberOfFrames = frames
+        pixels = np.stack([pixels] * frames)
+    ds.PixelData = pixels.tobytes()
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+
+    output = io.BytesIO()
+    ds.save_as(output, write_like_original=False)
+    return output.getvalue()
+
+
+def encode_input(gray, fmt):
+    """(filename extension, bytes) of the slice in one of INPUT_FORMATS"""
+    if fmt in ("jpg", "png"):
+        return fmt, encode_image(gray, fmt)
+    if fmt.startswith("dcm"):
+        return "dcm", dicom_bytes(gray, bits=int(fmt[3:]))
+    raise ValueError(f"Unknown input format: {fmt}")
+
+
+def synthetic_inputs(sizes=(256, 512), formats=INPUT_FORMATS, per_combination=2, seed=0):
+    """List of (filename, bytes), the same for the same arguments"""
+    inputs = []
+    for size in sizes:
+        for index in range(per_combination):
+            gray = brain_slice(size, seed=seed + size * 1000 + index)
+            for fmt in formats:
+                ext, data = encode_input(gray, fmt)
+                inputs.append((f"synthetic_{size}_{index}_{fmt}.{ext}", data))
+    return inputs
+
+
+def write_inputs(directory, **kwargs):
+    os.makedirs(directory, exist_ok=True)
+    inputs = synthetic_inputs(**kwargs)
+    for filename, data in inputs:
+        with open(os.path.join(directory, filename), "wb") as f:
+            f.write(data)
+    return [filename for filename, _ in inputs]
+
+
+def ensure_models(directory):
+    """Write small untrained stand-ins for missing model files; returns the ones written.
+
+    They have the same inputs, outputs and layer structure the services
+    expect (a nested `vgg16` for the subclass model), so every code path
+    runs, but their scores are meaningless.
+    """
+    import tensorflow as tf
+
+    written = []
+    binary_path = os.path.join(directory, BINARY_MODEL_FILE)
+    if not os.path.exists(binary_path):
+        tf.keras.utils.set_random_seed(0)
+        inputs = tf.keras.layers.Input(shape=(256, 256, 3))
+        x = tf.keras.layers.Conv2D(16, (3, 3), activation="relu", padding="same")(inputs)
+        x = tf.keras.layers.MaxPooling2D((4, 4))(x)
+        x = tf.keras.layers.Conv2D(32, (3, 3), activation="relu", padding="same")(x)
+        x = tf.keras.layers.MaxPooling2D((4, 4))(x)
+        x = tf.keras.layers.Flatten()(x)
+        outputs = tf.keras.layers.Dense(1, activation="sigmoid")(x)
+        tf.keras.Model(inputs, outputs).save(binary_path)
+        written.append(binary_path)
+
+    subclass_path = os.path.join(directory, SUBCLASS_MODEL_FILE)
+    if not os.path.exists(subclass_path):
+        tf.keras.utils.set_random_seed(0)
+        base = tf.keras.applications.VGG16(include_top=False, weights=None, input_shape=(128, 128, 3))
+        model = tf.keras.Sequential([
+            base,
+            tf.keras.layers.GlobalAveragePooling2D(),
+            tf.keras.layers.Dense(4, activation="softmax"),
+        ])
+        model.save(subclass_path)
+        written.append(subclass_path)
+
+    for path in written:
+        print(f"WARNING: wrote placeholder model {path}; predictions are not meaningful")
+    return written
@@ -0,0 +1,74 @@
+import os
+import threading
+
+import numpy as np
+
+TFLITE_MODES = ("dynamic", "float16", "int8")
+TFLITE_THREADS = int(os.environ.get("TFLITE_THREADS", 0)) or None
+
+
+def tflite_path(model_path, mode):
+    """Where export_tflite.py writes the `mode` conversion of a .h5 model"""
+    return f"{os.path.splitext(model_path)[0]}.{mode}.tflite"
+
+
+class TFLiteModel:
+    """Batch prediction with a TFLite interpreter.
+
+    The interpreter is not thread-safe, so calls are serialised; the input
+    tensor is resized when the batch size changes. Quantized integer inputs
+    and outputs are converted using the tensors' scale and zero point.
+    """
+
+    def __init__(self, path, num_threads=TFLITE_THREADS):
+        import tensorflow as tf
+        self.path = path
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        self._lock = threading.Lock()
+
+    @property
+    def input_shape(self):
+        return tuple(int(dim) for dim in self._input["shape_signature"])
+
+    def predict(self, batch):
+        batch = self._quantize(np.asarray(batch, dtype=np.float32))
+        with self._lock:
+            if len(batch) != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input["index"], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self.interpreter.set_tensor(self._input["index"], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output["index"]).copy()
+        return self._dequantize(output)
+
+    def _quantize(self, batch):
+        dtype = self._input["dtype"]
+        if dtype == np.float32:
+            return batch
+        scale, zero_point = self._input["quantization"]
+        info = np.iinfo(dtype)
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def _dequantize(self, output):
+        if output.dtype == np.float32:
+            return output
+        scale, zero_point = self._output["quantization"]
+        return (output.astype(np.float32) - zero_point) * scale
+
+
+def load_tflite(model_path, mode):
+    """TFLiteModel for the exported `mode` of a model, or None if it is missing"""
+    path = tflite_path(model_path, mode)
+    if not os.path.exists(path):
+        print(f"No {mode} TFLite export at {path}; using the Keras model")
+        return None
+    try:
+        return TFLiteModel(path)
+    except Exception as e:
+        print(f"Error loading TFLite model {path}: {e}")
+        return None
@@ -0,0 +1,104 @@
+import os
+import io
+
+import cv2
+import numpy as np
+from flask import Request, current_app
+
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", 32)) * 1024 * 1024)
+# Whole-request limit for endpoints that take many files (see upload_limit)
+MAX_BATCH_UPLOAD_BYTES = int(float(os.environ.get("MAX_BATCH_UPLOAD_MB", 512)) * 1024 * 1024)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+DICOM_EXTENSIONS = (".dcm",)
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UndecodableImage(ValueError):
+    pass
+
+
+class InMemoryRequest(Request):
+    """Request whose multipart file parts are buffered in memory.
+
+    Werkzeug spools parts larger than 500 KB to temporary files; the total
+    request size is already capped by MAX_CONTENT_LENGTH, so keep them in RAM.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+    @property
+    def max_content_length(self):
+        # Views marked with upload_limit() accept larger bodies
+        view = current_app.view_functions.get(self.endpoint) if current_app and self.endpoint else None
+        limit = getattr(view, "max_upload_bytes", None)
+        if limit is not None:
+            return limit + 64 * 1024
+        return super().max_content_length
+
+
+def configure_app(app, max_bytes=MAX_UPLOAD_BYTES):
+    """Keep uploads in memory and reject oversized bodies while streaming"""
+    app.request_class = InMemoryRequest
+    # Leave room for the multipart framing and other form fields
+    app.config["MAX_CONTENT_LENGTH"] = max_bytes + 64 * 1024
+
+
+def upload_limit(max_bytes):
+    """Decorator raising the request body limit of one view"""
+    def decorator(view):
+        view.max_upload_bytes = max_bytes
+        return view
+    return decorator
+
+
+def file_extension(filename):
+    return os.path.splitext(filename or "")[-1].lower()
+
+
+def read_upload(file_storage, max_bytes=MAX_UPLOAD_BYTES):
+    """Read an uploaded file's bytes, stopping as soon as the limit is passed"""
+    chunks = []
+    total = 0
+    while True:
+        chunk = file_storage.stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(f"File exceeds the {round(max_bytes / (1024 * 1024), 2):g} MB upload limit")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def decode_image(data):
+    """Decode JPEG/PNG bytes to a BGR uint8 array, or None if undecodable"""
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+def resize_rgb(image_bgr, size):
+    """BGR image to RGB at size x size.
+
+    Uses the PIL-compatible nearest-neighbour filter so results match the
+    previous keras `load_img(target_size=...)` path.
+    """
+    return resize_rgb_sizes(image_bgr, (size,))[size]
+
+
+def resize_rgb_sizes(image_bgr, sizes):
+    """One BGR->RGB conversion resized to each of `sizes`, as {size: image}"""
+    image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+    resized = {}
+    for size in sizes:
+        if image_rgb.shape[:2] == (size, size):
+            resized[size] = image_rgb
+        else:
+            resized[size] = cv2.resize(image_rgb, (size, size), interpolation=cv2.INTER_NEAREST_EXACT)
+    return resized
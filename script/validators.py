@@ -0,0 +1,179 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+VALID_MESSAGE = "Valid MRI image"
+INVALID_MESSAGE = "The uploaded image does not appear to be an MRI scan"
+
+ROBOFLOW_API_URL = os.environ.get("ROBOFLOW_API_URL", "https://detect.roboflow.com")
+ROBOFLOW_API_KEY = os.environ.get("ROBOFLOW_API_KEY", "Uv31TiRmfGZBE4y9mLLE")
+ROBOFLOW_MODEL_ID = os.environ.get("ROBOFLOW_MODEL_ID", "noisy-data/2")
+
+
+class MriValidator:
+    """Decides whether a decoded BGR image looks like an MRI scan"""
+
+    name = "base"
+
+    def validate(self, image_bgr):
+        """Return (is_mri, message)"""
+        raise NotImplementedError
+
+
+class RoboflowValidator(MriValidator):
+    """Hosted Roboflow `noisy-data` detector (one HTTPS call per image)"""
+
+    name = "remote"
+
+    def __init__(self, api_url=ROBOFLOW_API_URL, api_key=ROBOFLOW_API_KEY, model_id=ROBOFLOW_MODEL_ID):
+        # Imported here so local backends do not need the SDK
+        from inference_sdk import InferenceHTTPClient
+        self.client = InferenceHTTPClient(api_url=api_url, api_key=api_key)
+        self.model_id = model_id
+
+    def validate(self, image_bgr):
+        result = self.client.infer(image_bgr, model_id=self.model_id)
+        if "predictions" in result and len(result["predictions"]) > 0:
+            return True, VALID_MESSAGE
+        return False, INVALID_MESSAGE
+
+
+class HeuristicValidator(MriValidator):
+    """In-process checks for the look of a brain MRI slice.
+
+    MRI slices are (near) grayscale, have a dark background around the head
+    and a bright, textured foreground covering a reasonable share of the
+    frame. Photos, documents and screenshots usually fail one of these.
+    """
+
+    name = "heuristic"
+
+    def __init__(self, max_color_diff=12.0, max_border_mean=60.0,
+                 min_foreground=0.08, max_foreground=0.95, min_foreground_std=8.0):
+        self.max_color_diff = max_color_diff
+        self.max_border_mean = max_border_mean
+        self.min_foreground = min_foreground
+        self.max_foreground = max_foreground
+        self.min_foreground_std = min_foreground_std
+
+    def validate(self, image_bgr):
+        small = cv2.resize(image_bgr, (128, 128), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+        # Color saturation: grayscale scans have near-identical channels
+        color_diff = max(np.abs(small[..., 0] - small[..., 1]).mean(),
+                         np.abs(small[..., 1] - small[..., 2]).mean())
+        if color_diff > self.max_color_diff:
+            return False, INVALID_MESSAGE
+
+        gray = small.mean(axis=-1)
+        border = np.concatenate([gray[:10].ravel(), gray[-10:].ravel(), gray[:, :10].ravel(), gray[:, -10:].ravel()])
+        if border.mean() > self.max_border_mean:
+            return False, INVALID_MESSAGE
+
+        foreground = gray > 15
+        fraction = foreground.mean()
+        if not self.min_foreground <= fraction <= self.max_foreground:
+            return False, INVALID_MESSAGE
+        if gray[foreground].std() < self.min_foreground_std:
+            return False, INVALID_MESSAGE
+        return True, VALID_MESSAGE
+
+
+class KerasValidator(MriValidator):
+    """Small in-process binary classifier (Keras .h5/SavedModel) scoring MRI-ness"""
+
+    name = "keras"
+
+    def __init__(self, model_path, threshold=0.5):
+        import tensorflow as tf
+        self.model = tf.keras.models.load_model(model_path, compile=False)
+        self.input_size = tuple(self.model.input_shape[1:3])
+        self.threshold = threshold
+        self._lock = threading.Lock()
+
+    def validate(self, image_bgr):
+        img = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+        img = cv2.resize(img, (self.input_size[1], self.input_size[0]), interpolation=cv2.INTER_AREA)
+        batch = img[np.newaxis].astype(np.float32) / 255.0
+        with self._lock:
+            score = float(np.ravel(self.model(batch, training=False))[0])
+        return (True, VALID_MESSAGE) if score >= self.threshold else (False, INVALID_MESSAGE)
+
+
+class StubValidator(MriValidator):
+    """Accepts every image after an optional fixed delay (benchmarks, offline runs)"""
+
+    name = "stub"
+
+    def __init__(self, delay_ms=0.0):
+        self.delay_ms = delay_ms
+
+    def validate(self, image_bgr):
+        if self.delay_ms > 0:
+            time.sleep(self.delay_ms / 1000.0)
+        return True, VALID_MESSAGE
+
+
+class CachedValidator:
+    """Remembers validation results by upload content hash (LRU)"""
+
+    def __init__(self, backend, max_entries=1024):
+        self.backend = backend
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    def validate(self, image_bgr, content_key=None):
+        if content_key is not None:
+            with self._lock:
+                result = self._results.get(content_key)
+                if result is not None:
+                    self._results.move_to_end(content_key)
+                    self.hits += 1
+                    return result
+
+        # Errors propagate and are not cached
+        result = self.backend.validate(image_bgr)
+        if content_key is not None:
+            with self._lock:
+                self.misses += 1
+                self._results[content_key] = result
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {"backend": self.name, "entries": len(self._results),
+                    "hits": self.hits, "misses": self.misses}
+
+
+def create_validator(kind=None, max_entries=None):
+    """Validator selected by MRI_VALIDATOR: remote (default), heuristic, keras or stub"""
+    kind = (kind or os.environ.get("MRI_VALIDATOR", "remote")).lower()
+    if max_entries is None:
+        max_entries = int(os.environ.get("VALIDATION_CACHE_SIZE", 1024))
+
+    if kind in ("heuristic", "local"):
+        backend = HeuristicValidator()
+    elif kind == "keras":
+        backend = KerasValidator(os.environ.get("MRI_VALIDATOR_MODEL", "mri_validator.h5"),
+                                 threshold=float(os.environ.get("MRI_VALIDATOR_THRESHOLD", 0.5)))
+    elif kind == "stub":
+        # MRI_VALIDATOR_STUB_MS stands in for the remote call's latency
+        backend = StubValidator(float(os.environ.get("MRI_VALIDATOR_STUB_MS", 0)))
+    elif kind == "remote":
+        backend = RoboflowValidator()
+    else:
+        raise ValueError(f"Unknown MRI validator: {kind}")
+    return CachedValidator(backend, max_entries=max_entries)
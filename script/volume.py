@@ -0,0 +1,140 @@
+import os
+import io
+import heapq
+import zipfile
+
+import numpy as np
+from pydicom import dcmread
+
+from dicom_loader import DicomScan
+from uploads import MAX_UPLOAD_BYTES
+
+VOLUME_BATCH_SIZE = int(os.environ.get("VOLUME_BATCH_SIZE", 16))
+VOLUME_TOP_K = int(os.environ.get("VOLUME_TOP_K", 3))
+VOLUME_MAX_SLICES = int(os.environ.get("VOLUME_MAX_SLICES", 1024))
+# Total uncompressed size of a zipped series
+VOLUME_MAX_BYTES = int(float(os.environ.get("VOLUME_MAX_MB", 512)) * 1024 * 1024)
+ARCHIVE_EXTENSIONS = (".zip",)
+
+
+class VolumeTooLarge(Exception):
+    pass
+
+
+def slice_position(header):
+    """Position of a slice along its normal (ImagePositionPatient projected on
+    the cross product of ImageOrientationPatient), or None if not recorded"""
+    try:
+        orientation = [float(value) for value in header.ImageOrientationPatient]
+        position = [float(value) for value in header.ImagePositionPatient]
+        normal = np.cross(orientation[:3], orientation[3:])
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return float(np.dot(normal, position)) if len(position) == 3 else None
+
+
+def anatomical_key(archive, info):
+    """Sort key for a series member: slice position, then InstanceNumber, then filename"""
+    try:
+        with archive.open(info) as fp:
+            header = dcmread(fp, stop_before_pixels=True, force=True)
+        position = slice_position(header)
+        instance = header.get("InstanceNumber")
+        instance = int(instance) if instance is not None else None
+    except Exception:
+        position, instance = None, None
+    return (position is None, position or 0.0, instance is None, instance or 0, info.filename)
+
+
+def iter_dicom_sources(data, filename, max_members=VOLUME_MAX_SLICES, max_bytes=VOLUME_MAX_BYTES):
+    """Yield (name, bytes) for a single DICOM file or each member of a zip series.
+
+    Members are ordered anatomically (by slice position, then InstanceNumber,
+    then filename) from their headers alone. Sizes are checked from the zip
+    directory before anything is inflated: members over the upload limit
+    are skipped and a series over `max_bytes` in total is rejected.
+    """
+    if os.path.splitext(filename or "")[-1].lower() in ARCHIVE_EXTENSIONS or zipfile.is_zipfile(io.BytesIO(data)):
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            members = []
+            for info in archive.infolist():
+                if info.is_dir() or os.path.basename(info.filename).startswith("."):
+                    continue
+                if info.file_size > MAX_UPLOAD_BYTES:
+                    print(f"Skipping {info.filename}: exceeds the upload limit")
+                    continue
+                members.append(info)
+            if len(members) > max_members:
+                raise VolumeTooLarge(f"Volume has more than {max_members} slices")
+            if sum(info.file_size for info in members) > max_bytes:
+                raise VolumeTooLarge(f"Volume exceeds {max_bytes // (1024 * 1024)} MB uncompressed")
+
+            for info in sorted(members, key=lambda info: anatomical_key(archive, info)):
+                # Members are read one at a time so only one slice file is inflated
+                yield info.filename, archive.read(info)
+    else:
+        yield filename, data
+
+
+def iter_slices(data, filename, max_slices=VOLUME_MAX_SLICES):
+    """Yield slice metadata, stored pixels and DicomScan for every frame of every DICOM source.
+
+    Uncompressed pixel data is viewed frame by frame without decoding the
+    whole volume; compressed data is decoded by pydicom.
+    """
+    index = 0
+    for source, source_bytes in iter_dicom_sources(data, filename):
+        try:
+            scan = DicomScan(source_bytes)
+            if not scan.has_pixels:
+                continue
+        except Exception as e:
+            print(f"Skipping {source}: {e}")
+            continue
+
+        instance_number = scan.header.get("InstanceNumber")
+        for frame_index, pixels in enumerate(scan.pixels()):
+            if index >= max_slices:
+                raise VolumeTooLarge(f"Volume has more than {max_slices} slices")
+            yield {
+                "slice": index,
+                "source": source,
+                "frame": frame_index,
+                "instance_number": int(instance_number) if instance_number is not None else None,
+            }, pixels, scan
+            index += 1
+
+
+def batched(items, batch_size=VOLUME_BATCH_SIZE):
+    """Group an iterable into lists of up to batch_size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class TopK:
+    """Keeps the k highest-scoring items seen while streaming"""
+
+    def __init__(self, k=VOLUME_TOP_K):
+        self.k = max(0, int(k))
+        self._heap = []
+        self._counter = 0
+
+    def push(self, score, item):
+        if self.k == 0:
+            return
+        entry = (float(score), self._counter, item)
+        self._counter += 1
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def items(self):
+        """Items ordered from highest to lowest score"""
+        return [item for _, _, item in sorted(self._heap, key=lambda e: (-e[0], e[1]))]
@@ -0,0 +1,336 @@
+import os
+import time
+import queue
+import itertools
+import importlib
+import threading
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import Future
+
+import numpy as np
+
+WORKER_SLOT_MB = float(os.environ.get("WORKER_SLOT_MB", 8))
+WORKER_TIMEOUT = float(os.environ.get("WORKER_TIMEOUT", 60))
+# How long a request waits for a free slot before PoolBusy (503)
+WORKER_SLOT_WAIT = float(os.environ.get("WORKER_SLOT_WAIT", 0.05))
+# Seconds between checks for dead workers, busy or idle
+WORKER_CHECK_INTERVAL = float(os.environ.get("WORKER_CHECK_INTERVAL", 1))
+SLOT_ALIGN = 64
+
+# Model name -> service module imported by each worker
+SERVICE_MODULES = {"binary": "app", "subclass": "subclass"}
+
+
+class PoolBusy(Exception):
+    pass
+
+
+class WorkerError(Exception):
+    pass
+
+
+def default_thread_counts(num_workers):
+    """(intra_op, inter_op) TensorFlow threads per worker so the pool uses every core once"""
+    cores = os.cpu_count() or 1
+    intra = int(os.environ.get("WORKER_INTRA_THREADS", 0)) or max(1, cores // max(1, num_workers))
+    inter = int(os.environ.get("WORKER_INTER_THREADS", 0)) or 1
+    return intra, inter
+
+
+def pack(buf, offset, capacity, items):
+    """Copy arrays and byte strings into buf[offset:offset + capacity].
+
+    Returns the layout needed to read them back, or None if they do not fit.
+    """
+    layout = []
+    position = 0
+    for name, value in items.items():
+        if value is None:
+            continue
+        if isinstance(value, (bytes, bytearray)):
+            kind, data = "bytes", np.frombuffer(value, dtype=np.uint8)
+        else:
+            kind, data = "array", np.ascontiguousarray(value)
+        if position + data.nbytes > capacity:
+            return None
+        target = np.ndarray(data.shape, dtype=data.dtype, buffer=buf, offset=offset + position)
+        target[...] = data
+        layout.append((name, kind, data.dtype.str, data.shape, position))
+        position += -(-data.nbytes // SLOT_ALIGN) * SLOT_ALIGN
+    return layout
+
+
+def unpack(buf, offset, layout):
+    """Copies of the items described by `layout` (the slot is reused afterwards)"""
+    items = {}
+    for name, kind, dtype, shape, position in layout:
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=buf, offset=offset + position)
+        items[name] = view.tobytes() if kind == "bytes" else view.copy()
+    return items
+
+
+# Tasks run inside the workers
+def binary_task(service, inputs, params):
+    """Score and Grad-CAM explanation for one preprocessed image.
+
+    The encoded image (base64) goes through shared memory; the other
+    explanation fields (mime type, or a small Grad-CAM grid) through meta.
+    """
+    preprocessed_img, original_img = inputs["input"], inputs["original"]
+    outputs = {}
+    cam, layer_name = None, None
+    if params.get("mode") == "gradcam":
+        layer_name = params.get("layer_name")
+    else:
+        prediction, cams = service.run_binary_batch(preprocessed_img)
+        outputs["scores"] = np.asarray(prediction, dtype=np.float32)
+        cam = cams[0] if cams is not None else None
+    fields = service.gradcam_fields(cam, preprocessed_img, original_img, params["options"], layer_name)
+    outputs["gradcam"] = (fields.pop("gradcam_visualization", None) or "").encode("ascii")
+    return outputs, fields
+
+
+def subclass_task(service, inputs, params):
+    """Class scores, encoded heatmap and optional per-class heatmaps (base64)"""
+    preprocessed_img, brain_mask = inputs["input"], inputs.get("brain_mask")
+    all_classes = params.get("all_classes", False)
+    prediction, cams, class_cams = service.predict_and_explain(preprocessed_img, all_classes)
+    class_index = int(np.argmax(prediction[0]))
+
+    heatmap_id, fallback = service.store_prediction_heatmap(cams, preprocessed_img, class_index, brain_mask,
+                                                              params["options"])
+    heatmap, mimetype = service.heatmap_store.pop(heatmap_id)
+    outputs = {"scores": np.asarray(prediction[0], dtype=np.float32), "heatmap": heatmap}
+    meta = {"heatmap_mime_type": mimetype, "heatmap_fallback": fallback, "class_heatmaps": False}
+    if params["options"]["heatmap"] == "grid" and cams is not None:
+        meta["grid"] = service.grid_fields(cams[0], params["options"])
+    if all_classes and class_cams is not None:
+        class_heatmaps = service.encode_class_heatmaps(class_cams, service.CLASSES, preprocessed_img,
+                                                       brain_mask, params["options"])
+        for label, encoded in class_heatmaps.items():
+            outputs[f"class:{label}"] = encoded.encode("ascii")
+        meta["class_heatmaps"] = True
+    return outputs, meta
+
+
+TASKS = {"binary": binary_task, "subclass": subclass_task}
+
+
+def worker_main(worker_id, model_names, shm_name, slot_bytes, tasks, results, intra_threads, inter_threads, warmup):
+    # Thread pools have to be sized before TensorFlow and TFLite start
+    os.environ["OMP_NUM_THREADS"] = str(intra_threads)
+    os.environ["TFLITE_THREADS"] = str(intra_threads)
+    import cv2
+    cv2.setNumThreads(1)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_threads)
+
+    from registry import registry
+    services = {}
+    for name in model_names:
+        services[name] = importlib.import_module(SERVICE_MODULES[name])
+        if warmup:
+            services[name].warmup()
+    versions = {name: f"{registry.get(name).version}:{registry.get(name).backend}" for name in model_names}
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    results.put(("ready", worker_id, versions))
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            task_id, model_name, slot, layout, params = task
+            results.put(("busy", worker_id, task_id))
+            offset = slot * slot_bytes
+            try:
+                inputs = unpack(shm.buf, offset, layout)
+                outputs, meta = TASKS[model_name](services[model_name], inputs, params)
+                # Results go back through the same slot; oversized ones are pickled
+                output_layout = pack(shm.buf, offset, slot_bytes, outputs)
+                if output_layout is None:
+                    results.put(("inline", task_id, outputs, meta))
+                else:
+                    results.put(("ok", task_id, output_layout, meta))
+            except Exception as e:
+                traceback.print_exc()
+                results.put(("error", task_id, str(e), None))
+    finally:
+        shm.close()
+
+
+class WorkerPool:
+    """Pre-started model worker processes fed through shared-memory slots.
+
+    The front end preprocesses an upload, copies the tensors into a free
+    slot of one shared block and queues a small task message; any idle
+    worker runs the model and writes its outputs (scores, encoded heatmaps)
+    back into the same slot. Only slot numbers and layouts are pickled.
+    """
+
+    def __init__(self, num_workers, model_names=tuple(SERVICE_MODULES), slot_mb=WORKER_SLOT_MB,
+                 slots=None, warmup=True):
+        self.num_workers = max(1, int(num_workers))
+        self.model_names = tuple(model_names)
+        self.slot_bytes = int(slot_mb * 1024 * 1024)
+        self.num_slots = slots or self.num_workers * 2
+        self.intra_threads, self.inter_threads = default_thread_counts(self.num_workers)
+        self.warmup = warmup
+
+        # Workers start from a fresh interpreter: TensorFlow is not fork-safe
+        self._context = mp.get_context("spawn")
+        self.shm = shared_memory.SharedMemory(create=True, size=self.num_slots * self.slot_bytes)
+        self._free_slots = queue.Queue()
+        for slot in range(self.num_slots):
+            self._free_slots.put(slot)
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending = {}
+        self._running = {}
+        self.versions = {}
+        self.ready_workers = set()
+        self.completed = 0
+        self.errors = 0
+        self.restarts = 0
+        self._closed = False
+
+        self._processes = [self._start_worker(worker_id) for worker_id in range(self.num_workers)]
+        self._collector = threading.Thread(target=self._collect, name="pool-results", daemon=True)
+        self._collector.start()
+
+    def _start_worker(self, worker_id):
+        process = self._context.Process(
+            target=worker_main,
+            args=(worker_id, self.model_names, self.shm.name, self.slot_bytes, self._tasks, self._results,
+                  self.intra_threads, self.inter_threads, self.warmup),
+            name=f"model-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def is_ready(self):
+        with self._lock:
+            return len(self.ready_workers) == self.num_workers
+
+    def submit(self, model_name, inputs, params, slot_wait=WORKER_SLOT_WAIT):
+        """Queue a task; returns a Future of (outputs, meta).
+        Raises PoolBusy if no slot frees up within `slot_wait` seconds"""
+        try:
+            slot = self._free_slots.get(timeout=slot_wait) if slot_wait > 0 else self._free_slots.get_nowait()
+        except queue.Empty:
+            raise PoolBusy("All worker slots are in use")
+
+        layout = pack(self.shm.buf, slot * self.slot_bytes, self.slot_bytes, inputs)
+        if layout is None:
+            self._free_slots.put(slot)
+            raise ValueError("Input does not fit in a worker slot (raise WORKER_SLOT_MB)")
+
+        future = Future()
+        task_id = next(self._ids)
+        with self._lock:
+            self._pending[task_id] = (future, slot)
+        self._tasks.put((task_id, model_name, slot, layout, params))
+        return future
+
+    def run(self, model_name, inputs, params, timeout=WORKER_TIMEOUT):
+        return self.submit(model_name, inputs, params).result(timeout)
+
+    def _collect(self):
+        next_check = time.monotonic() + WORKER_CHECK_INTERVAL
+        while not self._closed:
+            # Dead workers are noticed on schedule even while results keep arriving
+            if time.monotonic() >= next_check:
+                self._check_workers()
+                next_check = time.monotonic() + WORKER_CHECK_INTERVAL
+            try:
+                message = self._results.get(timeout=max(0.01, next_check - time.monotonic()))
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            kind = message[0]
+            if kind == "ready":
+                _, worker_id, versions = message
+                with self._lock:
+                    self.ready_workers.add(worker_id)
+                    self.versions.update(versions)
+                continue
+            if kind == "busy":
+                _, worker_id, task_id = message
+                with self._lock:
+                    self._running[worker_id] = task_id
+                continue
+
+            _, task_id, payload, meta = message
+            with self._lock:
+                future, slot = self._pending.pop(task_id, (None, None))
+                for worker_id, running in list(self._running.items()):
+                    if running == task_id:
+                        del self._running[worker_id]
+            if future is None:
+                continue
+            try:
+                if kind == "ok":
+                    future.set_result((unpack(self.shm.buf, slot * self.slot_bytes, payload), meta))
+                    self.completed += 1
+                elif kind == "inline":
+                    future.set_result((payload, meta))
+                    self.completed += 1
+                else:
+                    self.errors += 1
+                    future.set_exception(WorkerError(payload))
+            finally:
+                self._free_slots.put(slot)
+
+    def _check_workers(self):
+        """Restart dead workers and fail the task each was running"""
+        for worker_id, process in enumerate(self._processes):
+            if process.is_alive() or self._closed:
+                continue
+            print(f"Model worker {worker_id} exited ({process.exitcode}), restarting")
+            with self._lock:
+                self.ready_workers.discard(worker_id)
+                task_id = self._running.pop(worker_id, None)
+                future, slot = self._pending.pop(task_id, (None, None))
+            if future is not None:
+                self.errors += 1
+                future.set_exception(WorkerError("Model worker exited while processing the request"))
+                self._free_slots.put(slot)
+            self.restarts += 1
+            self._processes[worker_id] = self._start_worker(worker_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.num_workers,
+                "ready_workers": len(self.ready_workers),
+                "models": list(self.model_names),
+                "intra_op_threads": self.intra_threads,
+                "inter_op_threads": self.inter_threads,
+                "slots": self.num_slots,
+                "slot_mb": round(self.slot_bytes / (1024 * 1024), 2),
+                "slots_in_use": self.num_slots - self._free_slots.qsize(),
+                "in_flight": len(self._pending),
+                "completed": self.completed,
+                "errors": self.errors,
+                "restarts": self.restarts,
+            }
+
+    def close(self):
+        self._closed = True
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.shm.close()
+        self.shm.unlink()